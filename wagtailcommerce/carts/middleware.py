@@ -0,0 +1,16 @@
+from .utils import set_request_cart
+
+
+class CartMiddleware(object):
+    """
+    Set request.cart, loaded on first access. Must come after the session,
+    authentication and store middleware.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        set_request_cart(request)
+        response = self.get_response(request)
+
+        return response
@@ -0,0 +1,34 @@
+# Generated by Django 2.2.5 on 2026-10-18 09:11
+
+from django.db import migrations
+from django.db.models import Count, Min, Sum
+
+
+def forwards_func(apps, schema_editor):
+    # Merge lines of the same variant in a cart into the oldest one
+    CartLine = apps.get_model('wagtailcommerce_carts', 'CartLine')
+    db_alias = schema_editor.connection.alias
+
+    duplicates = CartLine.objects.using(db_alias).filter(variant__isnull=False).values(
+        'cart_id', 'variant_id').annotate(count=Count('pk'), first_pk=Min('pk'), total_quantity=Sum('quantity')).filter(count__gt=1)
+
+    for duplicate in duplicates.order_by():
+        lines = CartLine.objects.using(db_alias).filter(cart_id=duplicate['cart_id'], variant_id=duplicate['variant_id'])
+
+        lines.filter(pk=duplicate['first_pk']).update(quantity=duplicate['total_quantity'])
+        lines.exclude(pk=duplicate['first_pk']).delete()
+
+
+def reverse_func(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcommerce_carts', '0006_auto_20190910_1353'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards_func, reverse_func),
+    ]
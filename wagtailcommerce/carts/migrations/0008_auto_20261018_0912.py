@@ -0,0 +1,17 @@
+# Generated by Django 2.2.5 on 2026-10-18 09:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcommerce_carts', '0007_merge_duplicate_cart_lines'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='cartline',
+            unique_together={('cart', 'variant')},
+        ),
+    ]
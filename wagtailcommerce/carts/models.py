@@ -1,17 +1,16 @@
 from __future__ import absolute_import, unicode_literals
 
-from decimal import Decimal
 from uuid import uuid4
 
 from django.conf import settings
-from django.contrib.contenttypes.models import ContentType
 from django.db import models
+from django.utils.functional import cached_property
 from django.utils.translation import pgettext_lazy
 from django.utils.translation import ugettext_lazy as _
 
-from wagtailcommerce.products.models import Product
-from wagtailcommerce.promotions.models import Coupon
+from wagtailcommerce.carts.pricing import price_cart, price_shipping
 from wagtailcommerce.shipping.utils import get_shipping_cost as get_shipping_cost_util
+from wagtailcommerce.utils.query import PrefetchSpecificMixin
 
 
 class CartQueryset(models.QuerySet):
@@ -63,6 +62,13 @@ class CartQueryset(models.QuerySet):
         """
         return self.filter(status=Cart.PAID)
 
+    def with_lines(self):
+        """
+        Prefetch lines with their variants and products, which pricing reuses.
+        """
+        return self.prefetch_related(models.Prefetch(
+            'lines', queryset=CartLine.objects.select_related('variant', 'variant__product')))
+
 
 class Cart(models.Model):
     OPEN = 'open'
@@ -97,96 +103,82 @@ class Cart(models.Model):
     def __str__(self):
         return "{}".format(self.pk)
 
-    def get_subtotal(self):
-        subtotal = Decimal('0')
-
-        for line in self.lines.all():
-            subtotal += line.get_item_unit_price() * Decimal(line.quantity)
-
-        return subtotal
+    def save(self, *args, **kwargs):
+        self.invalidate_pricing()
+        super().save(*args, **kwargs)
 
-    def get_total(self, address=None):
+    def get_pricing(self, shipping_address=None, shipping_method=None):
         """
-        Get final including shipping (if address is supplied),
-        discounts taxes and product base cost.
-        """
-        total = self.get_subtotal() - self.get_promotions_discount()
+        Return the cart's CartPricing, including shipping if both shipping_address
+        and shipping_method are supplied.
 
-        if address:
-            total += self.get_shipping_cost(address)
+        Results are kept on the instance until invalidate_pricing() is called,
+        so every total and line price read during a request shares one pass.
+        """
+        if bool(shipping_address) != bool(shipping_method):
+            raise ValueError('shipping_address and shipping_method must be supplied together')
 
-        return total
+        if not hasattr(self, '_pricing_cache'):
+            self._pricing_cache = {}
 
-    def get_promotions_discount(self):
-        if self.coupon:
-            if self.coupon.coupon_type == Coupon.ORDER_TOTAL and self.coupon.coupon_mode == Coupon.COUPON_MODE_PERCENTAGE:
-                if not self.coupon.categories:
-                    subtotal = self.get_subtotal()
-                    return subtotal * (self.coupon.coupon_amount / 100)
-                else:
-                    discounted_product_ids = Product.objects.filter(categories__in=self.coupon.categories.values_list('pk', flat=True)).values_list('pk', flat=True)
+        if None not in self._pricing_cache:
+            self._pricing_cache[None] = price_cart(self)
 
-                    total_discount = Decimal('0')
+        if not (shipping_address and shipping_method):
+            return self._pricing_cache[None]
 
-                    for line in self.lines.all():
-                        if line.variant.product.pk in discounted_product_ids:
-                            total_discount += line.variant.product.price * Decimal(line.quantity) * (self.coupon.coupon_amount / 100)
+        key = (shipping_address.pk, shipping_method.pk)
 
-                    return total_discount
+        if key not in self._pricing_cache:
+            self._pricing_cache[key] = price_shipping(
+                self, self._pricing_cache[None], shipping_address, shipping_method)
 
-            elif self.coupon.coupon_type == Coupon.ORDER_TOTAL and self.coupon.coupon_mode == Coupon.COUPON_MODE_FIXED:
-                subtotal = self.get_subtotal()
+        return self._pricing_cache[key]
 
-                if self.coupon.coupon_amount > subtotal:
-                    return subtotal
+    def invalidate_pricing(self):
+        self._pricing_cache = {}
 
-                return self.coupon.coupon_amount
+    def invalidate_lines(self):
+        """
+        Drop prefetched lines and pricing, after lines are added, changed or removed.
+        """
+        getattr(self, '_prefetched_objects_cache', {}).pop('lines', None)
+        self.invalidate_pricing()
 
-        return Decimal('0')
+    def get_subtotal(self):
+        return self.get_pricing().subtotal
 
-    def get_item_count(self):
-        q = 0
+    def get_total(self, address=None, shipping_method=None):
+        """
+        Get final including shipping (if address and shipping method are supplied,
+        they go together), discounts taxes and product base cost.
+        """
+        return self.get_pricing(address, shipping_method).total
 
-        for line in self.lines.all():
-            q += line.quantity
+    def get_promotions_discount(self):
+        return self.get_pricing().discount
 
-        return q
+    def get_item_count(self):
+        return self.get_pricing().item_count
 
     def get_shipping_cost(self, shipping_address, shipping_method):
         return get_shipping_cost_util(self, shipping_address, shipping_method)
 
     def get_totals(self):
-        subtotal = self.get_subtotal()
-        discount = self.get_promotions_discount()
-
-        return {
-            'subtotal': subtotal,
-            'discount': discount,
-            'total': subtotal - discount
-        }
+        return self.get_pricing().get_totals()
 
     def get_totals_with_shipping(self, shipping_address, shipping_method):
-        subtotal = self.get_subtotal()
-        discount = self.get_promotions_discount()
-
-        shipping_cost = self.get_shipping_cost(shipping_address, shipping_method)
-
-        ret = {
-            'subtotal': subtotal,
-            'discount': discount,
-            'shipping_cost': shipping_cost['cost'],
-            'shipping_cost_discount': shipping_cost['discount'],
-            'shipping_cost_total': shipping_cost['total'],
-            'total': subtotal - discount + shipping_cost['total']
-        }
-
-        return ret
+        return self.get_pricing(shipping_address, shipping_method).get_totals_with_shipping()
 
     class Meta:
         verbose_name = _('cart')
         verbose_name_plural = _('carts')
 
 
+class CartLineQueryset(PrefetchSpecificMixin, models.QuerySet):
+    pass
+
+
 class CartLine(models.Model):
     cart = models.ForeignKey(Cart, related_name='lines', on_delete=models.CASCADE)
     variant = models.ForeignKey(
@@ -196,64 +188,81 @@ class CartLine(models.Model):
 
     created = models.DateTimeField(_('created on'), auto_now_add=True)
 
+    objects = CartLineQueryset.as_manager()
+
+    @cached_property
+    def primary_image(self):
+        from wagtailcommerce.products.variant_images import get_images_for_variants
+
+        images = get_images_for_variants([self.variant_id], limit=1).get(self.variant_id)
+        return images[0] if images else None
+
     def get_image(self):
         """
-        Filter image sets and obtain cart line's variant's related image set.
-
-        Returns the first image of the set.
+        Return the first image of the image set matching the line's variant.
+        Use prefetch_variant_images() to get the images of several lines at once.
         """
-        filtering_fields = self.variant.product.specific.image_set_filtering_fields
+        return self.primary_image
 
-        image_sets = self.variant.product.image_sets.all()
+    def has_stock(self):
+        return True if self.variant and self.variant.available_stock > 0 else False
 
-        for field in filtering_fields:
-            # Filter image sets by generic foreign key, value comes from field on variant
-            filtering_object = getattr(self.variant.specific, field)
-            image_sets = image_sets.filter(
-                content_type=ContentType.objects.get_for_model(filtering_object),
-                object_id=filtering_object.pk
-            )
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
 
-        return image_sets[0].images.first().image
+        if CartLine.cart.is_cached(self):
+            self.cart.invalidate_pricing()
 
-    def has_stock(self):
-        return True if self.variant and self.variant.stock > 0 else False
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+
+        if CartLine.cart.is_cached(self):
+            self.cart.invalidate_pricing()
+
+        return result
+
+    def get_pricing(self):
+        """
+        Return this line's LinePricing, taken from its cart's pricing.
+        """
+        line_pricing = self.cart.get_pricing().get_line(self)
+
+        if line_pricing is None:
+            # Line was added after the cart was priced
+            self.cart.invalidate_pricing()
+            line_pricing = self.cart.get_pricing().get_line(self)
+
+        return line_pricing
 
     def get_item_unit_regular_price(self):
-        return self.variant.product.regular_price
+        return self.get_pricing().unit_regular_price
 
     def get_item_unit_sale_price(self):
-        return self.variant.product.sale_price
+        return self.get_pricing().unit_sale_price
 
     def get_item_unit_price(self):
-        return self.variant.product.price
+        return self.get_pricing().unit_price
 
     def get_item_percentage_discount(self):
-        return self.variant.product.percentage_discount
+        return self.get_pricing().percentage_discount
 
     def get_item_unit_promotions_discount(self):
-        if self.cart.coupon:
-            # PERCENTAGE COUPON
-            if self.cart.coupon.coupon_type == Coupon.ORDER_TOTAL and self.cart.coupon.coupon_mode == Coupon.COUPON_MODE_PERCENTAGE:
-                if not self.cart.coupon.categories or len(set(self.variant.product.categories.values_list('pk', flat=True)) & set(self.cart.coupon.categories.values_list('pk', flat=True))):
-                    return self.get_item_unit_price() * (self.cart.coupon.coupon_amount / Decimal('100'))
-            # FIXED COUPON
-            elif self.cart.coupon.coupon_type == Coupon.ORDER_TOTAL and self.cart.coupon.coupon_mode == Coupon.COUPON_MODE_FIXED:
-                totals = self.cart.get_totals()
+        return self.get_pricing().unit_promotions_discount
 
-                total_percentage = self.get_item_unit_price() / totals['subtotal']
-
-                return totals['discount'] * total_percentage
-
-        return Decimal('0')
+    def get_promotions_discount(self):
+        """
+        Return this line's share of the cart's promotions discount.
+        """
+        return self.get_pricing().promotions_discount
 
     def get_item_unit_price_with_promotions_discount(self):
-        return self.get_item_unit_price() - self.get_item_unit_promotions_discount()
+        return self.get_pricing().unit_price_with_promotions_discount
 
     def get_total(self):
-        return self.get_item_unit_price_with_promotions_discount() * self.quantity
+        return self.get_pricing().total
 
     class Meta:
         verbose_name = _('cart line')
         verbose_name_plural = _('cart lines')
         ordering = ('created', )
+        unique_together = ('cart', 'variant')
@@ -77,6 +77,69 @@ class AddToCart(graphene.Mutation):
             return AddToCart(success=False, errors=[_('Product variant not found')])
 
 
+class CartLineInput(graphene.InputObjectType):
+    variant_pk = graphene.String(required=True)
+    quantity = graphene.Int(required=True)
+
+
+class SetCartLines(graphene.Mutation):
+    """
+    Set the quantities of several variants in the cart at once, removing those
+    set to 0. Nothing is changed if any variant can't be found or purchased.
+    """
+    class Arguments:
+        lines = graphene.List(CartLineInput, required=True)
+
+    success = graphene.Boolean()
+    cart = graphene.Field(lambda: CartType)
+    errors = graphene.List(graphene.String)
+    unavailable_variant_pks = graphene.List(graphene.String)
+
+    def mutate(self, info, lines, *args):
+        from wagtailcommerce.carts.utils import set_cart_lines
+        from wagtailcommerce.products.models import ProductVariant
+
+        # The last quantity given for a variant wins
+        quantities = {}
+
+        for line in lines:
+            try:
+                quantities[int(line.variant_pk)] = line.quantity
+            except ValueError:
+                return SetCartLines(success=False, errors=[_('Product variant not found')])
+
+        if any(quantity < 0 for quantity in quantities.values()):
+            return SetCartLines(success=False, errors=[_('Quantities can\'t be negative')])
+
+        variants = {
+            variant.pk: variant for variant in ProductVariant.objects.filter(
+                pk__in=quantities, product__store=info.context.store).select_related('product')
+        }
+
+        if len(variants) != len(quantities):
+            return SetCartLines(success=False, errors=[_('Product variant not found')])
+
+        # Unavailable variants can still be removed
+        unavailable_variant_pks = [
+            variant_pk for variant_pk, variant in variants.items()
+            if quantities[variant_pk] and not is_variant_purchasable(info.context.user, variant)
+        ]
+
+        if unavailable_variant_pks:
+            return SetCartLines(success=False, unavailable_variant_pks=[
+                str(variant_pk) for variant_pk in unavailable_variant_pks
+            ], errors=[
+                _('The product {} is no longer available.').format(variants[variant_pk])
+                for variant_pk in unavailable_variant_pks
+            ])
+
+        cart = set_cart_lines(info.context, {
+            variant: quantities[variant_pk] for variant_pk, variant in variants.items()
+        })
+
+        return SetCartLines(success=True, cart=cart)
+
+
 class UpdateCartCoupon(graphene.Mutation):
     class Arguments:
         delete = graphene.Boolean(required=False)
@@ -3,6 +3,8 @@ from graphene_django.types import DjangoObjectType
 
 from wagtailcommerce.carts.models import Cart, CartLine
 from wagtailcommerce.graphql_api.object_types import WagtailImageType
+from wagtailcommerce.products.variant_images import prefetch_variant_images
+from wagtailcommerce.utils.query import prefetch_specific
 from products.schema import ProductUnion, ProductVariantUnion
 
 
@@ -15,6 +17,7 @@ class CartLineType(DjangoObjectType):
     item_unit_sale_price = graphene.Float()
     item_percentage_discount = graphene.Float()
     item_unit_promotions_discount = graphene.Float()
+    promotions_discount = graphene.Float()
     total = graphene.Float()
 
     def resolve_product(self, info, **kwargs):
@@ -38,12 +41,19 @@ class CartLineType(DjangoObjectType):
     def resolve_item_unit_promotions_discount(self, info, **kwargs):
         return self.get_item_unit_promotions_discount()
 
+    def resolve_promotions_discount(self, info, **kwargs):
+        return self.get_promotions_discount()
+
     def resolve_total(self, info, **kwargs):
         return float(self.get_total())
 
     def resolve_variant(self, info, **kwargs):
         return self.variant.specific
 
+    def resolve_id(self, info, **kwargs):
+        # Lines of carts kept outside the database have no pk, but one variant each
+        return self.pk or 'variant-{}'.format(self.variant_id)
+
     class Meta:
         model = CartLine
 
@@ -61,11 +71,16 @@ class CartType(DjangoObjectType):
         return float(self.get_promotions_discount())
 
     def resolve_lines(self, info, **kwargs):
-        return self.lines.all()
+        return prefetch_variant_images(prefetch_specific(
+            [line_pricing.line for line_pricing in self.get_pricing().lines], 'variant', 'variant__product'))
 
     def resolve_item_count(self, info, **kwargs):
         return self.get_item_count()
 
+    def resolve_id(self, info, **kwargs):
+        # Carts kept outside the database have no pk
+        return self.pk or self.token
+
     class Meta:
         model = Cart
 
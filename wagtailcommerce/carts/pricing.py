@@ -0,0 +1,157 @@
+from __future__ import absolute_import, unicode_literals
+
+from collections import namedtuple
+from decimal import Decimal
+from types import MappingProxyType
+
+from wagtailcommerce.products.models import Product
+from wagtailcommerce.promotions.allocation import allocate_coupon_discount
+from wagtailcommerce.promotions.models import Coupon
+
+
+LinePricing = namedtuple('LinePricing', [
+    'line',
+    'quantity',
+    'unit_regular_price',
+    'unit_sale_price',
+    'unit_price',
+    'percentage_discount',
+    'unit_promotions_discount',
+    'unit_price_with_promotions_discount',
+    'subtotal',
+    'promotions_discount',
+    'total',
+])
+
+
+class CartPricing(namedtuple('CartPricing', [
+        'lines', 'line_index', 'item_count', 'subtotal', 'discount',
+        'shipping_cost', 'shipping_cost_discount', 'shipping_cost_total', 'total'])):
+    """
+    Immutable result of pricing a cart. Built by ``price_cart``, and extended
+    with shipping costs by ``price_shipping``.
+    """
+    __slots__ = ()
+
+    def get_line(self, line):
+        """
+        Return the LinePricing for a cart line, or None if the line wasn't priced.
+        """
+        return self.line_index.get((line.pk, line.variant_id))
+
+    def get_totals(self):
+        return {
+            'subtotal': self.subtotal,
+            'discount': self.discount,
+            'total': self.total
+        }
+
+    def get_totals_with_shipping(self):
+        return {
+            'subtotal': self.subtotal,
+            'discount': self.discount,
+            'shipping_cost': self.shipping_cost,
+            'shipping_cost_discount': self.shipping_cost_discount,
+            'shipping_cost_total': self.shipping_cost_total,
+            'total': self.total
+        }
+
+
+def get_discounted_product_pks(coupon, product_pks):
+    """
+    Return the pks among product_pks a percentage coupon applies to,
+    or None if the coupon isn't restricted to any category.
+    """
+    category_pks = list(coupon.categories.values_list('pk', flat=True))
+
+    if not category_pks:
+        return None
+
+    return set(Product.categories.through.objects.filter(
+        product_id__in=product_pks,
+        category_id__in=category_pks
+    ).values_list('product_id', flat=True))
+
+
+def price_cart(cart):
+    """
+    Price every line of a cart and the cart itself in a single pass.
+
+    Lines, variants and products are loaded with one query, unless they
+    were prefetched with ``Cart.objects.with_lines()``; the coupon and its
+    categories are looked up at most once. Coupon discounts are distributed
+    across lines by ``allocate_coupon_discount``.
+    """
+    if 'lines' in getattr(cart, '_prefetched_objects_cache', {}):
+        lines = [line for line in cart.lines.all() if line.variant_id]
+    elif cart.pk:
+        lines = list(cart.lines.filter(variant__isnull=False).select_related('variant', 'variant__product'))
+    else:
+        lines = []
+
+    coupon = cart.coupon
+
+    line_subtotals = [line.variant.product.price * Decimal(line.quantity) for line in lines]
+    eligible_lines = None
+
+    if coupon and coupon.coupon_type == Coupon.ORDER_TOTAL and coupon.coupon_mode == Coupon.COUPON_MODE_PERCENTAGE:
+        discounted_product_pks = get_discounted_product_pks(
+            coupon, [line.variant.product_id for line in lines])
+
+        if discounted_product_pks is not None:
+            eligible_lines = [line.variant.product_id in discounted_product_pks for line in lines]
+
+    discount, line_discounts = allocate_coupon_discount(coupon, line_subtotals, eligible_lines)
+
+    line_pricings = []
+
+    for line, line_subtotal, line_discount in zip(lines, line_subtotals, line_discounts):
+        product = line.variant.product
+        unit_price = product.price
+        unit_discount = line_discount / Decimal(line.quantity) if line.quantity else Decimal('0')
+
+        line_pricings.append(LinePricing(
+            line=line,
+            quantity=line.quantity,
+            unit_regular_price=product.regular_price,
+            unit_sale_price=product.sale_price,
+            unit_price=unit_price,
+            percentage_discount=product.percentage_discount,
+            unit_promotions_discount=unit_discount,
+            unit_price_with_promotions_discount=unit_price - unit_discount,
+            subtotal=line_subtotal,
+            promotions_discount=line_discount,
+            total=line_subtotal - line_discount
+        ))
+
+    subtotal = sum(line_subtotals, Decimal('0'))
+
+    return CartPricing(
+        lines=tuple(line_pricings),
+        # Lines of carts kept outside the database have no pk, but one variant each
+        line_index=MappingProxyType({
+            (line_pricing.line.pk, line_pricing.line.variant_id): line_pricing for line_pricing in line_pricings
+        }),
+        item_count=sum(line.quantity for line in lines),
+        subtotal=subtotal,
+        discount=discount,
+        shipping_cost=None,
+        shipping_cost_discount=None,
+        shipping_cost_total=None,
+        total=subtotal - discount
+    )
+
+
+def price_shipping(cart, pricing, shipping_address, shipping_method):
+    """
+    Return a copy of a cart's pricing including the cost of shipping it
+    to shipping_address with shipping_method.
+    """
+    shipping_cost = shipping_method.get_shipping_cost(cart, shipping_address, cart_total=pricing.total)
+
+    return pricing._replace(
+        shipping_cost=shipping_cost['cost'],
+        shipping_cost_discount=shipping_cost['discount'],
+        shipping_cost_total=shipping_cost['total'],
+        total=pricing.total + shipping_cost['total']
+    )
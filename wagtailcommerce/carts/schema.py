@@ -27,16 +27,16 @@ class CartQuery(graphene.ObjectType):
                 shipping_address = info.context.user.addresses.get(deleted=False, pk=shipping_address_pk)
                 shipping_method = ShippingMethod.objects.for_shipping_address(
                     shipping_address, info.context.user
-                ).get(pk=shipping_method_pk).specific
+                ).select_specific().get(pk=shipping_method_pk)
 
-                totals = cart.get_totals_with_shipping(shipping_address, shipping_method)
+                totals = cart.get_pricing(shipping_address, shipping_method).get_totals_with_shipping()
             except Address.DoesNotExist:
                 raise ShippingCostCalculationException(_('Address not found'))
             except ShippingMethod.DoesNotExist:
                 raise ShippingCostCalculationException(_('Shipping method not found'))
 
         else:
-            totals = cart.get_totals()
+            totals = cart.get_pricing().get_totals()
 
         totals.update({
             'coupon_code': cart.coupon.code if cart.coupon else None,
@@ -0,0 +1,234 @@
+from __future__ import absolute_import, unicode_literals
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from wagtailcommerce.carts.models import Cart, CartLine
+from wagtailcommerce.utils.bulk import bulk_upsert
+
+CART_CACHE_KEY = 'wagtailcommerce:cart:{}'
+
+
+def get_cache():
+    return caches[getattr(settings, 'WAGTAILCOMMERCE_CART_CACHE', 'default')]
+
+
+def set_prefetched_lines(cart, lines):
+    """
+    Make cart.lines.all() return lines, as if they had been prefetched.
+    """
+    queryset = CartLine.objects.none()
+    queryset._result_cache = list(lines)
+    queryset._prefetch_done = True
+
+    if not hasattr(cart, '_prefetched_objects_cache'):
+        cart._prefetched_objects_cache = {}
+
+    cart._prefetched_objects_cache['lines'] = queryset
+    cart.invalidate_pricing()
+
+
+class DatabaseCartStorage(object):
+    """
+    Keep carts and their lines in the Cart and CartLine tables.
+    """
+    def load(self, store, token):
+        """
+        Return the open anonymous cart for a token, or None.
+        """
+        if not token:
+            return None
+
+        return Cart.objects.open().from_store(store).for_token(token=token).select_related('coupon').with_lines().first()
+
+    def save(self, cart):
+        cart.save()
+
+    def save_line(self, cart, line):
+        if not cart.pk:
+            cart.save()
+
+        line.cart = cart
+        line.save()
+        cart.invalidate_lines()
+
+    def delete_line(self, cart, line):
+        line.delete()
+        cart.invalidate_lines()
+
+    def set_lines(self, cart, quantities):
+        """
+        Set the quantity of the lines of variants, a dict of quantities by
+        variant, removing those set to 0. Lines are inserted or updated with a
+        single statement, and removed with another.
+        """
+        if not cart.pk and not any(quantities.values()):
+            return
+
+        with transaction.atomic():
+            if not cart.pk:
+                cart.save()
+
+            bulk_upsert(CartLine, [
+                CartLine(cart=cart, variant=variant, quantity=quantity)
+                for variant, quantity in quantities.items() if quantity
+            ], unique_fields=('cart', 'variant'), update_fields=('quantity', ))
+
+            removed_variants = [variant for variant, quantity in quantities.items() if not quantity]
+
+            if removed_variants:
+                CartLine.objects.filter(cart=cart, variant__in=removed_variants).delete()
+
+        cart.invalidate_lines()
+
+    def persist(self, cart):
+        if not cart.pk:
+            cart.save()
+
+
+class CacheCartStorage(DatabaseCartStorage):
+    """
+    Keep anonymous carts in the WAGTAILCOMMERCE_CART_CACHE cache, as snapshots
+    of their coupon and lines, until persist() writes them to the database,
+    e.g. on login or checkout. Carts already in the database are loaded from it.
+    """
+    def get_cache_key(self, token):
+        return CART_CACHE_KEY.format(token)
+
+    def get_timeout(self):
+        return getattr(settings, 'WAGTAILCOMMERCE_CART_CACHE_TIMEOUT', settings.SESSION_COOKIE_AGE)
+
+    def load(self, store, token):
+        snapshot = get_cache().get(self.get_cache_key(token)) if token else None
+
+        if snapshot is None or snapshot['store'] != store.pk:
+            return super().load(store, token)
+
+        from wagtailcommerce.products.models import ProductVariant
+        from wagtailcommerce.promotions.utils import get_auto_assign_coupon
+
+        cart = Cart(store=store, token=token, coupon_id=snapshot['coupon'])
+        cart.storage = self
+
+        auto_assign_coupon = get_auto_assign_coupon() if cart.coupon_id else None
+
+        if auto_assign_coupon is not None and auto_assign_coupon.pk == cart.coupon_id:
+            cart.coupon = auto_assign_coupon
+
+        variants = ProductVariant.objects.select_related('product').in_bulk(
+            [variant_pk for variant_pk, quantity, created in snapshot['lines']])
+
+        # Lines of variants deleted since are dropped, like CartLine.variant is set to null
+        set_prefetched_lines(cart, [
+            CartLine(cart=cart, variant=variants[variant_pk], quantity=quantity, created=created)
+            for variant_pk, quantity, created in snapshot['lines'] if variant_pk in variants
+        ])
+
+        return cart
+
+    def save(self, cart):
+        if cart.pk:
+            return super().save(cart)
+
+        cart.storage = self
+        cart.invalidate_pricing()
+
+        get_cache().set(self.get_cache_key(cart.token), {
+            'store': cart.store_id,
+            'coupon': cart.coupon_id,
+            'lines': [(line.variant_id, line.quantity, line.created) for line in cart.lines.all()],
+        }, self.get_timeout())
+
+    def save_line(self, cart, line):
+        if cart.pk:
+            return super().save_line(cart, line)
+
+        lines = list(cart.lines.all())
+
+        if line not in lines:
+            line.cart = cart
+            line.created = timezone.now()
+            lines.append(line)
+
+        set_prefetched_lines(cart, lines)
+        self.save(cart)
+
+    def delete_line(self, cart, line):
+        if cart.pk:
+            return super().delete_line(cart, line)
+
+        set_prefetched_lines(cart, [other for other in cart.lines.all() if other is not line])
+        self.save(cart)
+
+    def set_lines(self, cart, quantities):
+        if cart.pk:
+            return super().set_lines(cart, quantities)
+
+        lines = {line.variant_id: line for line in cart.lines.all()}
+
+        for variant, quantity in quantities.items():
+            if not quantity:
+                lines.pop(variant.pk, None)
+            elif variant.pk in lines:
+                lines[variant.pk].quantity = quantity
+            else:
+                lines[variant.pk] = CartLine(cart=cart, variant=variant, quantity=quantity, created=timezone.now())
+
+        set_prefetched_lines(cart, lines.values())
+        self.save(cart)
+
+    def persist(self, cart):
+        if cart.pk:
+            return
+
+        lines = list(cart.lines.all())
+
+        with transaction.atomic():
+            cart.save()
+
+            for line in lines:
+                line.cart = cart
+
+            CartLine.objects.bulk_create(lines)
+
+        set_prefetched_lines(cart, lines)
+        cart.storage = None
+
+        # The cached cart is kept if the transaction persisting it is rolled back
+        cache_key = self.get_cache_key(cart.token)
+        transaction.on_commit(lambda: get_cache().delete(cache_key))
+
+
+def get_anonymous_cart_storage():
+    """
+    Return an instance of the storage class configured in
+    WAGTAILCOMMERCE_ANONYMOUS_CART_STORAGE, defaulting to ``DatabaseCartStorage``.
+    """
+    storage_class = getattr(settings, 'WAGTAILCOMMERCE_ANONYMOUS_CART_STORAGE',
+                            'wagtailcommerce.carts.storage.DatabaseCartStorage')
+
+    if isinstance(storage_class, str):
+        storage_class = import_string(storage_class)
+
+    return storage_class()
+
+
+def get_cart_storage(cart):
+    """
+    Return the storage a cart is kept in.
+    """
+    return getattr(cart, 'storage', None) or DatabaseCartStorage()
+
+
+def save_cart(cart):
+    get_cart_storage(cart).save(cart)
+
+
+def persist_cart(cart):
+    """
+    Write a cart kept outside the database to it, e.g. before it's ordered.
+    """
+    get_cart_storage(cart).persist(cart)
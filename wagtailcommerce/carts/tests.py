@@ -1,6 +1,36 @@
-from django.test import TestCase
+from decimal import Decimal
+from unittest import mock
 
+import graphene
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from wagtail.core.models import Site
+
+from wagtailcommerce.addresses.models import Address
+from wagtailcommerce.carts.middleware import CartMiddleware
+from wagtailcommerce.carts.models import Cart, CartLine
+from wagtailcommerce.carts.storage import CacheCartStorage, get_cache
+from wagtailcommerce.carts.utils import assign_coupon, invalidate_request_cart
+from wagtailcommerce.graphql_api.schema import WagtailCommerceMutations, WagtailCommerceQueries
+from wagtailcommerce.products.models import Product, ProductVariant
+from wagtailcommerce.promotions.models import Coupon
+from wagtailcommerce.shipping_methods.flat_rate.models import FlatRateShippingMethod
+from wagtailcommerce.stores.models import Currency, Store
 from wagtailcommerce.tests.base import WithUsers
+from wagtailcommerce.utils.bulk import bulk_upsert
+
+SET_CART_LINES = '''
+mutation setCartLines($lines: [CartLineInput]!) {
+    setCartLines(lines: $lines) {
+        success
+        errors
+        unavailableVariantPks
+    }
+}
+'''
 
 
 class TestGetCart(WithUsers, TestCase):
@@ -12,3 +42,250 @@ class TestGetCart(WithUsers, TestCase):
 
     def test_get_cart_2(self):
         self.assertEqual(self.a, 1)
+
+
+class WithCart(object):
+    def setUp(self):
+        currency = Currency.objects.create(name='Peso', code='ARS', symbol='$')
+        self.store = Store.objects.create(name='Store', tax_rate=0, currency=currency, site=Site.objects.first())
+        self.user = get_user_model().objects.create(username='customer', email='customer@example.com')
+
+        product = Product.objects.create(
+            store=self.store, name='Hat', slug='hat', active=True, regular_price=Decimal('10.00'))
+        self.variants = [
+            ProductVariant.objects.create(product=product, sku=sku, active=True, stock=10) for sku in ('S', 'M')]
+
+        self.cart = Cart.objects.create(store=self.store, user=self.user)
+
+    def get_lines(self):
+        return dict(self.cart.lines.values_list('variant_id', 'quantity'))
+
+
+class TestSetCartLines(WithCart, TestCase):
+    def set_cart_lines(self, lines):
+        request = RequestFactory().post('/graphql')
+        request.user = self.user
+        request.store = self.store
+        request.session = SessionStore()
+
+        schema = graphene.Schema(query=WagtailCommerceQueries, mutation=WagtailCommerceMutations)
+        result = schema.execute(SET_CART_LINES, context=request, variables={'lines': [
+            {'variantPk': variant_pk, 'quantity': quantity} for variant_pk, quantity in lines
+        ]})
+
+        self.assertIsNone(result.errors)
+        return result.data['setCartLines']
+
+    def test_lines_are_set_and_removed(self):
+        s, m = self.variants
+
+        self.assertTrue(self.set_cart_lines([(str(s.pk), 2), (str(m.pk), 1)])['success'])
+        self.assertEqual(self.get_lines(), {s.pk: 2, m.pk: 1})
+
+        # Padded pks are the same variant, and the last quantity given wins
+        self.assertTrue(self.set_cart_lines([(str(s.pk), 5), ('0{}'.format(s.pk), 3), (str(m.pk), 0)])['success'])
+        self.assertEqual(self.get_lines(), {s.pk: 3})
+
+    def test_unknown_variants_are_not_found(self):
+        for variant_pk in ('x', '', str(self.variants[1].pk + 100)):
+            result = self.set_cart_lines([(str(self.variants[0].pk), 1), (variant_pk, 1)])
+
+            self.assertEqual((result['success'], result['errors']), (False, ['Product variant not found']))
+
+        self.assertEqual(self.get_lines(), {})
+
+    def test_negative_quantities_are_rejected(self):
+        result = self.set_cart_lines([(str(self.variants[0].pk), -1)])
+
+        self.assertFalse(result['success'])
+        self.assertEqual(result['errors'], ['Quantities can\'t be negative'])
+
+
+class TestCartMiddleware(WithCart, TestCase):
+    def test_request_cart_is_loaded_again_once_invalidated(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        request.store = self.store
+        request.session = SessionStore()
+
+        CartMiddleware(lambda request: None)(request)
+        self.assertEqual(request.cart.pk, self.cart.pk)
+
+        Cart.objects.filter(pk=self.cart.pk).update(status=Cart.CANCELED)
+        self.assertEqual(request.cart.pk, self.cart.pk)
+
+        invalidate_request_cart(request)
+        self.assertIsNone(request.cart.pk)
+
+
+def create_coupon(code):
+    return Coupon.objects.create(
+        name=code, code=code, coupon_type=Coupon.ORDER_TOTAL, coupon_mode=Coupon.COUPON_MODE_FIXED,
+        coupon_amount=Decimal('5.00'), auto_assign_to_new_users=False)
+
+
+class TestAssignCoupon(WithCart, TestCase):
+    def test_concurrent_requests_attach_and_count_the_coupon_once(self):
+        coupon, other_coupon = create_coupon('WELCOME'), create_coupon('OTHER')
+
+        # Another request loaded the cart before the coupon was attached
+        stale_cart = Cart.objects.get(pk=self.cart.pk)
+
+        assign_coupon(self.cart, coupon)
+        assign_coupon(stale_cart, other_coupon)
+
+        self.assertEqual(stale_cart.coupon, coupon)
+        self.assertEqual(Cart.objects.get(pk=self.cart.pk).coupon, coupon)
+        self.assertEqual(list(Coupon.objects.order_by('code').values_list('code', 'times_added_to_cart')), [
+            ('OTHER', 0), ('WELCOME', 1),
+        ])
+
+
+class TestCacheCartStorage(WithCart, TestCase):
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+
+        self.storage = CacheCartStorage()
+
+        cart = Cart(store=self.store)
+        cart.coupon = create_coupon('WELCOME')
+        self.storage.set_lines(cart, {self.variants[0]: 2, self.variants[1]: 1})
+        self.token = cart.token
+
+    def run_on_commit(self):
+        # Callbacks registered during the test, which never commits
+        callbacks, connection.run_on_commit = connection.run_on_commit, []
+
+        for sids, func in callbacks:
+            func()
+
+    def get_lines(self, cart):
+        return {line.variant_id: line.quantity for line in cart.lines.all()}
+
+    def test_snapshots_load_as_saved(self):
+        cart = self.storage.load(self.store, self.token)
+
+        self.assertIsNone(cart.pk)
+        self.assertEqual(cart.coupon.code, 'WELCOME')
+        self.assertEqual(self.get_lines(cart), {self.variants[0].pk: 2, self.variants[1].pk: 1})
+
+        self.storage.set_lines(cart, {self.variants[1]: 0})
+        self.assertEqual(self.get_lines(self.storage.load(self.store, self.token)), {self.variants[0].pk: 2})
+
+        self.assertFalse(Cart.objects.filter(token=self.token).exists())
+
+    def test_persisted_carts_are_loaded_from_the_database(self):
+        cart = self.storage.load(self.store, self.token)
+        self.storage.persist(cart)
+        self.run_on_commit()
+
+        self.assertIsNone(get_cache().get(self.storage.get_cache_key(self.token)))
+
+        cart = self.storage.load(self.store, self.token)
+        self.assertIsNotNone(cart.pk)
+        self.assertEqual(cart.coupon.code, 'WELCOME')
+        self.assertEqual(self.get_lines(cart), {self.variants[0].pk: 2, self.variants[1].pk: 1})
+
+    def test_snapshots_are_kept_when_persisting_is_rolled_back(self):
+        cart = self.storage.load(self.store, self.token)
+
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.storage.persist(cart)
+                raise ValueError
+
+        self.run_on_commit()
+
+        self.assertFalse(Cart.objects.filter(token=self.token).exists())
+        cart = self.storage.load(self.store, self.token)
+        self.assertIsNone(cart.pk)
+        self.assertEqual(self.get_lines(cart), {self.variants[0].pk: 2, self.variants[1].pk: 1})
+
+
+class TestCartPricing(WithCart, TestCase):
+    def setUp(self):
+        super().setUp()
+
+        for variant, quantity in zip(self.variants, (2, 1)):
+            CartLine.objects.create(cart=self.cart, variant=variant, quantity=quantity)
+
+        self.address = Address.objects.create(user=self.user, name='Customer', postal_code='1000')
+        self.shipping_method = FlatRateShippingMethod.objects.create(
+            store=self.store, title='Flat rate', enabled=True, enabled_for_administrators=False, sort_order=0,
+            shipping_rate=Decimal('5.00'), generate_shipping_label=False)
+
+    def test_totals_and_line_prices_share_one_pricing_pass(self):
+        cart = Cart.objects.with_lines().get(pk=self.cart.pk)
+
+        with self.assertNumQueries(0):
+            totals = (cart.get_subtotal(), cart.get_total(), cart.get_item_count())
+            line_totals = [line.get_total() for line in cart.lines.all()]
+
+        self.assertEqual(totals, (Decimal('30.00'), Decimal('30.00'), 3))
+        self.assertEqual(line_totals, [Decimal('20.00'), Decimal('10.00')])
+
+    def test_shipping_is_added_to_the_total(self):
+        total = self.cart.get_total()
+        shipping_cost = self.cart.get_shipping_cost(self.address, self.shipping_method)
+
+        self.assertEqual(self.cart.get_total(self.address, self.shipping_method), total + shipping_cost['total'])
+
+    def test_address_and_shipping_method_go_together(self):
+        with self.assertRaises(ValueError):
+            self.cart.get_total(self.address)
+
+        with self.assertRaises(ValueError):
+            self.cart.get_total(shipping_method=self.shipping_method)
+
+
+class TestBulkUpsert(WithCart, TestCase):
+    def upsert(self, quantities):
+        bulk_upsert(CartLine, [
+            CartLine(cart=self.cart, variant=variant, quantity=quantity) for variant, quantity in quantities
+        ], unique_fields=('cart', 'variant'), update_fields=('quantity', ))
+
+    def test_rows_are_inserted_or_updated(self):
+        s, m = self.variants
+        self.upsert([(s, 1)])
+        self.upsert([(s, 4), (m, 2)])
+
+        self.assertEqual(self.get_lines(), {s.pk: 4, m.pk: 2})
+
+    def test_other_databases_update_rows_one_by_one(self):
+        s, m = self.variants
+        self.upsert([(s, 1)])
+
+        with mock.patch.object(connections['default'], 'vendor', 'sqlite'):
+            self.upsert([(s, 4), (m, 2)])
+
+        self.assertEqual(self.get_lines(), {s.pk: 4, m.pk: 2})
+
+
+class TestMergeDuplicateCartLinesMigration(WithCart, TransactionTestCase):
+    migrate_from = ('wagtailcommerce_carts', '0006_auto_20190910_1353')
+    migrate_to = ('wagtailcommerce_carts', '0008_auto_20261018_0912')
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([target])
+
+        return executor.loader.project_state(target).apps
+
+    def test_duplicate_lines_are_merged(self):
+        s, m = self.variants
+
+        self.addCleanup(self.migrate, self.migrate_to)
+        apps = self.migrate(self.migrate_from)
+
+        HistoricalCartLine = apps.get_model('wagtailcommerce_carts', 'CartLine')
+        for variant_pk, quantity in ((s.pk, 1), (m.pk, 1), (s.pk, 2)):
+            HistoricalCartLine.objects.create(cart_id=self.cart.pk, variant_id=variant_pk, quantity=quantity)
+
+        first_pk = CartLine.objects.filter(variant=s).order_by('pk').values_list('pk', flat=True).first()
+
+        self.migrate(self.migrate_to)
+
+        self.assertEqual(self.get_lines(), {s.pk: 3, m.pk: 1})
+        self.assertEqual(CartLine.objects.get(variant=s).pk, first_pk)
@@ -1,11 +1,15 @@
 from __future__ import absolute_import, unicode_literals
 
+from django.db.models import F
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 from django.utils.translation import ugettext_lazy as _
 
 from wagtailcommerce.carts.exceptions import CartException
 from wagtailcommerce.carts.models import CartLine
+from wagtailcommerce.carts.storage import get_anonymous_cart_storage, get_cart_storage, persist_cart, save_cart
 from wagtailcommerce.promotions.models import Coupon
-from wagtailcommerce.promotions.utils import apply_coupon
+from wagtailcommerce.promotions.utils import get_auto_assign_coupon
 
 SESSION_KEY_NAME = 'cart_token'
 
@@ -15,16 +19,18 @@ def set_cart_cookie(cart, request):
     Save a cart token in the session
     """
     # FIXME: check why session is not used in Saleor
-    request.session[SESSION_KEY_NAME] = '{}'.format(cart.token)
+    token = '{}'.format(cart.token)
+
+    # Only write the session when the token changes
+    if request.session.get(SESSION_KEY_NAME) != token:
+        request.session[SESSION_KEY_NAME] = token
 
 
 def get_anonymous_cart_from_token(store, token):
     """
-    Return an open anonymous cart for a given token
+    Return an open anonymous cart for a given token, from the anonymous cart storage
     """
-    from wagtailcommerce.carts.models import Cart
-
-    return Cart.objects.open().from_store(store).for_token(token=token).first()
+    return get_anonymous_cart_storage().load(store, token)
 
 
 def get_user_cart(store, user):
@@ -33,7 +39,7 @@ def get_user_cart(store, user):
     """
     from wagtailcommerce.carts.models import Cart
 
-    return Cart.objects.open().from_store(store).for_user(user).first()
+    return Cart.objects.open().from_store(store).for_user(user).select_related('coupon').with_lines().first()
 
 
 def is_variant_purchasable(user, variant):
@@ -44,6 +50,37 @@ def is_variant_purchasable(user, variant):
 
 
 def get_cart_from_request(request):
+    """
+    Return the request's cart, loaded once per request with its coupon and lines.
+    Helpers changing which cart the request uses call invalidate_request_cart().
+    """
+    cart = getattr(request, '_cached_cart', None)
+
+    if cart is None:
+        cart = request._cached_cart = load_cart(request)
+
+    return cart
+
+
+def set_request_cart(request):
+    """
+    Set request.cart, evaluated on first access.
+    """
+    request.cart = SimpleLazyObject(lambda: get_cart_from_request(request))
+
+
+def invalidate_request_cart(request):
+    """
+    Make the request load its cart again on next access, e.g. after logging in.
+    """
+    request.__dict__.pop('_cached_cart', None)
+
+    # request.cart may have been evaluated already
+    if hasattr(request, 'cart'):
+        set_request_cart(request)
+
+
+def load_cart(request):
     """
     Retrieve cart from DB or create a new one
     """
@@ -61,17 +98,41 @@ def get_cart_from_request(request):
 
         if not cart.coupon:
             # Look for auto-assignment coupons
-            try:
-                coupon = Coupon.objects.active().filter(auto_assign_to_new_users=True).latest('created')
-
-                apply_coupon(coupon.code, cart)
+            coupon = get_auto_assign_coupon()
 
-            except Coupon.DoesNotExist:
-                pass
+            if coupon is not None and not coupon.auto_generated:
+                assign_coupon(cart, coupon)
 
         return cart
 
-    return Cart(user=user, store=request.store)
+    cart = Cart(user=user, store=request.store)
+
+    if user is None:
+        cart.storage = get_anonymous_cart_storage()
+
+    return cart
+
+
+def assign_coupon(cart, coupon):
+    """
+    Attach a verified coupon to a saved cart without one, with a conditional
+    UPDATE, so concurrent requests only attach and count it once.
+    """
+    from wagtailcommerce.carts.models import Cart
+
+    if not cart.pk:
+        # Kept outside the database
+        cart.coupon = coupon
+        save_cart(cart)
+        Coupon.objects.filter(pk=coupon.pk).update(times_added_to_cart=F('times_added_to_cart') + 1)
+
+    elif Cart.objects.filter(pk=cart.pk, coupon__isnull=True).update(coupon=coupon, updated=timezone.now()):
+        Coupon.objects.filter(pk=coupon.pk).update(times_added_to_cart=F('times_added_to_cart') + 1)
+        cart.coupon = coupon
+    else:
+        cart.refresh_from_db(fields=['coupon'])
+
+    cart.invalidate_pricing()
 
 
 def merge_carts(user, request):
@@ -88,6 +149,9 @@ def merge_carts(user, request):
     if token:
         session_cart = get_anonymous_cart_from_token(token=token, store=request.store)
 
+        if session_cart is not None:
+            persist_cart(session_cart)
+
     final_cart = None
 
     if db_cart:
@@ -135,24 +199,29 @@ def merge_carts(user, request):
 
     close_queryset.update(status=Cart.CANCELED)
 
+    invalidate_request_cart(request)
+
+
+def get_cart_line(cart, variant):
+    """
+    Return the line of a cart for variant, or None. Uses prefetched lines if any.
+    """
+    return next((line for line in cart.lines.all() if line.variant_id == variant.pk), None)
+
 
 def add_to_cart(request, variant):
     """
     Add one unit of variant to the request's cart
     """
-    from wagtailcommerce.carts.models import CartLine
-
     cart = get_cart_from_request(request)
+    cart_line = get_cart_line(cart, variant)
 
-    if not getattr(cart, 'pk', None):
-        cart.save()
-
-    try:
-        cart_line = cart.lines.get(variant=variant)
+    if cart_line:
         cart_line.quantity = cart_line.quantity + 1
-        cart_line.save()
-    except CartLine.DoesNotExist:
-        cart_line = CartLine.objects.create(cart=cart, variant=variant, quantity=1)
+    else:
+        cart_line = CartLine(cart=cart, variant=variant, quantity=1)
+
+    get_cart_storage(cart).save_line(cart, cart_line)
 
     if not request.user.is_authenticated:
         set_cart_cookie(cart, request)
@@ -165,28 +234,44 @@ def modify_cart_line(request, variant, quantity):
     Find a cart line matching the variant and modify its quantity
     place_order_error += variant_data.removal_reason_message
     """
-    from wagtailcommerce.carts.models import CartLine
-
     cart = get_cart_from_request(request)
 
-    if not getattr(cart, 'pk', None) or quantity < 0:
+    if quantity < 0:
         # Generic error to be displayed on UI
         # Should't happen on any normal scenario
         raise CartException()
 
-    try:
-        cart_line = cart.lines.get(variant=variant)
-
-        if quantity == 0:
-            cart_line.delete()
-            return None
+    cart_line = get_cart_line(cart, variant)
 
-        cart_line.quantity = quantity
-        cart_line.save()
-        return cart_line
-    except CartLine.DoesNotExist:
+    if not cart_line:
         raise CartException()
 
+    storage = get_cart_storage(cart)
+
+    if quantity == 0:
+        storage.delete_line(cart, cart_line)
+        return None
+
+    cart_line.quantity = quantity
+    storage.save_line(cart, cart_line)
+
+    return cart_line
+
+
+def set_cart_lines(request, quantities):
+    """
+    Set the quantities of variants in the request's cart, a dict of quantities
+    by variant, removing those set to 0. Return the cart.
+    """
+    cart = get_cart_from_request(request)
+
+    get_cart_storage(cart).set_lines(cart, quantities)
+
+    if not request.user.is_authenticated and (cart.pk or cart.lines.all()):
+        set_cart_cookie(cart, request)
+
+    return cart
+
 
 def modify_cart_status(cart, next_status):
     """
@@ -233,7 +318,7 @@ def verify_cart_lines_stock(user, cart):
 
             line.delete()
 
-        elif variant.stock <= 0:
+        elif variant.available_stock <= 0:
             no_stock_variants.append({
                 'variant': variant,
                 'removal_reason_message': _('The product {} is no longer available.').format(variant)
@@ -241,13 +326,17 @@ def verify_cart_lines_stock(user, cart):
 
             line.delete()
 
-        elif variant.stock < line.quantity:
+        elif variant.available_stock < line.quantity:
             no_stock_variants.append({
                 'variant': variant,
-                'removal_reason_message': _('We\'re running out of "{}". There is only {} left.').format(variant, variant.stock)
+                'removal_reason_message': _('We\'re running out of "{}". There is only {} left.').format(
+                    variant, variant.available_stock)
             })
 
-            line.quantity = variant.stock
+            line.quantity = variant.available_stock
             line.save()
 
+    if no_stock_variants:
+        cart.invalidate_lines()
+
     return no_stock_variants
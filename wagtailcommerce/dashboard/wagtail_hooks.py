@@ -1,6 +1,6 @@
 from wagtail.contrib.modeladmin.options import ModelAdmin, ModelAdminGroup, modeladmin_register
 
-from wagtailcommerce.products.models import Product
+from wagtailcommerce.products.models import Product, StockLocation
 from wagtailcommerce.stores.models import Currency, Store
 
 
@@ -18,6 +18,13 @@ class ProductAdmin(ModelAdmin):
     list_display = ('name', 'active')
 
 
+class StockLocationAdmin(ModelAdmin):
+    model = StockLocation
+    menu_icon = 'fa-archive'
+    menu_order = 200
+    list_display = ('name', 'store', 'priority', 'active')
+
+
 class StoreAdmin(ModelAdmin):
     model = Store
     menu_icon = 'date'
@@ -29,7 +36,7 @@ class WagtailCommerceGroup(ModelAdminGroup):
     menu_label = 'Commerce'
     menu_icon = 'fa-shopping-cart'
     menu_order = 500
-    items = [CurrencyAdmin, ProductAdmin, StoreAdmin]
+    items = [CurrencyAdmin, ProductAdmin, StockLocationAdmin, StoreAdmin]
 
 
 modeladmin_register(WagtailCommerceGroup)
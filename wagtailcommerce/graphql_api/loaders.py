@@ -0,0 +1,100 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from promise import Promise
+from promise.dataloader import DataLoader
+
+from wagtailcommerce.products.models import Image
+from wagtailcommerce.utils.images import get_image_model
+
+RENDITION_JOB_CACHE_KEY = 'wagtailcommerce:rendition_job:{}:{}'
+
+# Seconds a missing rendition isn't scheduled again for
+DEFAULT_RENDITION_JOB_TIMEOUT = 10 * 60
+
+
+def get_loader(context, loader_class):
+    """
+    Return the instance of loader_class for a request, so objects requested by
+    any resolver during a GraphQL operation are loaded together and cached for
+    that request only.
+    """
+    if not hasattr(context, 'wagtailcommerce_loaders'):
+        context.wagtailcommerce_loaders = {}
+
+    if loader_class not in context.wagtailcommerce_loaders:
+        context.wagtailcommerce_loaders[loader_class] = loader_class()
+
+    return context.wagtailcommerce_loaders[loader_class]
+
+
+def schedule_renditions(jobs):
+    """
+    Have (Wagtail image pk, filter spec) renditions generated in the background,
+    if WAGTAILCOMMERCE_ASYNC_THUMBNAILS is enabled. Renditions already scheduled
+    in the last WAGTAILCOMMERCE_RENDITION_JOB_TIMEOUT seconds are skipped, so
+    requests missing the same ones don't queue them again.
+    """
+    if not getattr(settings, 'WAGTAILCOMMERCE_ASYNC_THUMBNAILS', False):
+        return
+
+    from wagtailcommerce.products.images import generate_missing_renditions
+
+    cache = caches[getattr(settings, 'WAGTAILCOMMERCE_RENDITION_JOB_CACHE', 'default')]
+    timeout = getattr(settings, 'WAGTAILCOMMERCE_RENDITION_JOB_TIMEOUT', DEFAULT_RENDITION_JOB_TIMEOUT)
+
+    jobs = [job for job in jobs if cache.add(RENDITION_JOB_CACHE_KEY.format(*job), True, timeout)]
+
+    if jobs:
+        generate_missing_renditions.delay([list(job) for job in jobs])
+
+
+class RenditionLoader(DataLoader):
+    """
+    Load the renditions of Wagtail images, keyed by (image pk, filter specs),
+    with a single query. An empty tuple of filter specs loads every rendition.
+    """
+    def batch_load_fn(self, keys):
+        Rendition = get_image_model().get_rendition_model()
+
+        renditions = Rendition.objects.filter(image_id__in={image_pk for image_pk, filter_specs in keys})
+
+        if all(filter_specs for image_pk, filter_specs in keys):
+            renditions = renditions.filter(
+                filter_spec__in={spec for image_pk, filter_specs in keys for spec in filter_specs})
+
+        image_renditions = defaultdict(list)
+
+        for rendition in renditions.order_by('pk'):
+            image_renditions[rendition.image_id].append(rendition)
+
+        results = []
+        missing = set()
+
+        for image_pk, filter_specs in keys:
+            results.append([
+                rendition for rendition in image_renditions[image_pk]
+                if not filter_specs or rendition.filter_spec in filter_specs
+            ])
+
+            found_specs = {rendition.filter_spec for rendition in results[-1]}
+            missing.update((image_pk, spec) for spec in filter_specs if spec not in found_specs)
+
+        if missing:
+            schedule_renditions(sorted(missing))
+
+        return Promise.resolve(results)
+
+
+class ImageSetImagesLoader(DataLoader):
+    """
+    Load the images of image sets, keyed by image set pk, with a single query.
+    """
+    def batch_load_fn(self, keys):
+        images = defaultdict(list)
+
+        for image in Image.objects.filter(image_set_id__in=keys).select_related('image').order_by('sort_order', 'pk'):
+            images[image.image_set_id].append(image)
+
+        return Promise.resolve([images[key] for key in keys])
@@ -1,8 +1,10 @@
 import graphene
 from graphene_django.types import DjangoObjectType
 
+from wagtailcommerce.graphql_api.loaders import ImageSetImagesLoader, RenditionLoader, get_loader
 from wagtailcommerce.utils.images import get_image_model
 from wagtailcommerce.products.models import Image, ImageSet
+from wagtailcommerce.products.renditions import get_srcset, get_srcset_specs
 
 from wagtail.images.models import Rendition
 
@@ -15,17 +17,23 @@ class RenditionType(DjangoObjectType):
         model = Rendition
 
 
+class ImageSourceType(graphene.ObjectType):
+    format = graphene.String()
+    mime_type = graphene.String()
+    srcset = graphene.String()
+    src = graphene.String()
+
+
 class WagtailImageType(DjangoObjectType):
     renditions = graphene.List(RenditionType, filter_specs=graphene.Argument(graphene.List(graphene.String)))
+    srcset = graphene.List(ImageSourceType)
 
     def resolve_renditions(self, info, filter_specs=[]):
-        params = {}
-
-        if filter_specs:
-            params['filter_spec__in'] = filter_specs
+        return get_loader(info.context, RenditionLoader).load((self.pk, tuple(sorted(set(filter_specs or [])))))
 
-        rend = self.renditions.filter(**params)
-        return rend
+    def resolve_srcset(self, info):
+        specs = tuple(sorted(spec for image_format, width, spec in get_srcset_specs()))
+        return get_loader(info.context, RenditionLoader).load((self.pk, specs)).then(get_srcset)
 
     class Meta:
         model = WagtailImage
@@ -53,10 +61,10 @@ class ImageSetType(DjangoObjectType):
         return self.object_id
 
     def resolve_images(self, info, limit=None):
-        images = self.images.all()
+        images = get_loader(info.context, ImageSetImagesLoader).load(self.pk)
 
         if limit:
-            return images[:limit]
+            return images.then(lambda images: images[:limit])
 
         return images
 
@@ -3,7 +3,7 @@ import graphene
 from wagtailcommerce.accounts.schema import UserQuery
 from wagtailcommerce.addresses.mutations import DeleteAddress, EditAddress
 from wagtailcommerce.carts.schema import CartQuery
-from wagtailcommerce.carts.mutations import AddToCart, ModifyCartLine, UpdateCartCoupon
+from wagtailcommerce.carts.mutations import AddToCart, ModifyCartLine, SetCartLines, UpdateCartCoupon
 from wagtailcommerce.products.schema import CategoriesQuery
 from wagtailcommerce.orders.schema import OrdersQuery
 from wagtailcommerce.orders.mutations import PlaceOrder
@@ -16,6 +16,7 @@ class WagtailCommerceMutations(graphene.ObjectType):
     delete_address = DeleteAddress.Field()
     place_order = PlaceOrder.Field()
     modify_cart_line = ModifyCartLine.Field()
+    set_cart_lines = SetCartLines.Field()
     update_cart_coupon = UpdateCartCoupon.Field()
 
 
@@ -0,0 +1,37 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from wagtailcommerce.graphql_api.loaders import schedule_renditions
+
+
+@override_settings(WAGTAILCOMMERCE_ASYNC_THUMBNAILS=True)
+class TestScheduleRenditions(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+        # The tasks module needs celery, which is optional
+        tasks = mock.Mock()
+        patcher = mock.patch.dict('sys.modules', {'wagtailcommerce.products.images': tasks})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.delay = tasks.generate_missing_renditions.delay
+
+    def test_renditions_are_scheduled_once(self):
+        schedule_renditions([(1, 'fill-100x100'), (2, 'fill-100x100')])
+        schedule_renditions([(1, 'fill-100x100'), (1, 'width-400')])
+        schedule_renditions([(2, 'fill-100x100')])
+
+        self.assertEqual(self.delay.call_args_list, [
+            mock.call([[1, 'fill-100x100'], [2, 'fill-100x100']]),
+            mock.call([[1, 'width-400']]),
+        ])
+
+    def test_renditions_are_scheduled_again_once_the_timeout_expires(self):
+        with override_settings(WAGTAILCOMMERCE_RENDITION_JOB_TIMEOUT=-1):
+            schedule_renditions([(1, 'fill-100x100')])
+            schedule_renditions([(1, 'fill-100x100')])
+
+        self.assertEqual(self.delay.call_count, 2)
@@ -1,6 +1,7 @@
 from __future__ import absolute_import, unicode_literals
 
-import shortuuid
+import string
+
 from django.conf import settings
 from django.contrib.postgres.fields import JSONField
 from django.db import models
@@ -14,7 +15,15 @@ from wagtail.admin.edit_handlers import (
 
 from wagtailcommerce.orders.signals import order_paid_signal, order_shipment_generation_failure_signal
 from wagtailcommerce.promotions.models import Coupon
+from wagtailcommerce.promotions.utils import invalidate_auto_assign_coupon
 from wagtailcommerce.utils.edit_handlers import ReadOnlyPanel
+from wagtailcommerce.utils.identifiers import get_identifier_allocator
+from wagtailcommerce.utils.query import PrefetchSpecificMixin
+
+
+def get_order_identifier_allocator():
+    return get_identifier_allocator(
+        Order, 'WAGTAILCOMMERCE_ORDER_IDENTIFIER_ALLOCATOR', alphabet=string.ascii_uppercase + string.digits)
 
 
 class Order(ClusterableModel):
@@ -129,23 +138,21 @@ class Order(ClusterableModel):
     ])
 
     def save(self, *args, **kwargs):
-        if not self.identifier:
-            self.identifier = self.generate_identifier()
-
         try:
             previous_state = Order.objects.get(pk=self.pk)
 
             if previous_state.status != 'paid' and self.status == 'paid':
-                # Order has been paid, reduce product stock and trigger event
-                for line in self.lines.all():
-                    variant = line.product_variant
-                    variant.stock = variant.stock - line.quantity
-                    variant.save(update_fields=['stock'])
+                # Order has been paid. Stock is taken out by the order_paid_signal
+                # receiver in wagtailcommerce.products, which converts its reservations.
 
                 # Update coupon amount
                 if self.coupon:
                     Coupon.objects.filter(pk=self.coupon.pk).update(times_used=models.F('times_used') + 1)
 
+                    if self.coupon.usage_limit is not None:
+                        # The coupon may have just reached its usage limit
+                        invalidate_auto_assign_coupon()
+
                 order_paid_signal.send(Order, order=self)
 
                 # If the order has shipping, generate shipment
@@ -158,17 +165,13 @@ class Order(ClusterableModel):
         except Order.DoesNotExist:
             pass
 
-        super().save(*args, **kwargs)
+        if self.identifier:
+            super().save(*args, **kwargs)
+        else:
+            get_order_identifier_allocator().save(self, super().save, *args, **kwargs)
 
     def generate_identifier(self):
-        shortuuid.set_alphabet('ABCDEFGHIJKLMNOPQRSTUVWXYZ1234567890')
-
-        while True:
-            uuid = shortuuid.uuid()[:8]
-            if not Order.objects.filter(identifier=uuid).exists():
-                break
-
-        return uuid
+        return get_order_identifier_allocator().generate()
 
     def product_count(self):
         o = Order.objects.filter(pk=self.pk).annotate(
@@ -186,6 +189,10 @@ class Order(ClusterableModel):
         ordering = ('-date_placed', )
 
 
+class OrderLineQuerySet(PrefetchSpecificMixin, models.QuerySet):
+    pass
+
+
 class OrderLine(models.Model):
     order = ParentalKey(Order, related_name='lines')
     sku = models.CharField(_('SKU'), max_length=128)
@@ -218,6 +225,8 @@ class OrderLine(models.Model):
     # Stores serialized custom product information
     product_details = JSONField()
 
+    objects = OrderLineQuerySet.as_manager()
+
     panels = [
         FieldRowPanel([
             ReadOnlyPanel('sku', heading=_('SKU')),
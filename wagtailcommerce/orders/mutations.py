@@ -5,10 +5,13 @@ from django.db import transaction
 from django.utils.translation import ugettext_lazy as _
 
 from wagtailcommerce.addresses.models import Address
+from wagtailcommerce.carts.storage import persist_cart
 from wagtailcommerce.carts.utils import get_cart_from_request, verify_cart_lines_stock
 from wagtailcommerce.orders.object_types import OrderObjectType
 from wagtailcommerce.orders.utils import create_order
 from wagtailcommerce.payments.models import PaymentMethod
+from wagtailcommerce.products.exceptions import InsufficientStock
+from wagtailcommerce.products.stock import reserve_order_stock
 from wagtailcommerce.promotions.utils import remove_coupon, verify_coupon
 from wagtailcommerce.shipping.models import ShippingMethod
 
@@ -24,7 +27,6 @@ class PlaceOrder(graphene.Mutation):
     order = graphene.Field(lambda: OrderObjectType)
     error = graphene.String()
 
-    @transaction.atomic
     def mutate(self, info, shipping_address_pk, billing_address_pk, shipping_method_pk, *args):
         try:
             shipping_address = Address.objects.get(user=info.context.user, pk=shipping_address_pk)
@@ -38,12 +40,15 @@ class PlaceOrder(graphene.Mutation):
 
         try:
             shipping_method = ShippingMethod.objects.for_shipping_address(
-                shipping_address, info.context.user).get(pk=shipping_method_pk).specific
+                shipping_address, info.context.user).select_specific().get(pk=shipping_method_pk)
         except ShippingMethod.DoesNotExist:
             raise Exception
 
         cart = get_cart_from_request(info.context)
 
+        # Carts kept outside the database are written to it once ordered
+        persist_cart(cart)
+
         place_order_error = ''
 
         if cart.coupon and not verify_coupon(cart.coupon):
@@ -62,12 +67,22 @@ class PlaceOrder(graphene.Mutation):
             place_order_error += variant_data['removal_reason_message']
 
         if place_order_error:
+            # The cart changes are kept, so customers can review them
             return PlaceOrder(error=place_order_error, success=False)
 
-        method = PaymentMethod.objects.specific().filter(active=True).first()
+        # Only the order and its stock reservation are committed together, before
+        # the payment provider is called, so stock slots aren't locked meanwhile
+        try:
+            with transaction.atomic():
+                order = create_order(info.context, shipping_address, billing_address, shipping_method)
+                reserve_order_stock(order)
 
-        order = create_order(info.context, shipping_address, billing_address, shipping_method)
+        except InsufficientStock as e:
+            return PlaceOrder(error=' '.join([
+                _('We\'re running out of "{}".').format(variant) for variant in e.variants
+            ]), success=False)
 
+        method = PaymentMethod.objects.select_specific().filter(active=True).first()
         payment_redirect_url = method.generate_payment_redirect_url(order, info.context.site.root_url)
 
         return PlaceOrder(success=True, order=order, payment_redirect_url=payment_redirect_url)
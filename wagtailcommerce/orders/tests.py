@@ -0,0 +1,79 @@
+from decimal import Decimal
+from unittest import mock
+
+import graphene
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.test import RequestFactory, TestCase
+from wagtail.core.models import Site
+
+from wagtailcommerce.addresses.models import Address
+from wagtailcommerce.carts.models import Cart, CartLine
+from wagtailcommerce.graphql_api.schema import WagtailCommerceMutations, WagtailCommerceQueries
+from wagtailcommerce.orders.models import Order
+from wagtailcommerce.products.exceptions import InsufficientStock
+from wagtailcommerce.products.models import Product, ProductVariant, StockReservation
+from wagtailcommerce.shipping_methods.flat_rate.models import FlatRateShippingMethod
+from wagtailcommerce.stores.models import Currency, Store
+
+PLACE_ORDER = '''
+mutation placeOrder($shipping: String, $billing: String, $method: String) {
+    placeOrder(shippingAddressPk: $shipping, billingAddressPk: $billing, shippingMethodPk: $method) {
+        success
+        error
+    }
+}
+'''
+
+
+class TestPlaceOrder(TestCase):
+    def setUp(self):
+        currency = Currency.objects.create(name='Peso', code='ARS', symbol='$')
+        self.store = Store.objects.create(name='Store', tax_rate=0, currency=currency, site=Site.objects.first())
+        self.user = get_user_model().objects.create(username='customer', email='customer@example.com')
+
+        product = Product.objects.create(
+            store=self.store, name='Hat', slug='hat', active=True, regular_price=Decimal('10.00'))
+        self.variant = ProductVariant.objects.create(product=product, sku='HAT', active=True, stock=10)
+
+        self.cart = Cart.objects.create(store=self.store, user=self.user)
+        CartLine.objects.create(cart=self.cart, variant=self.variant, quantity=2)
+
+        self.address = Address.objects.create(user=self.user, name='Customer', postal_code='1000')
+        self.shipping_method = FlatRateShippingMethod.objects.create(
+            store=self.store, title='Flat rate', enabled=True, enabled_for_administrators=False, sort_order=0,
+            shipping_rate=Decimal('5.00'), generate_shipping_label=False)
+
+    def place_order(self):
+        request = RequestFactory().post('/graphql')
+        request.user = self.user
+        request.store = self.store
+        request.session = SessionStore()
+        request.LANGUAGE_CODE = 'en'
+
+        schema = graphene.Schema(query=WagtailCommerceQueries, mutation=WagtailCommerceMutations)
+
+        # Plain variants describe themselves through their specific model
+        with mock.patch.object(ProductVariant, '__str__', lambda variant: variant.sku):
+            result = schema.execute(PLACE_ORDER, context=request, variables={
+                'shipping': str(self.address.pk), 'billing': str(self.address.pk),
+                'method': str(self.shipping_method.pk),
+            })
+
+        self.assertIsNone(result.errors)
+        return result.data['placeOrder']
+
+    def test_nothing_is_kept_when_stock_cant_be_reserved(self):
+        address_count = Address.objects.count()
+
+        # Another checkout reserves the stock after the cart was verified
+        with mock.patch('wagtailcommerce.orders.mutations.reserve_order_stock',
+                        side_effect=InsufficientStock([self.variant])):
+            result = self.place_order()
+
+        self.assertFalse(result['success'])
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(Address.objects.count(), address_count)
+        self.assertEqual(Cart.objects.get(pk=self.cart.pk).status, Cart.OPEN)
+        self.assertEqual(list(self.cart.lines.values_list('variant_id', 'quantity')), [(self.variant.pk, 2)])
@@ -11,6 +11,10 @@ from wagtailcommerce.carts.utils import (
     cart_awaiting_payment, cart_paid, get_cart_from_request)
 from wagtailcommerce.orders.models import Order, OrderLine
 from wagtailcommerce.orders.signals import order_shipment_generated_signal
+from wagtailcommerce.products.renditions import get_order_thumbnail_spec
+from wagtailcommerce.products.stock import release_order_stock
+from wagtailcommerce.products.variant_images import prefetch_variant_images
+from wagtailcommerce.utils.query import prefetch_specific
 
 
 def create_order(request, shipping_address, billing_address, shipping_method, cart=None):
@@ -27,7 +31,7 @@ def create_order(request, shipping_address, billing_address, shipping_method, ca
     order_billing_address.user = None
     order_billing_address.save()
 
-    totals = cart.get_totals_with_shipping(shipping_address, shipping_method)
+    pricing = cart.get_pricing(shipping_address, shipping_method)
 
     order = Order.objects.create(
         cart=cart,
@@ -40,21 +44,25 @@ def create_order(request, shipping_address, billing_address, shipping_method, ca
         user=request.user,
         shipping_address=order_shipping_address,
         billing_address=order_billing_address,
-        subtotal=totals['subtotal'],
-        product_discount=totals['discount'],
+        subtotal=pricing.subtotal,
+        product_discount=pricing.discount,
         product_tax=Decimal('0'),
-        shipping_cost=totals['shipping_cost'],
-        shipping_cost_discount=totals['shipping_cost_discount'],
-        shipping_cost_total=totals['shipping_cost_total'],
+        shipping_cost=pricing.shipping_cost,
+        shipping_cost_discount=pricing.shipping_cost_discount,
+        shipping_cost_total=pricing.shipping_cost_total,
         shipping_method=shipping_method,
-        total=totals['total'],
-        total_inc_tax=totals['total'],
+        total=pricing.total,
+        total_inc_tax=pricing.total,
         language_code=request.LANGUAGE_CODE
     )
 
     order_lines = []
 
-    for line in cart.lines.select_related('variant', 'variant__product').all():
+    prefetch_specific([line_pricing.line for line_pricing in pricing.lines], 'variant', 'variant__product')
+    prefetch_variant_images([line_pricing.line for line_pricing in pricing.lines])
+
+    for line_pricing in pricing.lines:
+        line = line_pricing.line
         variant = line.variant.specific
         product = variant.product
 
@@ -63,13 +71,13 @@ def create_order(request, shipping_address, billing_address, shipping_method, ca
             sku=variant.sku,
             product_variant=variant,
             quantity=line.quantity,
-            item_unit_price=line.get_item_unit_price(),
-            item_unit_regular_price=line.get_item_unit_regular_price(),
-            item_unit_sale_price=line.get_item_unit_sale_price(),
-            item_percentage_discount=product.percentage_discount,
-            item_unit_promotions_discount=line.get_item_unit_promotions_discount(),
-            item_unit_price_with_promotions_discount=line.get_item_unit_price_with_promotions_discount(),
-            line_total=line.get_total(),
+            item_unit_price=line_pricing.unit_price,
+            item_unit_regular_price=line_pricing.unit_regular_price,
+            item_unit_sale_price=line_pricing.unit_sale_price,
+            item_percentage_discount=line_pricing.percentage_discount,
+            item_unit_promotions_discount=line_pricing.unit_promotions_discount,
+            item_unit_price_with_promotions_discount=line_pricing.unit_price_with_promotions_discount,
+            line_total=line_pricing.total,
             product_name=product.name,
             product_variant_description=variant.__str__(),
             product_details=variant.get_details(),
@@ -82,7 +90,7 @@ def create_order(request, shipping_address, billing_address, shipping_method, ca
         image = line.get_image()
 
         if image:
-            source_file = image.get_rendition('max-400x400|format-jpeg|bgcolor-ffffff')
+            source_file = image.get_rendition(get_order_thumbnail_spec())
             if source_file.file:
                 try:
                     file_content = ContentFile(source_file.file.read())
@@ -149,3 +157,4 @@ def order_shipment_generated(order):
 
 def order_cancelled(order):
     modify_order_status(order, Order.CANCELLED)
+    release_order_stock(order)
@@ -1,9 +1,13 @@
 from django.db.models import QuerySet
 
-from wagtailcommerce.utils.query import SpecificIterable
+from wagtailcommerce.utils.query import SelectSpecificMixin, SpecificIterable
 
 
-class PaymentMethodQuerySet(QuerySet):
+class PaymentMethodQuerySet(SelectSpecificMixin, QuerySet):
+    def get_specific_model_classes(self):
+        from wagtailcommerce.payments.models import PAYMENT_METHOD_MODEL_CLASSES
+        return PAYMENT_METHOD_MODEL_CLASSES
+
     def specific(self):
         """
         This efficiently gets all the specific objects for the queryset, using
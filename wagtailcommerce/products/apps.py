@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save
 from django.utils.translation import ugettext_lazy as _
 
 
@@ -6,3 +7,10 @@ class ProductsAppConfig(AppConfig):
     name = 'wagtailcommerce.products'
     label = 'wagtailcommerce_products'
     verbose_name = _('Wagtail Commerce Products')
+
+    def ready(self):
+        from wagtailcommerce.products.models import PRODUCT_VARIANT_MODEL_CLASSES, variant_saved
+
+        # Every variant model is registered by now
+        for model in PRODUCT_VARIANT_MODEL_CLASSES:
+            post_save.connect(variant_saved, sender=model)
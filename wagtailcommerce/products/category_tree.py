@@ -0,0 +1,187 @@
+from __future__ import absolute_import, unicode_literals
+
+import time
+import uuid
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+CATEGORY_TREE_CACHE_KEY = 'wagtailcommerce:category_tree:{}:{}'
+CATEGORY_TREE_VERSION_KEY = 'wagtailcommerce:category_tree_version:{}'
+
+# Trees built by this process, by store pk. Checked against the shared version
+# key at most every WAGTAILCOMMERCE_CATEGORY_TREE_CHECK_INTERVAL seconds, so
+# they're dropped shortly after another process invalidates them.
+_trees = {}
+
+DEFAULT_CATEGORY_TREE_CHECK_INTERVAL = 5
+
+
+def get_cache():
+    return caches[getattr(settings, 'WAGTAILCOMMERCE_CATEGORY_TREE_CACHE', 'default')]
+
+
+class CategoryTree(object):
+    """
+    Read-only snapshot of a store's categories, built from their treebeard paths.
+
+    Categories are kept sorted by path, so each subtree is a contiguous slice;
+    ancestors, descendants and path strings are looked up without queries.
+    """
+    def __init__(self, store_pk, rows, version=None):
+        self.store_pk = store_pk
+        self.version = version
+        # When the version was last known to be current
+        self.checked = time.monotonic()
+
+        # rows are (pk, path, name, slug) tuples sorted by path
+        self.pks = [pk for pk, path, name, slug in rows]
+        self.position = {}
+        self.paths = {}
+        self.parent = {}
+        self.ancestors = {}
+        self.names = {}
+        self.slugs = {}
+        self.subtree_end = {}
+        self.children = {}
+        self.roots = []
+
+        stack = []
+
+        for i, (pk, path, name, slug) in enumerate(rows):
+            while stack and not path.startswith(stack[-1][1]):
+                self.subtree_end[stack.pop()[0]] = i
+
+            parent = stack[-1][0] if stack else None
+
+            self.position[pk] = i
+            self.paths[pk] = path
+            self.parent[pk] = parent
+            self.ancestors[pk] = self.ancestors[parent] + (parent, ) if parent else ()
+            self.names[pk] = name
+            self.slugs[pk] = slug
+            self.children[pk] = []
+
+            if parent:
+                self.children[parent].append(pk)
+            else:
+                self.roots.append(pk)
+
+            stack.append((pk, path))
+
+        for pk, path in stack:
+            self.subtree_end[pk] = len(rows)
+
+        self.path_strings = {
+            pk: ' » '.join([self.names[ancestor] for ancestor in self.ancestors[pk]] + [self.names[pk]])
+            for pk in self.pks
+        }
+
+        self._payloads = {}
+
+    def __contains__(self, pk):
+        return pk in self.position
+
+    def get_ancestor_pks(self, pk):
+        """
+        Return the pks of a category's ancestors, root first.
+        """
+        return self.ancestors[pk]
+
+    def get_descendant_pks(self, pk, include_self=False):
+        start = self.position[pk]
+        return self.pks[start if include_self else start + 1:self.subtree_end[pk]]
+
+    def get_children_pks(self, pk):
+        return self.children[pk]
+
+    def get_path(self, pk):
+        """
+        Return the names of a category and its ancestors, root first.
+        """
+        return [self.names[ancestor] for ancestor in self.ancestors[pk]] + [self.names[pk]]
+
+    def get_path_string(self, pk):
+        return self.path_strings[pk]
+
+    def serialize(self, pk, depth, max_depth):
+        return {
+            'id': pk,
+            'name': self.names[pk],
+            'slug': self.slugs[pk],
+            'children': [
+                self.serialize(child, depth + 1, max_depth) for child in self.children[pk]
+            ] if max_depth is None or depth < max_depth else []
+        }
+
+    def get_payload(self, depth=None):
+        """
+        Return the tree as nested dicts, down to depth levels if given.
+        Payloads are built once per depth and shared, so they must not be modified.
+        """
+        if depth not in self._payloads:
+            self._payloads[depth] = [self.serialize(pk, 1, depth) for pk in self.roots]
+
+        return self._payloads[depth]
+
+
+def get_category_tree_version(store_pk):
+    cache = get_cache()
+    version_key = CATEGORY_TREE_VERSION_KEY.format(store_pk)
+    version = cache.get(version_key)
+
+    if version is None:
+        version = uuid.uuid4().hex
+
+        if not cache.add(version_key, version, None):
+            version = cache.get(version_key, version)
+
+    return version
+
+
+def get_category_tree(store_pk):
+    """
+    Return the CategoryTree of a store, from this process' memo if it's still
+    current, then from the cache, then from the database. The memo is used
+    without reading the version from the cache for a few seconds after it's
+    checked, so labelling many categories doesn't cost a cache get each.
+    """
+    tree = _trees.get(store_pk)
+    interval = getattr(settings, 'WAGTAILCOMMERCE_CATEGORY_TREE_CHECK_INTERVAL', DEFAULT_CATEGORY_TREE_CHECK_INTERVAL)
+
+    if tree is not None and time.monotonic() - tree.checked < interval:
+        return tree
+
+    version = get_category_tree_version(store_pk)
+
+    if tree is not None and tree.version == version:
+        tree.checked = time.monotonic()
+        return tree
+
+    cache = get_cache()
+    cache_key = CATEGORY_TREE_CACHE_KEY.format(store_pk, version)
+    rows = cache.get(cache_key)
+
+    if rows is None:
+        Category = apps.get_model('wagtailcommerce_products', 'Category')
+        rows = list(Category.objects.filter(store_id=store_pk).order_by('path').values_list(
+            'pk', 'path', 'name', 'slug'))
+        cache.set(cache_key, rows, getattr(settings, 'WAGTAILCOMMERCE_CATEGORY_TREE_CACHE_TIMEOUT', None))
+
+    tree = _trees[store_pk] = CategoryTree(store_pk, rows, version=version)
+    return tree
+
+
+def invalidate_category_tree(store_pk):
+    """
+    Make every process rebuild a store's category tree on next access.
+    Invalidated again on commit, so trees rebuilt from uncommitted data don't stick.
+    """
+    def bump_version():
+        get_cache().set(CATEGORY_TREE_VERSION_KEY.format(store_pk), uuid.uuid4().hex, None)
+        _trees.pop(store_pk, None)
+
+    bump_version()
+    transaction.on_commit(bump_version)
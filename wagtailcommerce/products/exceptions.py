@@ -0,0 +1,11 @@
+class CatalogImportError(Exception):
+    pass
+
+
+class InsufficientStock(Exception):
+    """
+    Raised when variants don't have enough available stock for an order.
+    """
+    def __init__(self, variants):
+        self.variants = variants
+        super().__init__(variants)
@@ -0,0 +1,69 @@
+from __future__ import absolute_import, unicode_literals
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Count, F, Q
+
+from wagtailcommerce.products.models import Product, ProductVariant
+
+# Lower bounds of the price facet buckets, the last one is open ended
+DEFAULT_PRICE_FACET_BUCKETS = (0, 25, 50, 100, 250, 500)
+
+
+def get_price_buckets():
+    """
+    Return (min price, max price) pairs from WAGTAILCOMMERCE_PRICE_FACET_BUCKETS.
+    """
+    bounds = [Decimal(bound) for bound in getattr(
+        settings, 'WAGTAILCOMMERCE_PRICE_FACET_BUCKETS', DEFAULT_PRICE_FACET_BUCKETS)]
+
+    return list(zip(bounds, bounds[1:] + [None]))
+
+
+def get_category_counts(products):
+    """
+    Return (category pk, store pk, product count) for every category of products, in one query.
+    """
+    return list(Product.categories.through.objects.filter(
+        product_id__in=products.order_by().values('pk')
+    ).values_list('category_id', 'category__store_id').annotate(count=Count('product_id')).order_by())
+
+
+def get_product_facets(products):
+    """
+    Count products per category, per price bucket (on effective_price) and
+    with variants in stock, with two aggregate queries.
+    """
+    buckets = get_price_buckets()
+    in_stock_product_pks = ProductVariant.objects.filter(
+        active=True, stock__gt=F('reserved_stock')).values('product_id')
+
+    # Filtering on categories may join products more than once, hence the distinct counts
+    aggregates = {
+        'total': Count('pk', distinct=True),
+        'in_stock': Count('pk', distinct=True, filter=Q(pk__in=in_stock_product_pks)),
+    }
+
+    for i, (min_price, max_price) in enumerate(buckets):
+        price_filter = Q(effective_price__gte=min_price)
+
+        if max_price is not None:
+            price_filter &= Q(effective_price__lt=max_price)
+
+        aggregates['price_{}'.format(i)] = Count('pk', distinct=True, filter=price_filter)
+
+    counts = products.order_by().aggregate(**aggregates)
+
+    return {
+        'total': counts['total'],
+        'in_stock': counts['in_stock'],
+        'prices': [
+            {'min_price': min_price, 'max_price': max_price, 'count': counts['price_{}'.format(i)]}
+            for i, (min_price, max_price) in enumerate(buckets)
+        ],
+        'categories': [
+            {'category_id': category_pk, 'store_id': store_pk, 'count': count}
+            for category_pk, store_pk, count in get_category_counts(products)
+        ]
+    }
@@ -7,7 +7,20 @@ if getattr(settings, 'WAGTAILCOMMERCE_ASYNC_THUMBNAILS', False):
     @shared_task(name='wagtailcommerce_generate_image_renditions')
     def generate_renditions(image):
         """
-        Get or generate product image renditions asynchronously.
+        Generate product image renditions asynchronously, skipping existing ones.
         """
-        for name, spec in image.image_set.product.specific.image_renditions.items():
-            print(image.image.get_rendition(spec).url)
+        from wagtailcommerce.products.renditions import generate_rendition_chunk, get_product_rendition_specs
+
+        if image.image_id:
+            generate_rendition_chunk([
+                (image.image_id, spec) for spec in get_product_rendition_specs(image.image_set.product.content_type_id)
+            ])
+
+    @shared_task(name='wagtailcommerce_generate_missing_renditions')
+    def generate_missing_renditions(jobs):
+        """
+        Generate renditions of [Wagtail image pk, filter spec] pairs, skipping existing ones.
+        """
+        from wagtailcommerce.products.renditions import generate_rendition_chunk
+
+        generate_rendition_chunk([(image_pk, spec) for image_pk, spec in jobs])
@@ -0,0 +1,322 @@
+from __future__ import absolute_import, unicode_literals
+
+import csv
+import json
+from collections import defaultdict
+from functools import partial
+
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import models, transaction
+from django.db.models import Q
+from django.utils.text import slugify
+from wagtail.search.backends import get_search_backends
+
+from wagtailcommerce.products.exceptions import CatalogImportError
+from wagtailcommerce.products.models import (
+    PRODUCT_MODEL_CLASSES, PRODUCT_VARIANT_MODEL_CLASSES, Category, Product, ProductVariant,
+    get_product_identifier_allocator)
+from wagtailcommerce.products.variant_images import update_variant_images
+from wagtailcommerce.utils.bulk import bulk_create_inherited
+
+CATEGORY = 'category'
+PRODUCT = 'product'
+VARIANT = 'variant'
+
+# Row keys handled by the importer rather than mapped to model fields
+RESERVED_KEYS = {'kind', 'type', 'ref', 'product', 'categories', 'parent'}
+
+TRUE_VALUES = {'1', 't', 'true', 'y', 'yes'}
+
+
+def read_csv_rows(f):
+    """
+    Yield rows from a CSV file with a header. Multiple categories are separated by "|".
+    """
+    for row in csv.DictReader(f):
+        if row.get('categories'):
+            row['categories'] = row['categories'].split('|')
+
+        yield row
+
+
+def read_jsonl_rows(f):
+    """
+    Yield rows from a file with one JSON object per line.
+    """
+    for line in f:
+        line = line.strip()
+
+        if line:
+            yield json.loads(line)
+
+
+class CatalogImporter(object):
+    """
+    Bulk load categories, products and variants into a store from rows.
+
+    Every row has a ``kind`` (category, product or variant). Product and
+    variant rows name their model in ``type`` (e.g. ``shop.Shoe``), and their
+    remaining keys are model field names. Products need a ``ref`` or an
+    identifier (the ref defaults to it), and may have a list of category slugs
+    in ``categories``; variants point at their product's ref in ``product``.
+    Refs are stored as the products' ``import_ref``, so imports can be re-run.
+
+    Products and variants are buffered and inserted batch_size at a time,
+    with their category links, skipping refs, identifiers and SKUs that already
+    exist. Products are added to the search index once everything is loaded.
+    """
+    def __init__(self, store, batch_size=1000, update_index=True):
+        self.store = store
+        self.batch_size = batch_size
+        self.update_index = update_index
+
+        self.category_pks = {}
+        for pk, slug in Category.objects.filter(store=store).order_by('path').values_list('pk', 'slug'):
+            self.category_pks.setdefault(slug, pk)
+
+        self.product_pks = {}
+        self.pending_products = []
+        self.pending_variants = []
+        self.imported_product_pks = defaultdict(list)
+
+        self.counts = defaultdict(int)
+
+    def get_model(self, row, model_classes):
+        try:
+            model = apps.get_model(row.get('type') or '')
+        except (LookupError, ValueError):
+            raise CatalogImportError('Unknown model type "{}"'.format(row.get('type')))
+
+        if model not in model_classes:
+            raise CatalogImportError('"{}" is not a {} model'.format(row['type'], row['kind']))
+
+        return model
+
+    def get_field_values(self, model, row):
+        """
+        Convert a row's values to model field values, keyed by attname.
+        """
+        values = {}
+
+        for key, value in row.items():
+            if key in RESERVED_KEYS or value is None or value == '':
+                continue
+
+            try:
+                field = model._meta.get_field(key)
+            except FieldDoesNotExist:
+                raise CatalogImportError('Unknown field "{}" for {}'.format(key, model._meta.label))
+
+            if field.many_to_many or field.one_to_many or field.primary_key:
+                raise CatalogImportError('Field "{}" can\'t be imported'.format(key))
+
+            if field.is_relation:
+                values[field.attname] = value
+            elif isinstance(field, models.BooleanField) and isinstance(value, str):
+                values[field.attname] = value.strip().lower() in TRUE_VALUES
+            else:
+                try:
+                    values[field.attname] = field.to_python(value)
+                except ValidationError as e:
+                    raise CatalogImportError('Invalid value for "{}": {}'.format(key, ' '.join(e.messages)))
+
+        return values
+
+    def import_rows(self, rows):
+        for row in rows:
+            kind = row.get('kind')
+
+            if kind == CATEGORY:
+                self.import_category(row)
+            elif kind == PRODUCT:
+                self.add_product(row)
+            elif kind == VARIANT:
+                self.add_variant(row)
+            else:
+                raise CatalogImportError('Unknown row kind "{}"'.format(kind))
+
+        self.flush_products()
+        self.flush_variants()
+
+        if self.update_index:
+            self.index_products()
+
+        return self.counts
+
+    def import_category(self, row):
+        if not row.get('slug'):
+            raise CatalogImportError('Category "{}" has no slug'.format(row.get('name', '')))
+
+        # Categories are few and live in a tree, so they're created one by one
+        if row['slug'] in self.category_pks:
+            self.counts['categories_skipped'] += 1
+            return
+
+        values = self.get_field_values(Category, row)
+        values.update(store=self.store)
+
+        if row.get('parent'):
+            try:
+                parent = Category.objects.get(pk=self.category_pks[row['parent']])
+            except KeyError:
+                raise CatalogImportError('Unknown parent category "{}"'.format(row['parent']))
+
+            category = parent.add_child(**values)
+        else:
+            category = Category.add_root(**values)
+
+        self.category_pks[category.slug] = category.pk
+        self.counts['categories'] += 1
+
+    def add_product(self, row):
+        model = self.get_model(row, PRODUCT_MODEL_CLASSES)
+
+        values = self.get_field_values(model, row)
+        values.update(store_id=self.store.pk, content_type_id=ContentType.objects.get_for_model(model).pk)
+        values.setdefault('active', False)
+
+        if not values.get('slug'):
+            values['slug'] = slugify(values.get('name', ''), allow_unicode=True)
+
+        categories = row.get('categories') or []
+        if isinstance(categories, str):
+            categories = categories.split('|')
+
+        try:
+            category_pks = [self.category_pks[slug] for slug in categories]
+        except KeyError as e:
+            raise CatalogImportError('Unknown category "{}"'.format(e.args[0]))
+
+        ref = row.get('ref') or values.get('identifier')
+        if not ref:
+            raise CatalogImportError('Product "{}" has no ref or identifier'.format(values.get('name', '')))
+
+        product = model(import_ref=ref, **values)
+        product.effective_price = product.get_effective_price()
+        self.pending_products.append((product, ref, category_pks))
+
+        if len(self.pending_products) >= self.batch_size:
+            self.flush_products()
+
+    def add_variant(self, row):
+        model = self.get_model(row, PRODUCT_VARIANT_MODEL_CLASSES)
+
+        values = self.get_field_values(model, row)
+        values.update(content_type_id=ContentType.objects.get_for_model(model).pk)
+        values.setdefault('active', True)
+
+        self.pending_variants.append((model(**values), row.get('product')))
+
+        if len(self.pending_variants) >= self.batch_size:
+            self.flush_variants()
+
+    @transaction.atomic
+    def flush_products(self):
+        pending, self.pending_products = self.pending_products, []
+
+        existing_refs, existing_identifiers = self.get_existing_product_pks(
+            [ref for product, ref, category_pks in pending],
+            [product.identifier for product, ref, category_pks in pending if product.identifier])
+
+        new = []
+        for product, ref, category_pks in pending:
+            if ref in existing_refs or product.identifier in existing_identifiers:
+                self.product_pks[ref] = existing_refs.get(ref) or existing_identifiers[product.identifier]
+                self.counts['products_skipped'] += 1
+            else:
+                new.append((product, ref, category_pks))
+
+        # Identifiers are unique across stores
+        taken_identifier = Product.objects.filter(
+            identifier__in=[product.identifier for product, ref, category_pks in new if product.identifier]
+        ).values_list('identifier', flat=True).first()
+
+        if taken_identifier:
+            raise CatalogImportError('Identifier "{}" belongs to another store\'s product'.format(taken_identifier))
+
+        allocator = get_product_identifier_allocator()
+        products_by_model = defaultdict(list)
+
+        for product, ref, category_pks in new:
+            products_by_model[type(product)].append(product)
+
+        for model, products in products_by_model.items():
+            allocator.bulk_create(products, create_func=partial(bulk_create_inherited, model))
+            self.imported_product_pks[model].extend(product.pk for product in products)
+
+        category_links = []
+        for product, ref, category_pks in new:
+            self.product_pks[ref] = product.pk
+
+            for category_pk in category_pks:
+                category_links.append(Product.categories.through(product_id=product.pk, category_id=category_pk))
+
+        Product.categories.through.objects.bulk_create(category_links, ignore_conflicts=True)
+        self.counts['products'] += len(new)
+
+    @transaction.atomic
+    def flush_variants(self):
+        # Variants may point at products still waiting to be inserted
+        self.flush_products()
+
+        pending, self.pending_variants = self.pending_variants, []
+
+        missing_refs = {ref for variant, ref in pending if ref not in self.product_pks}
+        if missing_refs:
+            self.product_pks.update(self.get_existing_product_pks(missing_refs, [])[0])
+
+        existing_skus = set(ProductVariant.objects.filter(
+            sku__in=[variant.sku for variant, ref in pending]).values_list('sku', flat=True))
+
+        variants_by_model = defaultdict(list)
+
+        for variant, ref in pending:
+            if variant.sku in existing_skus:
+                self.counts['variants_skipped'] += 1
+                continue
+
+            if ref not in self.product_pks:
+                raise CatalogImportError('Unknown product "{}" for variant "{}"'.format(ref, variant.sku))
+
+            variant.product_id = self.product_pks[ref]
+            variants_by_model[type(variant)].append(variant)
+
+        for model, variants in variants_by_model.items():
+            bulk_create_inherited(model, variants)
+            self.counts['variants'] += len(variants)
+
+        # bulk_create_inherited sends no post_save, which matches variants with their images
+        update_variant_images(ProductVariant.objects.filter(
+            pk__in=[variant.pk for variants in variants_by_model.values() for variant in variants]))
+
+    def get_existing_product_pks(self, refs, identifiers):
+        """
+        Return the pks of the store's products already imported with refs, and of
+        those having identifiers, as two dicts keyed by ref and by identifier.
+        """
+        refs, identifiers = set(refs), set(identifiers)
+        existing_refs = {}
+        existing_identifiers = {}
+
+        for pk, import_ref, identifier in Product.objects.filter(
+                Q(import_ref__in=refs) | Q(identifier__in=identifiers), store=self.store
+        ).values_list('pk', 'import_ref', 'identifier'):
+            if import_ref in refs:
+                existing_refs[import_ref] = pk
+
+            if identifier in identifiers:
+                existing_identifiers[identifier] = pk
+
+        return existing_refs, existing_identifiers
+
+    def index_products(self):
+        backends = list(get_search_backends(with_auto_update=True))
+
+        for model, pks in self.imported_product_pks.items():
+            for start in range(0, len(pks), self.batch_size):
+                products = list(model.get_indexed_objects().filter(pk__in=pks[start:start + self.batch_size]))
+
+                for backend in backends:
+                    backend.add_bulk(model, products)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from wagtailcommerce.products.stock import compact_inventory_movements, rebuild_stock_totals
+
+
+class Command(BaseCommand):
+    help = 'Folds inventory movements into the stock of their product variants'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--rebuild-totals', action='store_true',
+            help='Then set the stock of variants kept at locations to the total of their locations')
+
+    def handle(self, *args, **options):
+        compacted = compact_inventory_movements(batch_size=options['batch_size'])
+
+        self.stdout.write('{} inventory movements compacted'.format(compacted))
+
+        if options['rebuild_totals']:
+            self.stdout.write('{} variant totals rebuilt'.format(rebuild_stock_totals()))
@@ -0,0 +1,50 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wagtailcommerce.products.exceptions import CatalogImportError
+from wagtailcommerce.products.importing import CatalogImporter, read_csv_rows, read_jsonl_rows
+from wagtailcommerce.stores.models import Store
+
+
+class Command(BaseCommand):
+    help = 'Bulk imports categories, products and variants from a CSV or JSON lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or "-" to read from standard input')
+        parser.add_argument('--store', type=int, required=True, help='Primary key of the store to import into')
+        parser.add_argument(
+            '--format', choices=['csv', 'jsonl'],
+            help='File format, guessed from the file extension if not given')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--skip-index', action='store_true', help='Don\'t add imported products to the search index')
+
+    def handle(self, *args, **options):
+        try:
+            store = Store.objects.get(pk=options['store'])
+        except Store.DoesNotExist:
+            raise CommandError('Store {} not found'.format(options['store']))
+
+        file_format = options['format']
+        if not file_format:
+            file_format = 'csv' if options['path'].endswith('.csv') else 'jsonl'
+
+        read_rows = read_csv_rows if file_format == 'csv' else read_jsonl_rows
+
+        importer = CatalogImporter(
+            store, batch_size=options['batch_size'], update_index=not options['skip_index'])
+
+        f = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8')
+
+        try:
+            counts = importer.import_rows(read_rows(f))
+        except CatalogImportError as e:
+            raise CommandError(e)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+        for kind in ('categories', 'products', 'variants'):
+            self.stdout.write('{}: {} imported, {} skipped'.format(
+                kind.capitalize(), counts[kind], counts['{}_skipped'.format(kind)]))
@@ -0,0 +1,38 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from wagtailcommerce.products.related import rebuild_related_products
+
+
+class Command(BaseCommand):
+    help = 'Recomputes related products from paid orders and shared categories'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            help='Only recompute products bought since this date (YYYY-MM-DD or ISO 8601 date and time)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        since = None
+
+        if options['since']:
+            since = parse_datetime(options['since'])
+
+            if since is None:
+                since_date = parse_date(options['since'])
+
+                if since_date is None:
+                    raise CommandError('Invalid date "{}"'.format(options['since']))
+
+                since = datetime.datetime.combine(since_date, datetime.time.min)
+
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+
+        pair_count = rebuild_related_products(since=since, batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS('{} related product pairs computed'.format(pair_count)))
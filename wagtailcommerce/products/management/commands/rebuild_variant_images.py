@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from wagtailcommerce.products.variant_images import rebuild_variant_images
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the lookup table of product variant images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        variant_count = rebuild_variant_images(batch_size=options['batch_size'])
+
+        self.stdout.write('Images of {} variants rebuilt'.format(variant_count))
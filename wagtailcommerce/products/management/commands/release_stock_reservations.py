@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from wagtailcommerce.products.stock import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = 'Returns the stock held by expired reservations of unpaid orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        released = release_expired_reservations(batch_size=options['batch_size'])
+
+        self.stdout.write('{} reservations released'.format(released))
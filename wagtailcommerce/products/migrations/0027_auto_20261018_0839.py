@@ -0,0 +1,17 @@
+# Generated by Django 2.2.5 on 2026-10-18 13:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcommerce_products', '0026_auto_20200914_1313'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['featured', 'created', 'id'], name='product_listing_idx'),
+        ),
+    ]
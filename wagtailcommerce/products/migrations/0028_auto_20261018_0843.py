@@ -0,0 +1,36 @@
+# Generated by Django 2.2.5 on 2026-10-18 13:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcommerce_products', '0027_auto_20261018_0839'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedProduct',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('co_purchases', models.PositiveIntegerField(default=0, verbose_name='times bought together')),
+                ('shared_categories', models.PositiveIntegerField(default=0, verbose_name='shared categories')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_products', to='wagtailcommerce_products.Product')),
+                ('related_product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wagtailcommerce_products.Product')),
+            ],
+            options={
+                'verbose_name': 'related product',
+                'verbose_name_plural': 'related products',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='relatedproduct',
+            index=models.Index(fields=['product', '-co_purchases', '-shared_categories'], name='related_product_score_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='relatedproduct',
+            unique_together={('product', 'related_product')},
+        ),
+    ]
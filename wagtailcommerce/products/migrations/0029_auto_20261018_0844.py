@@ -0,0 +1,42 @@
+# Generated by Django 2.2.5 on 2026-10-18 13:44
+
+from django.db import migrations, models
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, NullIf
+
+
+def forwards_func(apps, schema_editor):
+    # Same computation as wagtailcommerce.products.query.get_effective_price_expression
+    Product = apps.get_model('wagtailcommerce_products', 'Product')
+    db_alias = schema_editor.connection.alias
+
+    Product.objects.using(db_alias).update(effective_price=Coalesce(
+        F('regular_price') - NullIf(F('percentage_discount'), Value(0)) / Value(100) * F('regular_price'),
+        NullIf(F('sale_price'), Value(0)),
+        F('regular_price'),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2)
+    ))
+
+
+def reverse_func(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcommerce_products', '0028_auto_20261018_0843'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=12, null=True, verbose_name='effective price'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['effective_price', 'id'], name='product_price_idx'),
+        ),
+        migrations.RunPython(forwards_func, reverse_func),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.5 on 2026-10-18 08:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcommerce_products', '0029_auto_20261018_0844'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['path'], name='category_path_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
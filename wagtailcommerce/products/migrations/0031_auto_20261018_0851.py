@@ -0,0 +1,35 @@
+# Generated by Django 2.2.5 on 2026-10-18 08:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcommerce_orders', '0027_auto_20201005_0025'),
+        ('wagtailcommerce_products', '0030_auto_20261018_0847'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productvariant',
+            name='reserved_stock',
+            field=models.IntegerField(default=0, editable=False, verbose_name='reserved stock'),
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(verbose_name='quantity')),
+                ('expires', models.DateTimeField(db_index=True, verbose_name='expires')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='created on')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservations', to='wagtailcommerce_orders.Order')),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservations', to='wagtailcommerce_products.ProductVariant')),
+            ],
+            options={
+                'verbose_name': 'stock reservation',
+                'verbose_name_plural': 'stock reservations',
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.5 on 2026-10-18 08:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcommerce_orders', '0027_auto_20201005_0025'),
+        ('wagtailcommerce_products', '0031_auto_20261018_0851'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryMovement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(help_text='negative for units leaving stock', verbose_name='quantity')),
+                ('reserved_quantity', models.PositiveIntegerField(default=0, help_text='reserved units released by this movement', verbose_name='reserved quantity')),
+                ('reason', models.CharField(choices=[('sale', 'Sale'), ('adjustment', 'Adjustment'), ('sync', 'Sync'), ('return', 'Return')], max_length=20, verbose_name='reason')),
+                ('note', models.CharField(blank=True, max_length=255, verbose_name='note')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='created on')),
+                ('compacted', models.DateTimeField(blank=True, null=True, verbose_name='compacted on')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='inventory_movements', to='wagtailcommerce_orders.Order', verbose_name='order')),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_movements', to='wagtailcommerce_products.ProductVariant')),
+            ],
+            options={
+                'verbose_name': 'inventory movement',
+                'verbose_name_plural': 'inventory movements',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='inventorymovement',
+            index=models.Index(condition=models.Q(compacted__isnull=True), fields=['variant'], name='inventory_pending_idx'),
+        ),
+    ]
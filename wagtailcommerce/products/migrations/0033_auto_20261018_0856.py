@@ -0,0 +1,49 @@
+# Generated by Django 2.2.5 on 2026-10-18 08:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcommerce_stores', '0003_auto_20190910_1353'),
+        ('wagtailcommerce_products', '0032_auto_20261018_0854'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockLocation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=128, verbose_name='name')),
+                ('priority', models.PositiveIntegerField(default=0, verbose_name='priority')),
+                ('active', models.BooleanField(default=True, verbose_name='active')),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_locations', to='wagtailcommerce_stores.Store', verbose_name='store')),
+            ],
+            options={
+                'verbose_name': 'stock location',
+                'verbose_name_plural': 'stock locations',
+                'ordering': ('priority', 'pk'),
+            },
+        ),
+        migrations.AddField(
+            model_name='inventorymovement',
+            name='location',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='inventory_movements', to='wagtailcommerce_products.StockLocation', verbose_name='location'),
+        ),
+        migrations.CreateModel(
+            name='LocationStock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(default=0, verbose_name='quantity')),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock', to='wagtailcommerce_products.StockLocation')),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='location_stock', to='wagtailcommerce_products.ProductVariant')),
+            ],
+            options={
+                'verbose_name': 'location stock',
+                'verbose_name_plural': 'location stock',
+                'unique_together': {('variant', 'location')},
+            },
+        ),
+    ]
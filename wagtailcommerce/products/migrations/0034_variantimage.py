@@ -0,0 +1,29 @@
+# Generated by Django 2.2.5 on 2026-10-18 08:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailimages', '0001_squashed_0021'),
+        ('wagtailcommerce_products', '0033_auto_20261018_0856'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VariantImage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sort_order', models.PositiveIntegerField()),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wagtailimages.Image')),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='indexed_images', to='wagtailcommerce_products.ProductVariant')),
+            ],
+            options={
+                'verbose_name': 'variant image',
+                'verbose_name_plural': 'variant images',
+                'unique_together': {('variant', 'sort_order')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.5 on 2026-10-18 09:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcommerce_products', '0034_variantimage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='import_ref',
+            field=models.CharField(blank=True, editable=False, max_length=255, verbose_name='import reference'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['store', 'import_ref'], name='product_import_ref_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.5 on 2026-10-18 09:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcommerce_products', '0035_product_import_ref'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSlot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField(verbose_name='index')),
+                ('quantity', models.IntegerField(default=0, verbose_name='quantity')),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_slots', to='wagtailcommerce_products.ProductVariant')),
+            ],
+            options={
+                'verbose_name': 'stock slot',
+                'verbose_name_plural': 'stock slots',
+                'unique_together': {('variant', 'index')},
+            },
+        ),
+        migrations.AddField(
+            model_name='stockreservation',
+            name='slot',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='wagtailcommerce_products.StockSlot'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 2.2.5 on 2026-10-18 09:16
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Q, Sum
+from django.db.models.functions import Coalesce
+
+
+def forwards_func(apps, schema_editor):
+    # Slots of variants holding reservations, the others get theirs as they're reserved or compacted.
+    # Same computation as wagtailcommerce.products.stock.get_slotted_stock
+    ProductVariant = apps.get_model('wagtailcommerce_products', 'ProductVariant')
+    StockReservation = apps.get_model('wagtailcommerce_products', 'StockReservation')
+    StockSlot = apps.get_model('wagtailcommerce_products', 'StockSlot')
+    db_alias = schema_editor.connection.alias
+
+    slot_count = getattr(settings, 'WAGTAILCOMMERCE_STOCK_SLOTS', 8)
+    reserved = dict(StockReservation.objects.using(db_alias).order_by().values('variant_id').annotate(
+        total=Sum('quantity')).values_list('variant_id', 'total'))
+
+    variants = ProductVariant.objects.using(db_alias).filter(pk__in=reserved).annotate(
+        pending=Coalesce(Sum('inventory_movements__quantity', filter=Q(
+            inventory_movements__compacted__isnull=True, inventory_movements__reason='sale')), 0))
+
+    slots = []
+
+    for pk, stock, pending in variants.values_list('pk', 'stock', 'pending'):
+        available = max(stock + pending - reserved[pk], 0)
+
+        slots += [
+            StockSlot(
+                variant_id=pk, index=i, quantity=available // slot_count + (1 if i < available % slot_count else 0))
+            for i in range(slot_count)
+        ]
+
+    StockSlot.objects.using(db_alias).bulk_create(slots)
+
+    for pk, variant_pk in StockSlot.objects.using(db_alias).filter(index=0).values_list('pk', 'variant_id'):
+        StockReservation.objects.using(db_alias).filter(variant_id=variant_pk).update(slot_id=pk)
+
+
+def reverse_func(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcommerce_products', '0036_stock_slots'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards_func, reverse_func),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.5 on 2026-10-18 09:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailcommerce_products', '0037_stock_reservation_slots'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockreservation',
+            name='slot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='wagtailcommerce_products.StockSlot'),
+        ),
+    ]
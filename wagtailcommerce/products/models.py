@@ -1,11 +1,12 @@
-import shortuuid
-from decimal import Decimal
+import string
+from decimal import ROUND_HALF_UP, Decimal
 
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
 from django.dispatch import receiver
 from django.utils.functional import cached_property
 from django.utils.text import capfirst
@@ -19,13 +20,24 @@ from wagtail.core.models import Orderable
 from wagtail.images.edit_handlers import ImageChooserPanel
 from wagtail.search import index
 
-from wagtailcommerce.products.query import ProductQuerySet, ProductVariantQuerySet
+from wagtailcommerce.orders.signals import order_paid_signal, order_stock_shortage_signal
+from wagtailcommerce.products.category_tree import get_category_tree, invalidate_category_tree
+from wagtailcommerce.products.query import PRICE_FIELDS, ProductQuerySet, ProductVariantQuerySet
+from wagtailcommerce.utils.identifiers import get_identifier_allocator
 from wagtailcommerce.utils.images import get_image_model
 
 CATEGORY_MODEL_CLASSES = []
 PRODUCT_MODEL_CLASSES = []
 PRODUCT_VARIANT_MODEL_CLASSES = []
 
+# Maintained by wagtailcommerce.products.stock, never overwritten by ProductVariant.save()
+STOCK_FIELDS = ('stock', 'reserved_stock')
+
+
+def get_product_identifier_allocator():
+    return get_identifier_allocator(
+        Product, 'WAGTAILCOMMERCE_PRODUCT_IDENTIFIER_ALLOCATOR', alphabet=string.ascii_lowercase + string.digits)
+
 
 def get_default_product_content_type():
     """
@@ -50,14 +62,32 @@ class Category(MP_Node):
     description = models.TextField(_('description'), blank=True)
 
     def category_path(self):
+        if self.pk:
+            tree = get_category_tree(self.store_id)
+
+            if self.pk in tree:
+                return tree.get_path(self.pk)
+
         return list(self.get_ancestors().values_list('name', flat=True)) + [self.name]
 
+    def move(self, target, pos=None):
+        # treebeard moves nodes with queryset updates, which send no signals
+        super().move(target, pos=pos)
+
+        invalidate_category_tree(self.store_id)
+        if target.store_id != self.store_id:
+            invalidate_category_tree(target.store_id)
+
     def __str__(self):
         return ' » '.join(self.category_path())
 
     class Meta:
         verbose_name = _('category')
         verbose_name_plural = _('categories')
+        indexes = [
+            # Prefix lookups on path (path__startswith), which select subtrees
+            models.Index(fields=['path'], name='category_path_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ]
 
 
 class BaseProductManager(models.Manager):
@@ -110,8 +140,13 @@ class Product(AbstractProduct, index.Indexed, ClusterableModel, metaclass=Produc
         max_digits=12, decimal_places=2, blank=True, null=True,
         help_text=_('Enter a value from 0 to 100 in order to offer a percentage discount on this product.')
     )
+    # Denormalized price, so products can be filtered and sorted on it. Maintained on save and update().
+    effective_price = models.DecimalField(
+        _('effective price'), max_digits=12, decimal_places=2, blank=True, null=True, editable=False)
 
     identifier = models.CharField(_('identifier'), max_length=8, db_index=True, unique=True)
+    # Reference of the product in the catalog it was imported from, see wagtailcommerce.products.importing
+    import_ref = models.CharField(_('import reference'), max_length=255, blank=True, editable=False)
 
     active = models.BooleanField(_('active'))
     purchasing_enabled = models.BooleanField(_('purchasing enabled'), default=True)
@@ -141,6 +176,7 @@ class Product(AbstractProduct, index.Indexed, ClusterableModel, metaclass=Produc
     search_fields = [
         index.SearchField('name', boost=2),
         index.FilterField('price'),
+        index.FilterField('effective_price'),
         index.FilterField('regular_price'),
         index.FilterField('sale_price'),
         index.FilterField('percentage_discount'),
@@ -160,6 +196,16 @@ class Product(AbstractProduct, index.Indexed, ClusterableModel, metaclass=Produc
     #     FieldPanel('price'),
     # ]
 
+    class Meta:
+        indexes = [
+            # Product listings and their cursor pagination
+            models.Index(fields=['featured', 'created', 'id'], name='product_listing_idx'),
+            # Filtering and sorting on price
+            models.Index(fields=['effective_price', 'id'], name='product_price_idx'),
+            # Matching re-imported products
+            models.Index(fields=['store', 'import_ref'], name='product_import_ref_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -189,20 +235,19 @@ class Product(AbstractProduct, index.Indexed, ClusterableModel, metaclass=Produc
         return capfirst(cls._meta.verbose_name)
 
     def save(self, *args, **kwargs):
-        if not self.identifier:
-            self.identifier = self.generate_identifier()
-
-        super().save(*args, **kwargs)
+        self.effective_price = self.get_effective_price()
 
-    def generate_identifier(self):
-        shortuuid.set_alphabet('abcdefghijklmnopqrstuvwxyz1234567890')
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(update_fields).intersection(PRICE_FIELDS):
+            kwargs['update_fields'] = set(update_fields) | {'effective_price'}
 
-        while True:
-            uuid = shortuuid.uuid()[:8]
-            if not Product.objects.filter(identifier=uuid).exists():
-                break
+        if self.identifier:
+            super().save(*args, **kwargs)
+        else:
+            get_product_identifier_allocator().save(self, super().save, *args, **kwargs)
 
-        return uuid
+    def generate_identifier(self):
+        return get_product_identifier_allocator().generate()
 
     def get_percentage_discount_amount(self):
         if self.percentage_discount:
@@ -213,6 +258,19 @@ class Product(AbstractProduct, index.Indexed, ClusterableModel, metaclass=Produc
 
         return Decimal('0')
 
+    def get_effective_price(self):
+        """
+        Return the price rounded to cents, as stored in effective_price.
+        """
+        if self.percentage_discount and self.regular_price is not None:
+            price = self.regular_price - self.percentage_discount / 100 * self.regular_price
+        elif self.sale_price:
+            price = self.sale_price
+        else:
+            price = self.regular_price
+
+        return Decimal(price).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) if price is not None else None
+
     @property
     def price(self):
         if self.percentage_discount:
@@ -250,6 +308,26 @@ class Product(AbstractProduct, index.Indexed, ClusterableModel, metaclass=Produc
         raise NotImplementedError(_('Your child Product model must implement the url() method'))
 
 
+class RelatedProduct(models.Model):
+    """
+    Precomputed relation between products, scored by how often they're bought
+    together and how many categories they share.
+    Maintained by ``wagtailcommerce.products.related``.
+    """
+    product = models.ForeignKey(Product, related_name='related_products', on_delete=models.CASCADE)
+    related_product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    co_purchases = models.PositiveIntegerField(_('times bought together'), default=0)
+    shared_categories = models.PositiveIntegerField(_('shared categories'), default=0)
+
+    class Meta:
+        verbose_name = _('related product')
+        verbose_name_plural = _('related products')
+        unique_together = ('product', 'related_product')
+        indexes = [
+            models.Index(fields=['product', '-co_purchases', '-shared_categories'], name='related_product_score_idx'),
+        ]
+
+
 class ImageSet(ClusterableModel):
     product = ParentalKey(Product, related_name='image_sets')
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, null=True, blank=True)
@@ -327,6 +405,8 @@ class ProductVariant(AbstractProductVariant, ClusterableModel, metaclass=Product
     depth = models.DecimalField(_('depth'), max_digits=12, decimal_places=2, help_text=_('value stored in millimeters'), blank=True, null=True)
 
     stock = models.IntegerField(_('stock'), default=0)
+    # Stock not left in the variant's stock slots as of the last compaction, see wagtailcommerce.products.stock
+    reserved_stock = models.IntegerField(_('reserved stock'), default=0, editable=False)
     active = models.BooleanField(_('active'))
 
     created = models.DateTimeField(_('created on'), auto_now_add=True)
@@ -385,10 +465,289 @@ class ProductVariant(AbstractProductVariant, ClusterableModel, metaclass=Product
                 # that this was created as
                 self.content_type = ContentType.objects.get_for_model(self)
 
+        # Field values as loaded, to turn stock edits into inventory movements
+        # and rebuild variant images when the fields picking them change
+        self._loaded_values = self.get_field_values()
+
+    def get_field_values(self, fields=None):
+        """
+        Return the values of the variant's loaded fields, or of fields, by attname.
+        """
+        attnames = None if fields is None else {self._meta.get_field(name).attname for name in fields}
+
+        return {
+            field.attname: self.__dict__[field.attname] for field in self._meta.concrete_fields
+            if field.attname in self.__dict__ and (attnames is None or field.attname in attnames)
+        }
+
+    def get_changed_fields(self):
+        """
+        Return the attnames of fields changed since the variant was loaded or saved.
+        """
+        return {
+            attname for attname, value in self.get_field_values().items()
+            if attname in self._loaded_values and self._loaded_values[attname] != value
+        }
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+
+        self._loaded_values.update(self.get_field_values(fields))
+
+    def save(self, *args, **kwargs):
+        """
+        Stock counters of existing variants are never overwritten, so saves don't
+        undo concurrent sales and reservations. Edits to ``stock`` (e.g. from the
+        admin) are recorded as an adjustment movement of the difference with the
+        stock loaded, applied once movements are compacted. ``reserved_stock`` is
+        only changed through wagtailcommerce.products.stock, and can't be in update_fields.
+        """
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            self._loaded_values = self.get_field_values()
+            return
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            deferred_fields = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred_fields
+            ]
+        elif 'reserved_stock' in update_fields:
+            raise ValueError('reserved_stock can\'t be saved, it\'s maintained by stock reservations')
+
+        kwargs['update_fields'] = [name for name in update_fields if name not in STOCK_FIELDS]
+
+        loaded_stock = self._loaded_values.get('stock')
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            if 'stock' in update_fields and loaded_stock is not None and self.stock != loaded_stock:
+                self.adjust_stock(self.stock - loaded_stock)
+
+        self._loaded_values.update(self.get_field_values(update_fields))
+
+    def adjust_stock(self, quantity):
+        """
+        Record an adjustment movement adding quantity to the variant's stock.
+        """
+        InventoryMovement.objects.create(variant=self, quantity=quantity, reason=InventoryMovement.ADJUSTMENT)
+
+    @property
+    def available_stock(self):
+        """
+        Stock that can still be sold, as of the last inventory compaction.
+        """
+        return self.stock - self.reserved_stock
+
     def __str__(self):
         return self.specific.__str__()
 
 
+class VariantImage(models.Model):
+    """
+    Images of the image set matching a variant, in order. Lookup table maintained
+    by ``wagtailcommerce.products.variant_images``.
+    """
+    variant = models.ForeignKey(ProductVariant, related_name='indexed_images', on_delete=models.CASCADE)
+    image = models.ForeignKey('wagtailimages.Image', related_name='+', on_delete=models.CASCADE)
+    sort_order = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name = _('variant image')
+        verbose_name_plural = _('variant images')
+        unique_together = ('variant', 'sort_order')
+
+
+class StockLocation(models.Model):
+    """
+    Warehouse or shop products are shipped from. Orders are allocated to active
+    locations by priority, lowest first.
+    """
+    store = models.ForeignKey(
+        'wagtailcommerce_stores.Store', related_name='stock_locations', verbose_name=_('store'),
+        on_delete=models.CASCADE)
+    name = models.CharField(_('name'), max_length=128)
+    priority = models.PositiveIntegerField(_('priority'), default=0)
+    active = models.BooleanField(_('active'), default=True)
+
+    panels = [
+        FieldPanel('store'),
+        FieldPanel('name'),
+        FieldPanel('priority'),
+        FieldPanel('active'),
+    ]
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = _('stock location')
+        verbose_name_plural = _('stock locations')
+        ordering = ('priority', 'pk')
+
+
+class LocationStock(models.Model):
+    """
+    Stock of a variant at a location. Variants' stock is the total of their locations,
+    both maintained by ``wagtailcommerce.products.stock``.
+    """
+    location = models.ForeignKey(StockLocation, related_name='stock', on_delete=models.CASCADE)
+    variant = models.ForeignKey(ProductVariant, related_name='location_stock', on_delete=models.CASCADE)
+    quantity = models.IntegerField(_('quantity'), default=0)
+
+    class Meta:
+        verbose_name = _('location stock')
+        verbose_name_plural = _('location stock')
+        unique_together = ('variant', 'location')
+
+
+class StockSlot(models.Model):
+    """
+    Share of a variant's stock available for reservations. Available stock is split
+    across a few slots, so concurrent checkouts of a variant reserve from different
+    rows instead of waiting on the same one. Maintained by ``wagtailcommerce.products.stock``.
+    """
+    variant = models.ForeignKey(ProductVariant, related_name='stock_slots', on_delete=models.CASCADE)
+    index = models.PositiveIntegerField(_('index'))
+    quantity = models.IntegerField(_('quantity'), default=0)
+
+    class Meta:
+        verbose_name = _('stock slot')
+        verbose_name_plural = _('stock slots')
+        unique_together = ('variant', 'index')
+
+
+class StockReservation(models.Model):
+    """
+    Stock of a variant held for an order until it's paid or the reservation expires,
+    taken from one of its slots. Maintained by ``wagtailcommerce.products.stock``.
+    """
+    order = models.ForeignKey(
+        'wagtailcommerce_orders.Order', related_name='stock_reservations', on_delete=models.CASCADE)
+    variant = models.ForeignKey(ProductVariant, related_name='stock_reservations', on_delete=models.CASCADE)
+    slot = models.ForeignKey(StockSlot, related_name='reservations', on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(_('quantity'))
+    expires = models.DateTimeField(_('expires'), db_index=True)
+    created = models.DateTimeField(_('created on'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('stock reservation')
+        verbose_name_plural = _('stock reservations')
+
+
+class InventoryMovement(models.Model):
+    """
+    Insert-only record of a change in a variant's stock. Movements are folded into
+    ProductVariant.stock by ``wagtailcommerce.products.stock.compact_inventory_movements``.
+    """
+    SALE = 'sale'
+    ADJUSTMENT = 'adjustment'
+    SYNC = 'sync'
+    RETURN = 'return'
+
+    REASON_CHOICES = (
+        (SALE, _('Sale')),
+        (ADJUSTMENT, _('Adjustment')),
+        (SYNC, _('Sync')),
+        (RETURN, _('Return')),
+    )
+
+    variant = models.ForeignKey(ProductVariant, related_name='inventory_movements', on_delete=models.CASCADE)
+    quantity = models.IntegerField(_('quantity'), help_text=_('negative for units leaving stock'))
+    reserved_quantity = models.PositiveIntegerField(
+        _('reserved quantity'), default=0, help_text=_('reserved units released by this movement'))
+    reason = models.CharField(_('reason'), max_length=20, choices=REASON_CHOICES)
+    order = models.ForeignKey(
+        'wagtailcommerce_orders.Order', related_name='inventory_movements', verbose_name=_('order'),
+        blank=True, null=True, on_delete=models.SET_NULL)
+    location = models.ForeignKey(
+        StockLocation, related_name='inventory_movements', verbose_name=_('location'),
+        blank=True, null=True, on_delete=models.SET_NULL)
+    note = models.CharField(_('note'), max_length=255, blank=True)
+    created = models.DateTimeField(_('created on'), auto_now_add=True, db_index=True)
+    compacted = models.DateTimeField(_('compacted on'), blank=True, null=True)
+
+    class Meta:
+        verbose_name = _('inventory movement')
+        verbose_name_plural = _('inventory movements')
+        indexes = [
+            models.Index(fields=['variant'], name='inventory_pending_idx', condition=Q(compacted__isnull=True)),
+        ]
+
+
+@receiver(models.signals.post_save, sender=Category)
+@receiver(models.signals.post_delete, sender=Category)
+def category_tree_changed(sender, instance, **kwargs):
+    invalidate_category_tree(instance.store_id)
+
+
+@receiver(models.signals.post_save, sender=ImageSet)
+@receiver(models.signals.post_delete, sender=ImageSet)
+def image_set_changed(sender, instance, **kwargs):
+    from wagtailcommerce.products.variant_images import update_variant_images
+
+    update_variant_images(ProductVariant.objects.filter(product_id=instance.product_id))
+
+
+@receiver(models.signals.post_save, sender=Image)
+@receiver(models.signals.post_delete, sender=Image)
+def image_changed(sender, instance, **kwargs):
+    from wagtailcommerce.products.variant_images import update_variant_images
+
+    update_variant_images(ProductVariant.objects.filter(product__image_sets=instance.image_set_id))
+
+
+def variant_saved(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    # Connected to each ProductVariant class by ProductsAppConfig.ready()
+    from wagtailcommerce.products.variant_images import get_image_set_filtering_fields, update_variant_images
+
+    if raw:
+        return
+
+    if not created:
+        changed_fields = instance.get_changed_fields()
+
+        if update_fields is not None:
+            changed_fields &= set(instance.get_field_values(update_fields))
+
+        if not changed_fields:
+            return
+
+        # Variant attributes pick their image set
+        filtering_fields = get_image_set_filtering_fields(instance.product)
+
+        if 'product_id' not in changed_fields and not any(
+                field.attname in changed_fields for field in instance._meta.concrete_fields
+                if field.name in filtering_fields):
+            return
+
+    update_variant_images(ProductVariant.objects.filter(pk=instance.pk))
+
+
+@receiver(models.signals.pre_delete, sender='wagtailcommerce_orders.Order')
+def order_deleted(sender, instance, **kwargs):
+    from wagtailcommerce.products.stock import release_order_stock
+
+    release_order_stock(instance)
+
+
+@receiver(order_paid_signal)
+def order_paid(sender, order, **kwargs):
+    from wagtailcommerce.products.related import record_co_purchases
+    from wagtailcommerce.products.stock import commit_order_stock
+
+    short_variants = commit_order_stock(order)
+
+    if short_variants:
+        # Paid for more than there was in stock
+        order_stock_shortage_signal.send(sender, order=order, variants=short_variants)
+
+    record_co_purchases(order)
+
+
 if getattr(settings, 'WAGTAILCOMMERCE_ASYNC_THUMBNAILS', False):
     from wagtailcommerce.products.images import generate_renditions
 
@@ -1,14 +1,50 @@
 import graphene
 from graphene_django.types import DjangoObjectType
 
-from wagtailcommerce.products.models import Category, Product, ProductVariant
+from wagtailcommerce.products.category_tree import get_category_tree
+from wagtailcommerce.products.models import ProductVariant
 
 
-class CategoryType(DjangoObjectType):
+class CategoryType(graphene.ObjectType):
+    """
+    Category tree node, resolved from ``CategoryTree.get_payload()`` dicts.
+    """
+    id = graphene.ID()
+    name = graphene.String()
+    slug = graphene.String()
     children = graphene.List('wagtailcommerce.products.object_types.CategoryType')
 
-    class Meta:
-        model = Category
+
+class CategoryFacetType(graphene.ObjectType):
+    id = graphene.ID()
+    name = graphene.String()
+    slug = graphene.String()
+    count = graphene.Int()
+
+    def resolve_id(self, info, **kwargs):
+        return self['category_id']
+
+    def resolve_name(self, info, **kwargs):
+        return get_category_tree(self['store_id']).names.get(self['category_id'])
+
+    def resolve_slug(self, info, **kwargs):
+        return get_category_tree(self['store_id']).slugs.get(self['category_id'])
+
+
+class PriceFacetType(graphene.ObjectType):
+    min_price = graphene.Float()
+    max_price = graphene.Float()
+    count = graphene.Int()
+
+
+class ProductFacetsType(graphene.ObjectType):
+    """
+    Facet counts, resolved from ``get_product_facets()`` dicts.
+    """
+    total = graphene.Int()
+    in_stock = graphene.Int()
+    prices = graphene.List(PriceFacetType)
+    categories = graphene.List(CategoryFacetType)
 
 
 class ProductType(graphene.ObjectType):
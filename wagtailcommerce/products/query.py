@@ -1,15 +1,96 @@
-from collections import defaultdict
+from functools import reduce
+from operator import or_
 
-from django.contrib.contenttypes.models import ContentType
-from django.db.models import QuerySet
-from django.db.models.query import BaseIterable
+from django.db.models import DecimalField, F, Q, QuerySet, Value
+from django.db.models.functions import Coalesce, NullIf
+
+from wagtailcommerce.products.category_tree import get_category_tree
+from wagtailcommerce.utils.query import PrefetchSpecificMixin, SelectSpecificMixin, SpecificIterable
+
+PRICE_FIELDS = ('regular_price', 'sale_price', 'percentage_discount')
+
+
+def get_effective_price_expression(**values):
+    """
+    SQL version of ``Product.price``. Price fields given as keyword arguments
+    (values or expressions) are used instead of the product's columns.
+    """
+    def get_expression(field):
+        if field not in values:
+            return F(field)
+
+        value = values[field]
+        return value if hasattr(value, 'resolve_expression') else Value(value)
+
+    regular_price, sale_price, percentage_discount = [get_expression(field) for field in PRICE_FIELDS]
+
+    # A zero or missing discount or sale price doesn't apply, like in Product.price
+    discounted_price = regular_price - NullIf(percentage_discount, Value(0)) / Value(100) * regular_price
+
+    return Coalesce(
+        discounted_price, NullIf(sale_price, Value(0)), regular_price,
+        output_field=DecimalField(max_digits=12, decimal_places=2)
+    )
 
 
 class CategoryQuerySet(QuerySet):
     pass
 
 
-class ProductQuerySet(QuerySet):
+class ProductQuerySet(PrefetchSpecificMixin, SelectSpecificMixin, QuerySet):
+    def get_specific_model_classes(self):
+        from wagtailcommerce.products.models import PRODUCT_MODEL_CLASSES
+        return PRODUCT_MODEL_CLASSES
+
+    def update(self, **kwargs):
+        # Keep effective_price in step with the price fields, in the same statement
+        if 'effective_price' not in kwargs and any(field in kwargs for field in PRICE_FIELDS):
+            kwargs['effective_price'] = get_effective_price_expression(
+                **{field: kwargs[field] for field in PRICE_FIELDS if field in kwargs})
+
+        return super().update(**kwargs)
+
+    def in_categories(self, category_pks, store=None):
+        """
+        Filter products belonging to any of the given categories or their
+        descendants, with a single semi-join on the categories' paths.
+        Paths are read from store's category tree if given.
+        """
+        from wagtailcommerce.products.models import Category
+
+        category_pks = {int(pk) for pk in category_pks}
+        paths = []
+
+        if store is not None:
+            tree = get_category_tree(store.pk)
+            paths = [tree.paths[pk] for pk in category_pks if pk in tree]
+            category_pks.difference_update(tree.paths)
+
+        if category_pks:
+            paths += Category.objects.filter(pk__in=category_pks).values_list('path', flat=True)
+
+        # Skip paths within other selected categories
+        prefixes = []
+        for path in sorted(paths):
+            if not prefixes or not path.startswith(prefixes[-1]):
+                prefixes.append(path)
+
+        if not prefixes:
+            return self.none()
+
+        through = self.model.categories.through
+
+        return self.filter(pk__in=through.objects.filter(
+            category__in=Category.objects.filter(reduce(or_, [Q(path__startswith=prefix) for prefix in prefixes]))
+        ).values('product_id'))
+
+    def with_effective_price(self):
+        """
+        Annotate products with ``computed_price``, their price computed from
+        the price fields rather than read from ``effective_price``.
+        """
+        return self.annotate(computed_price=get_effective_price_expression())
+
     def specific(self):
         """
         This efficiently gets all the specific objects for the queryset, using
@@ -20,7 +101,11 @@ class ProductQuerySet(QuerySet):
         return clone
 
 
-class ProductVariantQuerySet(QuerySet):
+class ProductVariantQuerySet(PrefetchSpecificMixin, SelectSpecificMixin, QuerySet):
+    def get_specific_model_classes(self):
+        from wagtailcommerce.products.models import PRODUCT_VARIANT_MODEL_CLASSES
+        return PRODUCT_VARIANT_MODEL_CLASSES
+
     def specific(self):
         """
         This efficiently gets all the specific objects for the queryset, using
@@ -29,37 +114,3 @@ class ProductVariantQuerySet(QuerySet):
         clone = self._clone()
         clone._iterable_class = SpecificIterable
         return clone
-
-
-def specific_iterator(qs):
-    """
-    This efficiently iterates all the specific pages in a queryset, using
-    the minimum number of queries.
-    This should be called from ``PageQuerySet.specific``
-    """
-    pks_and_types = qs.values_list('pk', 'content_type')
-    pks_by_type = defaultdict(list)
-    for pk, content_type in pks_and_types:
-        pks_by_type[content_type].append(pk)
-
-    # Content types are cached by ID, so this will not run any queries.
-    content_types = {pk: ContentType.objects.get_for_id(pk)
-                     for _, pk in pks_and_types}
-
-    # Get the specific instances of all pages, one model class at a time.
-    objects_by_type = {}
-    for content_type, pks in pks_by_type.items():
-        # look up model class for this content type, falling back on the original
-        # model (i.e. Page) if the more specific one is missing
-        model = content_types[content_type].model_class() or qs.model
-        objects = model.objects.filter(pk__in=pks)
-        objects_by_type[content_type] = {obj.pk: obj for obj in objects}
-
-    # Yield all of the pages, in the order they occurred in the original query.
-    for pk, content_type in pks_and_types:
-        yield objects_by_type[content_type][pk]
-
-
-class SpecificIterable(BaseIterable):
-    def __iter__(self):
-        return specific_iterator(self.queryset)
@@ -0,0 +1,137 @@
+from __future__ import absolute_import, unicode_literals
+
+from collections import Counter, defaultdict
+from itertools import groupby, permutations
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from wagtailcommerce.orders.models import Order, OrderLine
+from wagtailcommerce.products.models import Product, RelatedProduct
+
+# Orders that went through payment
+PAID_ORDER_STATUSES = [Order.PAID, Order.SHIPMENT_GENERATED, Order.SHIPPED, Order.DELIVERED]
+
+
+def get_product_categories(product_pks):
+    categories = defaultdict(set)
+
+    for product_pk, category_pk in Product.categories.through.objects.filter(
+            product_id__in=product_pks).values_list('product_id', 'category_id'):
+        categories[product_pk].add(category_pk)
+
+    return categories
+
+
+def get_co_purchase_counts(orders):
+    """
+    Return a Counter of how many of orders contain each (product pk, related product pk) pair.
+    """
+    counts = Counter()
+
+    lines = OrderLine.objects.filter(order__in=orders, product_variant__isnull=False).order_by(
+        'order_id').values_list('order_id', 'product_variant__product_id').distinct()
+
+    for order_pk, order_lines in groupby(lines.iterator(), key=lambda line: line[0]):
+        counts.update(permutations({product_pk for order_pk, product_pk in order_lines}, 2))
+
+    return counts
+
+
+def get_related_product_rows(counts):
+    categories = get_product_categories({product_pk for pair in counts for product_pk in pair})
+
+    return [
+        RelatedProduct(
+            product_id=product_pk,
+            related_product_id=related_product_pk,
+            co_purchases=count,
+            shared_categories=len(categories[product_pk] & categories[related_product_pk])
+        )
+        for (product_pk, related_product_pk), count in counts.items()
+    ]
+
+
+def rebuild_related_products(since=None, batch_size=1000):
+    """
+    Recompute related products from every paid order. With since, only the
+    products bought since then are recomputed, from all their orders.
+    """
+    orders = Order.objects.filter(status__in=PAID_ORDER_STATUSES)
+    related_products = RelatedProduct.objects.all()
+
+    if since:
+        product_pks = set(OrderLine.objects.filter(
+            order__in=orders.filter(date_placed__gte=since), product_variant__isnull=False
+        ).values_list('product_variant__product_id', flat=True))
+
+        orders = orders.filter(pk__in=OrderLine.objects.filter(
+            product_variant__product_id__in=product_pks).values('order_id'))
+
+        # Relations are symmetric, so rows pointing at those products change as well
+        related_products = related_products.filter(
+            Q(product_id__in=product_pks) | Q(related_product_id__in=product_pks))
+
+    counts = get_co_purchase_counts(orders)
+
+    if since:
+        # Those orders also pair up other products, whose rows are left as they are
+        counts = Counter({
+            pair: count for pair, count in counts.items()
+            if pair[0] in product_pks or pair[1] in product_pks
+        })
+
+    with transaction.atomic():
+        related_products.delete()
+        RelatedProduct.objects.bulk_create(get_related_product_rows(counts), batch_size=batch_size)
+
+    return len(counts)
+
+
+def record_co_purchases(order):
+    """
+    Count an order's products as bought together, as the order gets paid.
+    """
+    product_pks = set(order.lines.filter(product_variant__isnull=False).values_list(
+        'product_variant__product_id', flat=True))
+
+    if len(product_pks) < 2:
+        return
+
+    pairs = set(permutations(product_pks, 2))
+
+    with transaction.atomic():
+        new_rows = get_related_product_rows(Counter(pairs))
+
+        for row in new_rows:
+            row.co_purchases = 0
+
+        RelatedProduct.objects.bulk_create(new_rows, ignore_conflicts=True)
+
+        # Every pair of these products belongs to the order
+        RelatedProduct.objects.filter(
+            product_id__in=product_pks, related_product_id__in=product_pks
+        ).update(co_purchases=F('co_purchases') + 1)
+
+
+def get_related_product_pks(product_pk, products, limit):
+    """
+    Return the pks of up to limit products out of the products queryset
+    related to a product, best first. Products frequently bought with it
+    come first, followed by the newest products sharing its categories.
+    """
+    related_pks = list(RelatedProduct.objects.filter(
+        product_id=product_pk, related_product_id__in=products.values('pk')
+    ).order_by('-co_purchases', '-shared_categories').values_list('related_product_id', flat=True)[:limit])
+
+    if len(related_pks) < limit:
+        through = Product.categories.through
+        product_categories = through.objects.filter(product_id=product_pk).values('category_id')
+
+        related_pks += list(products.filter(
+            pk__in=through.objects.filter(category_id__in=product_categories).values('product_id')
+        ).exclude(
+            pk__in=related_pks + [product_pk]
+        ).order_by('-featured', '-created', '-id').values_list('pk', flat=True)[:limit - len(related_pks)])
+
+    return related_pks
@@ -0,0 +1,227 @@
+from __future__ import absolute_import, unicode_literals
+
+import json
+import multiprocessing
+import os
+
+import django
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections
+from django.db.models import Q
+from wagtail.images.models import Filter
+
+from wagtailcommerce.products.models import Image
+from wagtailcommerce.utils.images import get_image_model
+
+
+# Widths of the responsive renditions of product images, in pixels
+DEFAULT_PRODUCT_IMAGE_WIDTHS = (320, 640, 960, 1280)
+
+# Output formats of responsive renditions, preferred first. Wagtail versions
+# supporting format-webp or format-avif can list 'webp' or 'avif' first.
+DEFAULT_PRODUCT_IMAGE_FORMATS = ('jpeg', )
+
+DEFAULT_ORDER_THUMBNAIL_SPEC = 'max-400x400|format-jpeg|bgcolor-ffffff'
+
+MIME_TYPES = {
+    'avif': 'image/avif',
+    'gif': 'image/gif',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'webp': 'image/webp',
+}
+
+
+def get_order_thumbnail_spec():
+    return getattr(settings, 'WAGTAILCOMMERCE_ORDER_THUMBNAIL_SPEC', DEFAULT_ORDER_THUMBNAIL_SPEC)
+
+
+def get_srcset_specs():
+    """
+    Return (format, width, filter spec) for each responsive rendition of product
+    images, from WAGTAILCOMMERCE_PRODUCT_IMAGE_FORMATS and WAGTAILCOMMERCE_PRODUCT_IMAGE_WIDTHS.
+    """
+    return [
+        (image_format, width, 'width-{}|format-{}'.format(width, image_format))
+        for image_format in getattr(settings, 'WAGTAILCOMMERCE_PRODUCT_IMAGE_FORMATS', DEFAULT_PRODUCT_IMAGE_FORMATS)
+        for width in getattr(settings, 'WAGTAILCOMMERCE_PRODUCT_IMAGE_WIDTHS', DEFAULT_PRODUCT_IMAGE_WIDTHS)
+    ]
+
+
+def get_srcset(renditions):
+    """
+    Return a source per format, preferred first, from the renditions of an image:
+    a dict with its format, MIME type, srcset and src, its largest rendition.
+    Images aren't upscaled, so renditions of small images sharing a width are listed once.
+    """
+    renditions = {rendition.filter_spec: rendition for rendition in renditions}
+    by_format = {}
+
+    for image_format, width, spec in get_srcset_specs():
+        if spec in renditions:
+            by_format.setdefault(image_format, {}).setdefault(renditions[spec].width, renditions[spec])
+
+    sources = []
+
+    for image_format, by_width in by_format.items():
+        widths = sorted(by_width)
+
+        sources.append({
+            'format': image_format,
+            'mime_type': MIME_TYPES.get(image_format, 'image/{}'.format(image_format)),
+            'srcset': ', '.join('{} {}w'.format(by_width[width].url, width) for width in widths),
+            'src': by_width[widths[-1]].url,
+        })
+
+    return sources
+
+
+def get_product_rendition_specs(content_type_pk):
+    """
+    Return the filter specs product images of a content type are rendered with:
+    the product's ``image_renditions``, the responsive renditions and the order thumbnail.
+    """
+    model_class = ContentType.objects.get_for_id(content_type_pk).model_class()
+    specs = list(getattr(model_class, 'image_renditions', {}).values()) if model_class else []
+
+    for spec in [spec for image_format, width, spec in get_srcset_specs()] + [get_order_thumbnail_spec()]:
+        if spec not in specs:
+            specs.append(spec)
+
+    return specs
+
+
+def get_rendition_jobs(store=None, since=None):
+    """
+    Return the (Wagtail image pk, filter spec) pairs product images need renditions
+    for, without duplicates and sorted. With since, only images added or belonging
+    to products modified since then are included.
+    """
+    images = Image.objects.filter(image__isnull=False)
+
+    if store is not None:
+        images = images.filter(image_set__product__store=store)
+
+    if since is not None:
+        images = images.filter(Q(image__created_at__gte=since) | Q(image_set__product__modified__gte=since))
+
+    specs = {}
+    jobs = set()
+
+    for image_pk, content_type_pk in images.order_by().values_list(
+            'image_id', 'image_set__product__content_type_id').distinct().iterator():
+        if content_type_pk not in specs:
+            specs[content_type_pk] = get_product_rendition_specs(content_type_pk)
+
+        jobs.update((image_pk, spec) for spec in specs[content_type_pk])
+
+    return sorted(jobs)
+
+
+def generate_rendition_chunk(jobs):
+    """
+    Generate the renditions of (Wagtail image pk, filter spec) pairs that don't
+    exist yet. Images and existing renditions are read with a query each.
+    Return the counts of generated, skipped and failed renditions.
+    """
+    WagtailImage = get_image_model()
+    Rendition = WagtailImage.get_rendition_model()
+
+    images = WagtailImage.objects.in_bulk({image_pk for image_pk, spec in jobs})
+    existing = set(Rendition.objects.filter(
+        image_id__in=images, filter_spec__in={spec for image_pk, spec in jobs}
+    ).values_list('image_id', 'filter_spec', 'focal_point_key'))
+
+    counts = {'generated': 0, 'skipped': 0, 'failed': 0}
+
+    for image_pk, spec in jobs:
+        image = images.get(image_pk)
+
+        if image is None:
+            counts['skipped'] += 1
+            continue
+
+        rendition_filter = Filter(spec=spec)
+
+        if (image_pk, spec, rendition_filter.get_cache_key(image)) in existing:
+            counts['skipped'] += 1
+            continue
+
+        try:
+            image.get_rendition(rendition_filter)
+        except IOError:
+            # Missing (SourceImageIOError) or unreadable source file
+            counts['failed'] += 1
+        else:
+            counts['generated'] += 1
+
+    return counts
+
+
+def load_checkpoint(path):
+    """
+    Return the last job completed by a previous run, or None.
+    """
+    if not path or not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        image_pk, spec = json.load(f)['last_job']
+
+    return image_pk, spec
+
+
+def save_checkpoint(path, job):
+    # Replace the file atomically, so an interrupted write doesn't lose progress
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'last_job': list(job)}, f)
+
+    os.replace(path + '.tmp', path)
+
+
+def init_worker():
+    # Worker processes that aren't forked must load Django first
+    django.setup()
+
+
+def run_rendition_jobs(jobs, workers=1, chunk_size=100, checkpoint=None):
+    """
+    Generate renditions for jobs in chunks of chunk_size, in a pool of workers
+    processes if workers is more than one. Chunks complete in order, so with
+    checkpoint, a file path, progress is saved after each one and an interrupted
+    run resumes after the last completed chunk. Yield (chunk, counts) as chunks
+    complete.
+    """
+    last_job = load_checkpoint(checkpoint)
+
+    if last_job is not None:
+        jobs = [job for job in jobs if job > last_job]
+
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+
+    if workers > 1:
+        # Workers open their own connections, rather than sharing the parent's
+        connections.close_all()
+
+        pool = multiprocessing.Pool(workers, initializer=init_worker)
+        results = pool.imap(generate_rendition_chunk, chunks)
+    else:
+        pool = None
+        results = map(generate_rendition_chunk, chunks)
+
+    try:
+        for chunk, counts in zip(chunks, results):
+            if checkpoint:
+                save_checkpoint(checkpoint, chunk[-1])
+
+            yield chunk, counts
+
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    if checkpoint and os.path.exists(checkpoint):
+        # Done, the next run starts over
+        os.remove(checkpoint)
@@ -1,36 +1,41 @@
+from django.conf import settings
 from django.core.paginator import Paginator
 import graphene
 
 from django.db.models import Q
+from django.utils.translation import ugettext_lazy as _
 
-from wagtailcommerce.products.models import Category, Product
-from wagtailcommerce.products.object_types import CategoryType, ProductType
+from wagtailcommerce.products.category_tree import get_category_tree
+from wagtailcommerce.products.facets import get_product_facets
+from wagtailcommerce.products.models import Product
+from wagtailcommerce.products.object_types import CategoryType, ProductFacetsType, ProductType
+from wagtailcommerce.products.related import get_related_product_pks
+from wagtailcommerce.stores.models import Store
+from wagtailcommerce.utils.pagination import InvalidCursor, estimate_count, keyset_page
 
+# Product listings are ordered on these fields, descending. They are indexed together.
+PRODUCT_LISTING_ORDERING = ['featured', 'created', 'id']
+PRICE_ORDERING = ['effective_price', 'id']
 
-def process_category(category):
-    if 'data' in category:
-        cat = {
-            'id': category['id'],
-            'name': category['data']['name'],
-            'slug': category['data']['slug'],
-        }
+# Values of the sort argument
+PRICE_SORTING = ('price', '-price')
 
-        cat = Category(**cat)
 
-        if 'children' in category.keys():
-            cat.children = [process_category(c) for c in category['children']]
-
-        return cat
+class CategoriesQuery(graphene.ObjectType):
+    categories = graphene.List(CategoryType, depth=graphene.Int())
 
+    def resolve_categories(self, info, depth=None, **kwargs):
+        store = getattr(info.context, 'store', None)
 
-class CategoriesQuery(graphene.ObjectType):
-    categories = graphene.List(CategoryType)
+        if store:
+            store_pks = [store.pk]
+        else:
+            store_pks = Store.objects.order_by('pk').values_list('pk', flat=True)
 
-    def resolve_categories(self, info, **kwargs):
         categories = []
 
-        for category in Category.dump_bulk():
-            categories.append(process_category(category))
+        for store_pk in store_pks:
+            categories.extend(get_category_tree(store_pk).get_payload(depth))
 
         return categories
 
@@ -39,40 +44,92 @@ class BaseProductSearchResult(graphene.ObjectType):
     num_pages = graphene.Int()
     page_number = graphene.Int()
 
+    # Cursor pagination
+    end_cursor = graphene.String()
+    has_next_page = graphene.Boolean()
+    total_count = graphene.Int()
+
+    facets = graphene.Field(ProductFacetsType)
+
+    # Counts and facets are only computed when asked for
+
+    def resolve_total_count(self, info, **kwargs):
+        queryset = getattr(self, 'queryset', None)
+        return estimate_count(queryset) if queryset is not None else None
+
+    def resolve_facets(self, info, **kwargs):
+        queryset = getattr(self, 'queryset', None)
+        return get_product_facets(queryset) if queryset is not None else None
+
 
 class BaseProductsQuery(graphene.ObjectType):
 
     def get_products_queryset(cls, info, *args, **kwargs):
         if info.context.user.is_staff:
-            products = Product.objects.specific().all().filter(Q(active=True) | Q(preview_enabled=True))
+            products = Product.objects.select_specific().filter(Q(active=True) | Q(preview_enabled=True))
         else:
-            products = Product.objects.specific().all().filter(active=True)
+            products = Product.objects.select_specific().filter(active=True)
 
         params = kwargs.keys()
         if 'parent_categories' in params and kwargs['parent_categories']:
-            products = products.filter(categories__pk__in=kwargs['parent_categories'])
+            products = products.in_categories(kwargs['parent_categories'], store=getattr(info.context, 'store', None))
+
+        if kwargs.get('min_price') is not None:
+            products = products.filter(effective_price__gte=kwargs['min_price'])
+
+        if kwargs.get('max_price') is not None:
+            products = products.filter(effective_price__lte=kwargs['max_price'])
 
         return products
 
     @classmethod
     def resolve_product_search(cls, info, *args, **kwargs):
-        products = cls.get_products_queryset(cls, info, *args, **kwargs).order_by('-featured', '-created')
+        products = cls.get_products_queryset(cls, info, *args, **kwargs)
+
+        sort = kwargs.get('sort')
+        if sort in PRICE_SORTING:
+            listing_ordering, descending = PRICE_ORDERING, sort.startswith('-')
+            products = products.filter(effective_price__isnull=False)
+        else:
+            listing_ordering, descending = PRODUCT_LISTING_ORDERING, True
+
+        products = products.order_by(*['{}{}'.format('-' if descending else '', field) for field in listing_ordering])
+
+        # Listing the filters apply to, before any pagination
+        filtered_products = products
 
         params = kwargs.keys()
+        product_pks = kwargs.get('product_pks')
+
+        if 'related_to' in params:
+            product_pks = get_related_product_pks(
+                kwargs['related_to'], products,
+                getattr(settings, 'WAGTAILCOMMERCE_RELATED_PRODUCTS_LIMIT', 20))
 
-        if 'product_pks' in params:
-            clauses = ' '.join(['WHEN id=%s THEN %s' % (pk, i) for i, pk in enumerate(kwargs['product_pks'])])
-            ordering = 'CASE %s END' % clauses
+        if product_pks is not None:
+            clauses = ' '.join(['WHEN id=%s THEN %s' % (pk, i) for i, pk in enumerate(product_pks)])
+            ordering = 'CASE %s END' % clauses if clauses else 'id'
 
-            products = products.filter(pk__in=kwargs['product_pks']).extra(
+            products = products.filter(pk__in=product_pks).extra(
                 select={
                     'ordering': ordering
                 },
                 order_by=('ordering', )
             )
 
-        if 'related_to' in params:
-            products = products.order_by('?')
+        elif 'after' in params or 'first' in params:
+            # Cursor pagination, with the ordering above
+            try:
+                page, end_cursor, has_next_page = keyset_page(
+                    products, listing_ordering, kwargs.get('first') or 10, kwargs.get('after'), descending=descending)
+            except InvalidCursor:
+                raise Exception(_('Invalid cursor'))
+
+            result = cls.get_search_result_class(cls)(
+                products=page, end_cursor=end_cursor, has_next_page=has_next_page)
+            result.queryset = filtered_products
+
+            return result
 
         if 'page_number' in params:
             if 'page_size' in params:
@@ -84,4 +141,7 @@ class BaseProductsQuery(graphene.ObjectType):
             page_size = 10
 
         paginator = Paginator(products, page_size)
-        return cls.get_search_result_class(cls)(products=paginator.page(page_number), num_pages=paginator.num_pages, page_number=page_number)
+        result = cls.get_search_result_class(cls)(products=paginator.page(page_number), num_pages=paginator.num_pages, page_number=page_number)
+        result.queryset = filtered_products
+
+        return result
@@ -0,0 +1,589 @@
+from __future__ import absolute_import, unicode_literals
+
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from wagtailcommerce.products.exceptions import InsufficientStock
+from wagtailcommerce.products.models import (
+    InventoryMovement, LocationStock, ProductVariant, StockReservation, StockSlot)
+
+# Seconds an unpaid order holds its stock
+DEFAULT_STOCK_RESERVATION_TIMEOUT = 30 * 60
+
+# Rows each variant's available stock is split across
+DEFAULT_STOCK_SLOTS = 8
+
+
+def get_order_quantities(order):
+    """
+    Return a Counter of the quantity ordered per variant pk.
+    """
+    quantities = Counter()
+
+    for variant_pk, quantity in order.lines.filter(product_variant__isnull=False).values_list(
+            'product_variant_id', 'quantity'):
+        quantities[variant_pk] += quantity
+
+    return quantities
+
+
+def get_stock_slot_count():
+    return getattr(settings, 'WAGTAILCOMMERCE_STOCK_SLOTS', DEFAULT_STOCK_SLOTS)
+
+
+def split_quantity(quantity, parts):
+    """
+    Split quantity into parts as even as possible, larger ones first. Negative quantities count as 0.
+    """
+    quantity = max(quantity, 0)
+
+    return [quantity // parts + (1 if i < quantity % parts else 0) for i in range(parts)]
+
+
+def get_slotted_stock(variant_pks):
+    """
+    Return the stock the slots of variants should hold, by pk: their stock including
+    sales not compacted yet, less their reservations. Other movements are added to
+    slots as they're compacted.
+    """
+    reserved = dict(StockReservation.objects.filter(variant_id__in=variant_pks).order_by().values(
+        'variant_id').annotate(total=Sum('quantity')).values_list('variant_id', 'total'))
+
+    return {
+        pk: stock + pending - reserved.get(pk, 0) for pk, stock, pending in ProductVariant.objects.filter(
+            pk__in=variant_pks
+        ).annotate(pending=Coalesce(Sum('inventory_movements__quantity', filter=Q(
+            inventory_movements__compacted__isnull=True, inventory_movements__reason=InventoryMovement.SALE)), 0)
+        ).values_list('pk', 'stock', 'pending')
+    }
+
+
+def create_stock_slots(variant_pks):
+    """
+    Create the slots of those variants that have none, e.g. new or imported ones.
+    Concurrent calls for the same variants wait for each other, and only the first
+    one creates them. Return the pks of the variants whose slots were created.
+    """
+    variant_pks = set(variant_pks) - set(StockSlot.objects.filter(
+        variant_id__in=variant_pks).values_list('variant_id', flat=True).distinct())
+
+    if not variant_pks:
+        return set()
+
+    slot_count = get_stock_slot_count()
+
+    StockSlot.objects.bulk_create([
+        StockSlot(variant_id=pk, index=i, quantity=quantity)
+        for pk, stock in get_slotted_stock(variant_pks).items()
+        for i, quantity in enumerate(split_quantity(stock, slot_count))
+    ], ignore_conflicts=True)
+
+    return variant_pks
+
+
+def lock_stock_slots(variant_pk, quantity, skip_locked):
+    """
+    Lock slots of a variant holding quantity units, and return the [(slot pk, units)]
+    to take from them, adding up to less than quantity if the variant doesn't have it.
+
+    With skip_locked, slots locked by other transactions are passed over, and slots
+    are locked one at a time, fullest first, until there's enough. Otherwise every
+    slot of the variant is waited for, in pk order.
+    """
+    slots = StockSlot.objects.select_for_update(skip_locked=skip_locked).filter(
+        variant_id=variant_pk, quantity__gt=0)
+    taken = []
+
+    if skip_locked:
+        while quantity > 0:
+            slot = slots.exclude(pk__in=[pk for pk, units in taken]).order_by('-quantity').values_list(
+                'pk', 'quantity').first()
+
+            if slot is None:
+                break
+
+            taken.append((slot[0], min(slot[1], quantity)))
+            quantity -= taken[-1][1]
+    else:
+        for pk, available in slots.order_by('pk').values_list('pk', 'quantity'):
+            if quantity <= 0:
+                break
+
+            taken.append((pk, min(available, quantity)))
+            quantity -= taken[-1][1]
+
+    return taken
+
+
+def take_stock(variant_pk, quantity):
+    """
+    Lock the slots to take quantity units of a variant from, see lock_stock_slots().
+    Slots locked by concurrent checkouts are skipped, and only waited for when the
+    others fall short, so checkouts of a variant don't queue while it has stock.
+    """
+    with transaction.atomic():
+        taken = lock_stock_slots(variant_pk, quantity, skip_locked=True)
+
+        if sum(units for pk, units in taken) < quantity:
+            # Let go of the slots locked so far, rolling back to the savepoint
+            transaction.set_rollback(True)
+            taken = None
+
+    if taken is None:
+        taken = lock_stock_slots(variant_pk, quantity, skip_locked=False)
+
+    return taken
+
+
+def adjust_stock_slots(quantities):
+    """
+    Add quantities, by slot pk, to stock slots already locked.
+    """
+    quantities = {pk: quantity for pk, quantity in quantities.items() if quantity}
+
+    if quantities:
+        StockSlot.objects.filter(pk__in=quantities).update(quantity=get_adjustment('quantity', quantities))
+
+
+def return_to_stock_slots(quantities):
+    """
+    Add quantities, by slot pk, to stock slots, locking them by variant and pk first,
+    the order checkouts lock them in.
+    """
+    list(StockSlot.objects.select_for_update().filter(pk__in=quantities).order_by(
+        'variant_id', 'pk').values_list('pk', flat=True))
+
+    adjust_stock_slots(quantities)
+
+
+def add_to_stock_slots(quantities):
+    """
+    Add quantities, by variant pk, to the variants' stock slots, spreading their
+    units evenly across them again.
+    """
+    slots = defaultdict(list)
+
+    for pk, variant_pk, quantity in StockSlot.objects.select_for_update().filter(
+            variant_id__in=quantities).order_by('variant_id', 'pk').values_list('pk', 'variant_id', 'quantity'):
+        slots[variant_pk].append((pk, quantity))
+
+    adjustments = {}
+
+    for variant_pk, variant_slots in slots.items():
+        total = sum(quantity for pk, quantity in variant_slots) + quantities[variant_pk]
+
+        for (pk, quantity), share in zip(variant_slots, split_quantity(total, len(variant_slots))):
+            adjustments[pk] = share - quantity
+
+    adjust_stock_slots(adjustments)
+
+
+def reserve_order_stock(order, timeout=None):
+    """
+    Reserve the stock of an order's variants, or raise InsufficientStock with the
+    variants that don't have enough available.
+
+    Units are taken from the variants' stock slots, see take_stock(), and held by
+    insert-only reservations, so concurrent checkouts of a variant don't wait on
+    each other while it has stock. The slots taken from stay locked until the
+    transaction commits, so this should run as late as possible in it.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'WAGTAILCOMMERCE_STOCK_RESERVATION_TIMEOUT', DEFAULT_STOCK_RESERVATION_TIMEOUT)
+
+    quantities = get_order_quantities(order)
+    short_variant_pks = []
+    taken = {}
+
+    create_stock_slots(quantities)
+
+    with transaction.atomic():
+        # Variants in pk order, so checkouts waiting for slots can't deadlock
+        for variant_pk in sorted(quantities):
+            taken[variant_pk] = take_stock(variant_pk, quantities[variant_pk])
+
+            if sum(units for pk, units in taken[variant_pk]) < quantities[variant_pk]:
+                short_variant_pks.append(variant_pk)
+
+        if short_variant_pks:
+            # Let go of the slots locked
+            transaction.set_rollback(True)
+
+        else:
+            adjust_stock_slots({pk: -units for slots in taken.values() for pk, units in slots})
+
+            expires = timezone.now() + timedelta(seconds=timeout)
+
+            StockReservation.objects.bulk_create([
+                StockReservation(
+                    order=order, variant_id=variant_pk, slot_id=slot_pk, quantity=units, expires=expires)
+                for variant_pk, slots in taken.items()
+                for slot_pk, units in slots
+            ])
+
+    if short_variant_pks:
+        raise InsufficientStock(list(ProductVariant.objects.filter(pk__in=short_variant_pks)))
+
+
+def lock_variants(variant_pks):
+    """
+    Lock variant rows in pk order, so concurrent transactions can't deadlock.
+    Return their stock by pk.
+    """
+    return dict(ProductVariant.objects.select_for_update().filter(
+        pk__in=variant_pks).order_by('pk').values_list('pk', 'stock'))
+
+
+def get_adjustment(field_name, quantities):
+    """
+    Return an expression adding quantities, by pk, to a field, e.g. to a variant's stock.
+    """
+    return Case(
+        *[When(pk=pk, then=F(field_name) + quantity) for pk, quantity in quantities.items() if quantity],
+        default=F(field_name), output_field=IntegerField())
+
+
+def get_projected_stock(variant_pks):
+    """
+    Return the stock of variants by pk, including movements not compacted yet.
+    """
+    return {
+        pk: stock + pending for pk, stock, pending in ProductVariant.objects.filter(pk__in=variant_pks).annotate(
+            pending=Coalesce(Sum(
+                'inventory_movements__quantity', filter=Q(inventory_movements__compacted__isnull=True)), 0)
+        ).values_list('pk', 'stock', 'pending')
+    }
+
+
+def get_location_projected_stock(location, variant_pks):
+    """
+    Return the stock of variants at a location by variant pk, including movements not compacted yet.
+    """
+    stock = Counter(dict(LocationStock.objects.filter(
+        location=location, variant_id__in=variant_pks).values_list('variant_id', 'quantity')))
+
+    stock.update(dict(InventoryMovement.objects.filter(
+        location=location, variant_id__in=variant_pks, compacted__isnull=True
+    ).values('variant_id').annotate(pending=Sum('quantity')).values_list('variant_id', 'pending')))
+
+    return {pk: stock[pk] for pk in variant_pks}
+
+
+def record_stock_counts(counts, location=None, reason=InventoryMovement.SYNC, note=''):
+    """
+    Record the movements bringing variants to the stock counted, by variant pk,
+    e.g. when syncing with an ERP. With location, counts are that location's stock.
+    """
+    if location is None:
+        projected_stock = get_projected_stock(counts)
+    else:
+        projected_stock = get_location_projected_stock(location, counts)
+
+    InventoryMovement.objects.bulk_create([
+        InventoryMovement(variant_id=pk, location=location, quantity=counts[pk] - stock, reason=reason, note=note)
+        for pk, stock in projected_stock.items() if counts[pk] != stock
+    ])
+
+
+def allocate_stock(quantities, store=None):
+    """
+    Pick the locations to take quantities, by variant pk, from. Return a dict of
+    [(location pk, quantity)] lists by variant pk, with a None location for
+    quantities no location has in stock.
+
+    Location stock is read with a single query. Locations that have every
+    variant in stock come first, so orders ship from a single location when
+    possible, followed by those having most of them, by priority.
+    """
+    location_stock = LocationStock.objects.filter(
+        variant_id__in=[pk for pk, quantity in quantities.items() if quantity > 0],
+        quantity__gt=0, location__active=True)
+
+    if store is not None:
+        location_stock = location_stock.filter(location__store=store)
+
+    # Stock by variant pk, by location pk in priority order
+    available = {}
+
+    for location_pk, variant_pk, quantity in location_stock.order_by(
+            'location__priority', 'location_id').values_list('location_id', 'variant_id', 'quantity'):
+        available.setdefault(location_pk, {})[variant_pk] = quantity
+
+    def get_fulfilled_count(location_pk):
+        return len([pk for pk, quantity in quantities.items() if available[location_pk].get(pk, 0) >= quantity])
+
+    # Sorting is stable, so priority breaks ties
+    location_pks = sorted(available, key=get_fulfilled_count, reverse=True)
+
+    allocation = {}
+
+    for variant_pk, quantity in quantities.items():
+        allocation[variant_pk] = []
+
+        for location_pk in location_pks:
+            allocated = min(quantity, available[location_pk].get(variant_pk, 0))
+
+            if allocated:
+                allocation[variant_pk].append((location_pk, allocated))
+                quantity -= allocated
+
+            if not quantity:
+                break
+
+        if quantity:
+            allocation[variant_pk].append((None, quantity))
+
+    return allocation
+
+
+def release_reservations(reservations, skip_locked=False):
+    """
+    Return the stock held by reservations, a StockReservation queryset, to the
+    slots it was taken from, and delete them. Return how many reservations were released.
+    """
+    with transaction.atomic():
+        rows = list(reservations.select_for_update(skip_locked=skip_locked).values_list(
+            'pk', 'slot_id', 'quantity'))
+
+        released = Counter()
+
+        for pk, slot_pk, quantity in rows:
+            released[slot_pk] += quantity
+
+        if released:
+            return_to_stock_slots(released)
+
+        StockReservation.objects.filter(pk__in=[row[0] for row in rows]).delete()
+
+    return len(rows)
+
+
+def release_order_stock(order):
+    """
+    Release an order's reservations, e.g. when it's cancelled.
+    """
+    return release_reservations(StockReservation.objects.filter(order=order))
+
+
+def release_expired_reservations(batch_size=1000):
+    """
+    Release expired reservations, in batches of batch_size. Reservations locked
+    by another transaction (e.g. their order is being paid) are skipped.
+    Return how many reservations were released.
+    """
+    total = 0
+
+    while True:
+        expired = StockReservation.objects.filter(expires__lte=timezone.now()).order_by('expires')
+        released = release_reservations(
+            StockReservation.objects.filter(pk__in=expired.values('pk')[:batch_size]), skip_locked=True)
+        total += released
+
+        if released < batch_size:
+            return total
+
+
+def commit_order_stock(order, allow_negative=True):
+    """
+    Record the sale of a paid order's variants as movements, folded into their
+    stock by compact_inventory_movements(), turning its reservations into them.
+    Lines whose reservations already expired take their units from the variants'
+    stock slots, see take_stock(). Variant rows aren't locked or updated.
+
+    Return the variants whose slots didn't have the units of those lines, sold
+    beyond their stock, so they can be backordered or the order cancelled. With
+    allow_negative=False, InsufficientStock is raised instead and nothing is recorded.
+    """
+    with transaction.atomic():
+        reserved = Counter()
+        reservations = defaultdict(list)
+
+        for variant_pk, slot_pk, quantity in StockReservation.objects.select_for_update().filter(
+                order=order).values_list('variant_id', 'slot_id', 'quantity'):
+            reserved[variant_pk] += quantity
+            reservations[variant_pk].append((slot_pk, quantity))
+
+        quantities = get_order_quantities(order)
+        variant_pks = set(quantities) | set(reserved)
+
+        if not variant_pks:
+            return []
+
+        # Units reserved beyond what the order has now go back to their slots
+        returned = Counter()
+
+        for variant_pk, slots in reservations.items():
+            excess = reserved[variant_pk] - quantities[variant_pk]
+
+            for slot_pk, quantity in slots:
+                if excess <= 0:
+                    break
+
+                returned[slot_pk] += min(quantity, excess)
+                excess -= quantity
+
+        unreserved = {pk: quantities[pk] - reserved[pk] for pk in variant_pks if quantities[pk] > reserved[pk]}
+        create_stock_slots(unreserved)
+
+        taken = {pk: take_stock(pk, unreserved[pk]) for pk in sorted(unreserved)}
+        short_variant_pks = [
+            pk for pk, slots in taken.items() if sum(units for slot_pk, units in slots) < unreserved[pk]]
+
+        if short_variant_pks and not allow_negative:
+            raise InsufficientStock(list(ProductVariant.objects.filter(pk__in=short_variant_pks)))
+
+        adjust_stock_slots({pk: -units for slots in taken.values() for pk, units in slots})
+
+        if returned:
+            return_to_stock_slots(returned)
+
+        allocation = allocate_stock(quantities, store=order.store_id)
+        movements = []
+
+        for pk in sorted(variant_pks):
+            for i, (location_pk, quantity) in enumerate(allocation.get(pk) or [(None, 0)]):
+                # Reservations are released once per variant
+                movements.append(InventoryMovement(
+                    variant_id=pk, location_id=location_pk, quantity=-quantity,
+                    reserved_quantity=reserved[pk] if i == 0 else 0, reason=InventoryMovement.SALE, order=order))
+
+        InventoryMovement.objects.bulk_create(movements)
+
+        StockReservation.objects.filter(order=order).delete()
+
+    if short_variant_pks:
+        return list(ProductVariant.objects.filter(pk__in=short_variant_pks))
+
+    return []
+
+
+def compact_inventory_movements(batch_size=1000):
+    """
+    Fold movements into their variants' stock and their locations' stock, in
+    batches of batch_size, with one UPDATE per table and batch. Movements other
+    than sales, which took their units from the slots as they were recorded, are
+    added to the variants' stock slots, evened out again. Reserved stock is
+    refreshed once done. Return how many movements were compacted.
+    """
+    total = 0
+
+    while True:
+        with transaction.atomic():
+            rows = list(InventoryMovement.objects.filter(compacted__isnull=True).select_for_update(
+                skip_locked=True).values_list('pk', 'variant_id', 'location_id', 'quantity', 'reason')[:batch_size])
+
+            quantities = Counter()
+            slot_quantities = Counter()
+            location_quantities = Counter()
+
+            for pk, variant_pk, location_pk, quantity, reason in rows:
+                quantities[variant_pk] += quantity
+
+                if reason != InventoryMovement.SALE:
+                    slot_quantities[variant_pk] += quantity
+
+                if location_pk is not None:
+                    location_quantities[variant_pk, location_pk] += quantity
+
+            if rows:
+                lock_variants(quantities)
+                ProductVariant.objects.filter(pk__in=quantities).update(stock=get_adjustment('stock', quantities))
+
+                if location_quantities:
+                    compact_location_stock(location_quantities)
+
+                InventoryMovement.objects.filter(pk__in=[row[0] for row in rows]).update(compacted=timezone.now())
+
+                # Slots created now start from the stock just compacted
+                created_pks = create_stock_slots(quantities)
+                add_to_stock_slots({pk: slot_quantities[pk] for pk in quantities if pk not in created_pks})
+
+        total += len(rows)
+
+        if len(rows) < batch_size:
+            refresh_reserved_stock()
+            return total
+
+
+def refresh_reserved_stock():
+    """
+    Set the reserved stock of variants to the units of their stock their slots
+    don't hold, so their available_stock is what's left to reserve. Return how
+    many variants changed.
+    """
+    slot_stock = Subquery(StockSlot.objects.filter(variant=OuterRef('pk')).order_by().values(
+        'variant').annotate(total=Sum('quantity')).values('total'))
+    reserved_stock = Greatest(F('stock') - slot_stock, Value(0))
+
+    changed = ProductVariant.objects.annotate(slot_stock=slot_stock).filter(slot_stock__isnull=False).exclude(
+        reserved_stock=Greatest(F('stock') - F('slot_stock'), Value(0))).values('pk')
+
+    return ProductVariant.objects.filter(pk__in=changed).update(reserved_stock=reserved_stock)
+
+
+def compact_location_stock(location_quantities):
+    """
+    Add quantities, by (variant pk, location pk), to location stock.
+    """
+    LocationStock.objects.bulk_create([
+        LocationStock(variant_id=variant_pk, location_id=location_pk)
+        for variant_pk, location_pk in location_quantities
+    ], ignore_conflicts=True)
+
+    location_stock = LocationStock.objects.select_for_update().filter(
+        variant_id__in={variant_pk for variant_pk, location_pk in location_quantities},
+        location_id__in={location_pk for variant_pk, location_pk in location_quantities}
+    ).order_by('pk').values_list('pk', 'variant_id', 'location_id')
+
+    quantities = {
+        pk: location_quantities[variant_pk, location_pk] for pk, variant_pk, location_pk in location_stock
+        if (variant_pk, location_pk) in location_quantities
+    }
+
+    LocationStock.objects.filter(pk__in=quantities).update(quantity=get_adjustment('quantity', quantities))
+
+
+def rebuild_stock_totals():
+    """
+    Set the stock of variants kept at locations to the total of their locations,
+    e.g. when starting to use locations, and their stock slots to match.
+    Movements should be compacted first.
+    """
+    totals = LocationStock.objects.filter(variant=OuterRef('pk')).order_by().values(
+        'variant').annotate(total=Sum('quantity')).values('total')
+
+    with transaction.atomic():
+        rebuilt = ProductVariant.objects.filter(
+            pk__in=LocationStock.objects.values('variant_id')).update(stock=Subquery(totals))
+
+        reset_stock_slots(LocationStock.objects.values_list('variant_id', flat=True).distinct())
+
+    return rebuilt
+
+
+def reset_stock_slots(variant_pks):
+    """
+    Set the slots of variants back to their stock less their reservations, e.g.
+    after their stock was set outside of inventory movements.
+    """
+    variant_pks = set(variant_pks)
+    slots = defaultdict(list)
+
+    for pk, variant_pk, quantity in StockSlot.objects.select_for_update().filter(
+            variant_id__in=variant_pks).order_by('variant_id', 'pk').values_list('pk', 'variant_id', 'quantity'):
+        slots[variant_pk].append((pk, quantity))
+
+    adjustments = {}
+
+    for variant_pk, stock in get_slotted_stock(slots).items():
+        for (pk, quantity), share in zip(slots[variant_pk], split_quantity(stock, len(slots[variant_pk]))):
+            adjustments[pk] = share - quantity
+
+    adjust_stock_slots(adjustments)
+    create_stock_slots(variant_pks - set(slots))
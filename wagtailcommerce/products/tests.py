@@ -0,0 +1,354 @@
+import base64
+import json
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from wagtail.core.models import Site
+
+from wagtailcommerce.orders.models import Order, OrderLine
+from wagtailcommerce.products import category_tree
+from wagtailcommerce.products.exceptions import CatalogImportError, InsufficientStock
+from wagtailcommerce.products.importing import CatalogImporter
+from wagtailcommerce.products.models import (
+    Category, InventoryMovement, Product, ProductVariant, RelatedProduct, StockReservation, StockSlot)
+from wagtailcommerce.products.related import rebuild_related_products
+from wagtailcommerce.products.stock import (
+    compact_inventory_movements, create_stock_slots, release_expired_reservations, reserve_order_stock)
+from wagtailcommerce.stores.models import Currency, Store
+from wagtailcommerce.utils.pagination import InvalidCursor, keyset_page
+
+
+class WithProducts(object):
+    @classmethod
+    def setUpTestData(cls):
+        currency = Currency.objects.create(name='Peso', code='ARS', symbol='$')
+        cls.store = Store.objects.create(name='Store', tax_rate=0, currency=currency, site=Site.objects.first())
+        cls.user = get_user_model().objects.create(username='customer', email='customer@example.com')
+
+    def create_variant(self, sku, stock=0):
+        product = Product.objects.create(
+            store=self.store, name=sku, slug=sku.lower(), active=True, regular_price=Decimal('10.00'))
+
+        return ProductVariant.objects.create(product=product, sku=sku, active=True, stock=stock)
+
+    def create_order(self, variants, status=Order.PAID, quantity=1):
+        order = Order.objects.create(
+            store=self.store, user=self.user, status=status, language_code='en', subtotal=0, product_discount=0,
+            product_tax=0, shipping_cost=0, shipping_cost_discount=0, shipping_cost_total=0, total=0, total_inc_tax=0)
+
+        for variant in variants:
+            OrderLine.objects.create(
+                order=order, product_variant=variant, sku=variant.sku, quantity=quantity, product_name=variant.sku,
+                product_variant_description='', product_details={}, item_unit_price=1, item_unit_regular_price=1,
+                item_unit_promotions_discount=0, item_unit_price_with_promotions_discount=1, line_total=1)
+
+        return order
+
+
+class TestRebuildRelatedProducts(WithProducts, TestCase):
+    def get_pairs(self):
+        return {
+            (product, related_product): co_purchases
+            for product, related_product, co_purchases in RelatedProduct.objects.values_list(
+                'product__name', 'related_product__name', 'co_purchases')
+        }
+
+    def test_rebuild_since_keeps_pairs_of_products_not_bought_since(self):
+        a, b, x, y = [self.create_variant(sku) for sku in ('A', 'B', 'X', 'Y')]
+
+        old_order = self.create_order([a, b, x])
+        Order.objects.filter(pk=old_order.pk).update(date_placed=timezone.now() - timedelta(days=30))
+        self.create_order([x, y])
+
+        rebuild_related_products()
+        rebuild_related_products(since=timezone.now() - timedelta(days=1))
+
+        self.assertEqual(self.get_pairs(), {
+            ('A', 'B'): 1, ('B', 'A'): 1, ('A', 'X'): 1, ('X', 'A'): 1, ('B', 'X'): 1, ('X', 'B'): 1,
+            ('X', 'Y'): 1, ('Y', 'X'): 1,
+        })
+
+
+def get_slot_stock(variant):
+    return StockSlot.objects.filter(variant=variant).aggregate(total=Sum('quantity'))['total']
+
+
+class TestVariantStockEdits(WithProducts, TestCase):
+    def test_refresh_from_db_reloads_stock(self):
+        variant = self.create_variant('A', stock=10)
+
+        InventoryMovement.objects.create(variant=variant, quantity=-3, reason=InventoryMovement.SALE)
+        compact_inventory_movements()
+
+        variant.refresh_from_db()
+        variant.name = 'Renamed'
+        variant.save()
+
+        self.assertFalse(InventoryMovement.objects.filter(reason=InventoryMovement.ADJUSTMENT).exists())
+        self.assertEqual(ProductVariant.objects.get(pk=variant.pk).stock, 7)
+
+    def test_stock_edits_are_applied_once_compacted(self):
+        variant = self.create_variant('A', stock=10)
+
+        # A sale made since the variant was loaded
+        InventoryMovement.objects.create(variant=variant, quantity=-2, reason=InventoryMovement.SALE)
+
+        variant.stock = 15
+        variant.save(update_fields=['stock'])
+
+        self.assertEqual(ProductVariant.objects.get(pk=variant.pk).stock, 10)
+        self.assertEqual(list(InventoryMovement.objects.filter(compacted__isnull=True).values_list(
+            'reason', 'quantity').order_by('pk')), [(InventoryMovement.SALE, -2), (InventoryMovement.ADJUSTMENT, 5)])
+
+        self.assertEqual(compact_inventory_movements(), 2)
+        self.assertEqual(ProductVariant.objects.get(pk=variant.pk).stock, 13)
+        self.assertEqual(get_slot_stock(variant), 13)
+
+    def test_stock_left_out_of_update_fields_is_not_saved(self):
+        variant = self.create_variant('A', stock=10)
+
+        variant.stock = 15
+        variant.name = 'Renamed'
+        variant.save(update_fields=['name'])
+
+        self.assertEqual(ProductVariant.objects.get(pk=variant.pk).stock, 10)
+        self.assertFalse(InventoryMovement.objects.exists())
+
+    def test_reserved_stock_cant_be_saved(self):
+        variant = self.create_variant('A', stock=10)
+
+        variant.reserved_stock = 5
+
+        with self.assertRaises(ValueError):
+            variant.save(update_fields=['reserved_stock'])
+
+        variant.save()
+        self.assertEqual(ProductVariant.objects.get(pk=variant.pk).reserved_stock, 0)
+
+
+class TestStockReservations(WithProducts, TestCase):
+    def test_expired_reservations_return_their_stock_to_the_slots(self):
+        variant = self.create_variant('A', stock=10)
+        order = self.create_order([variant], status=Order.PAYMENT_PENDING, quantity=3)
+
+        reserve_order_stock(order)
+
+        self.assertEqual(get_slot_stock(variant), 7)
+        self.assertEqual(order.stock_reservations.aggregate(total=Sum('quantity'))['total'], 3)
+
+        compact_inventory_movements()
+        self.assertEqual(ProductVariant.objects.get(pk=variant.pk).available_stock, 7)
+
+        StockReservation.objects.update(expires=timezone.now() - timedelta(seconds=1))
+        release_expired_reservations()
+
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(get_slot_stock(variant), 10)
+
+        compact_inventory_movements()
+        self.assertEqual(ProductVariant.objects.get(pk=variant.pk).available_stock, 10)
+
+    def test_nothing_is_reserved_when_a_variant_is_short(self):
+        a, b = self.create_variant('A', stock=10), self.create_variant('B', stock=1)
+        order = self.create_order([a, b], status=Order.PAYMENT_PENDING, quantity=2)
+
+        with self.assertRaises(InsufficientStock) as context:
+            reserve_order_stock(order)
+
+        self.assertEqual(context.exception.variants, [b])
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual((get_slot_stock(a), get_slot_stock(b)), (10, 1))
+
+
+@skipUnless(connection.features.has_select_for_update_skip_locked, 'Stock slots are locked with SKIP LOCKED')
+class TestConcurrentReservations(WithProducts, TransactionTestCase):
+    def setUp(self):
+        self.setUpTestData()
+
+    def create_variant(self, sku, stock=0):
+        variant = super().create_variant(sku, stock)
+
+        # Otherwise the first checkout creates them, and the others wait for it
+        create_stock_slots([variant.pk])
+
+        return variant
+
+    def hold_reservation(self, order):
+        """
+        Reserve an order's stock in a transaction kept open, in another thread,
+        until the returned event is set.
+        """
+        reserved, release = threading.Event(), threading.Event()
+
+        def reserve():
+            try:
+                with transaction.atomic():
+                    reserve_order_stock(order)
+                    reserved.set()
+                    release.wait(5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=reserve)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+
+        self.assertTrue(reserved.wait(5))
+
+        return release
+
+    def reserve_in_thread(self, order):
+        errors = []
+
+        def reserve():
+            try:
+                reserve_order_stock(order)
+            except InsufficientStock as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=reserve)
+        thread.start()
+
+        return thread, errors
+
+    def test_checkouts_of_a_variant_dont_wait_on_each_other(self):
+        variant = self.create_variant('A', stock=10)
+
+        self.hold_reservation(self.create_order([variant], status=Order.PAYMENT_PENDING))
+
+        thread, errors = self.reserve_in_thread(self.create_order([variant], status=Order.PAYMENT_PENDING))
+        thread.join(5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(errors, [])
+
+    def test_checkouts_wait_for_the_last_units(self):
+        variant = self.create_variant('A', stock=1)
+
+        release = self.hold_reservation(self.create_order([variant], status=Order.PAYMENT_PENDING))
+
+        thread, errors = self.reserve_in_thread(self.create_order([variant], status=Order.PAYMENT_PENDING))
+        thread.join(0.5)
+        self.assertTrue(thread.is_alive())
+
+        release.set()
+        thread.join(5)
+
+        self.assertEqual([e.variants for e in errors], [[variant]])
+        self.assertEqual(StockReservation.objects.count(), 1)
+
+
+class TestCatalogImporter(WithProducts, TestCase):
+    rows = [
+        {'kind': 'product', 'type': 'wagtailcommerce_products.Product', 'ref': 'hat', 'name': 'Hat', 'active': 'true'},
+        {'kind': 'variant', 'type': 'wagtailcommerce_products.ProductVariant', 'product': 'hat', 'sku': 'HAT-1'},
+    ]
+
+    def test_reimport_matches_products_on_ref(self):
+        counts = CatalogImporter(self.store, update_index=False).import_rows(self.rows)
+        self.assertEqual((counts['products'], counts['variants']), (1, 1))
+
+        counts = CatalogImporter(self.store, update_index=False).import_rows(self.rows)
+        self.assertEqual((counts['products_skipped'], counts['variants_skipped']), (1, 1))
+
+        product = Product.objects.get()
+        self.assertEqual(product.import_ref, 'hat')
+        self.assertEqual(list(product.variants.values_list('sku', flat=True)), ['HAT-1'])
+
+    def test_products_need_a_ref_or_identifier(self):
+        with self.assertRaises(CatalogImportError):
+            CatalogImporter(self.store, update_index=False).import_rows([dict(self.rows[0], ref='')])
+
+    def test_products_of_other_stores_are_not_matched(self):
+        other_store = Store.objects.create(name='Other store', tax_rate=0, currency=self.store.currency)
+        CatalogImporter(other_store, update_index=False).import_rows([dict(self.rows[0], ref='', identifier='HAT')])
+
+        with self.assertRaises(CatalogImportError):
+            CatalogImporter(self.store, update_index=False).import_rows([dict(self.rows[1], product='HAT')])
+
+        with self.assertRaises(CatalogImportError):
+            CatalogImporter(self.store, update_index=False).import_rows([dict(self.rows[0], identifier='HAT')])
+
+        self.assertFalse(Product.objects.filter(store=self.store).exists())
+
+    def test_categories_need_a_slug(self):
+        with self.assertRaises(CatalogImportError):
+            CatalogImporter(self.store, update_index=False).import_rows([{'kind': 'category', 'name': 'Hats'}])
+
+
+class TestVariantImagesUpdates(WithProducts, TestCase):
+    def test_variant_images_are_only_rebuilt_when_filtering_fields_change(self):
+        variant = self.create_variant('A')
+        other_product = self.create_variant('B').product
+
+        with mock.patch('wagtailcommerce.products.variant_images.update_variant_images') as update_variant_images:
+            variant.name = 'Renamed'
+            variant.stock = 5
+            variant.save()
+            self.assertFalse(update_variant_images.called)
+
+            variant.product = other_product
+            variant.save(update_fields=['product'])
+            self.assertTrue(update_variant_images.called)
+
+
+class TestCategoryLabels(WithProducts, TestCase):
+    def setUp(self):
+        self.hats = Category.add_root(store=self.store, name='Hats', slug='hats')
+        self.caps = self.hats.add_child(store=self.store, name='Caps', slug='caps')
+
+    def test_labels_reuse_the_tree_without_checking_its_version(self):
+        self.assertEqual(str(self.caps), 'Hats » Caps')
+
+        with mock.patch.object(category_tree, 'get_category_tree_version') as get_version:
+            self.assertEqual([str(self.hats), str(self.caps)], ['Hats', 'Hats » Caps'])
+
+        self.assertFalse(get_version.called)
+
+    def test_labels_follow_changes(self):
+        self.assertEqual(str(self.caps), 'Hats » Caps')
+
+        self.hats.name = 'Headwear'
+        self.hats.save()
+        self.assertEqual(str(self.caps), 'Headwear » Caps')
+
+        # Another process invalidating the tree is noticed once the version is checked again
+        Category.objects.filter(pk=self.hats.pk).update(name='Hats')
+        category_tree.get_cache().set(category_tree.CATEGORY_TREE_VERSION_KEY.format(self.store.pk), 'other', None)
+
+        with override_settings(WAGTAILCOMMERCE_CATEGORY_TREE_CHECK_INTERVAL=0):
+            self.assertEqual(str(self.caps), 'Hats » Caps')
+
+
+class TestKeysetPage(WithProducts, TestCase):
+    fields = ['featured', 'created', 'id']
+
+    def test_pages_follow_each_other(self):
+        products = [self.create_variant(sku).product for sku in ('A', 'B', 'C')]
+
+        page, end_cursor, has_next_page = keyset_page(Product.objects.all(), self.fields, 2)
+        self.assertEqual((page, has_next_page), (products[:0:-1], True))
+
+        page, end_cursor, has_next_page = keyset_page(Product.objects.all(), self.fields, 2, end_cursor)
+        self.assertEqual((page, has_next_page), (products[:1], False))
+
+    def test_malformed_cursors_are_invalid(self):
+        product = self.create_variant('A').product
+        created = product.created.isoformat()
+
+        for values in ([False, created], {'id': 1}, 1, [False, 1, product.pk], [False, created, 'x'],
+                       [False, created, [1]], ['x', created, product.pk], [False, 'x', product.pk]):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+            with self.assertRaises(InvalidCursor):
+                keyset_page(Product.objects.all(), self.fields, 2, cursor)
@@ -0,0 +1,129 @@
+from __future__ import absolute_import, unicode_literals
+
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+
+from wagtailcommerce.products.models import Image, ImageSet, ProductVariant, VariantImage
+
+
+def get_filtering_key(variant, field_name):
+    """
+    Return the (content type pk, object pk) of the object a variant field points
+    to, matched against image sets' filtering relation.
+    """
+    field = variant._meta.get_field(field_name)
+
+    if field.many_to_one:
+        # Read the foreign key without fetching the related object
+        object_pk = getattr(variant, field.attname)
+        return ContentType.objects.get_for_model(field.related_model).pk if object_pk is not None else None, object_pk
+
+    filtering_object = getattr(variant, field_name)
+
+    if filtering_object is None:
+        return None, None
+
+    return ContentType.objects.get_for_model(filtering_object).pk, filtering_object.pk
+
+
+def get_image_set_filtering_fields(product):
+    """
+    Return the names of the variant fields matched against a product's image sets.
+    """
+    product_class = ContentType.objects.get_for_id(product.content_type_id).model_class()
+
+    return getattr(product_class, 'image_set_filtering_fields', [])
+
+
+def get_variant_image_set_pk(variant, image_sets):
+    """
+    Return the pk of the image set matching variant out of its product's image
+    sets, (pk, content type pk, object pk) tuples sorted by pk, or None.
+    """
+    for field_name in get_image_set_filtering_fields(variant.product):
+        key = get_filtering_key(variant.specific, field_name)
+        image_sets = [image_set for image_set in image_sets if image_set[1:] == key]
+
+    return image_sets[0][0] if image_sets else None
+
+
+def update_variant_images(variants):
+    """
+    Rebuild the VariantImage rows of variants, a ProductVariant queryset,
+    with the images of the image set each one matches.
+    """
+    variants = list(variants.select_specific().select_related('product'))
+
+    if not variants:
+        return
+
+    image_sets = defaultdict(list)
+
+    for image_set in ImageSet.objects.filter(product_id__in={variant.product_id for variant in variants}).order_by(
+            'pk').values_list('product_id', 'pk', 'content_type_id', 'object_id'):
+        image_sets[image_set[0]].append(image_set[1:])
+
+    variant_image_sets = {
+        variant.pk: get_variant_image_set_pk(variant, image_sets[variant.product_id]) for variant in variants
+    }
+
+    images = defaultdict(list)
+
+    for image_set_pk, image_pk in Image.objects.filter(
+            image_set_id__in=set(variant_image_sets.values()), image__isnull=False
+    ).order_by('image_set_id', 'sort_order', 'pk').values_list('image_set_id', 'image_id'):
+        images[image_set_pk].append(image_pk)
+
+    with transaction.atomic():
+        VariantImage.objects.filter(variant_id__in=variant_image_sets).delete()
+        VariantImage.objects.bulk_create([
+            VariantImage(variant_id=variant_pk, image_id=image_pk, sort_order=i)
+            for variant_pk, image_set_pk in variant_image_sets.items()
+            for i, image_pk in enumerate(images.get(image_set_pk, []))
+        ])
+
+
+def get_images_for_variants(variant_pks, limit=None):
+    """
+    Return the images of variants by variant pk, in order, with a single query.
+    With limit, only the first limit images of each variant are returned.
+    """
+    variant_images = VariantImage.objects.filter(variant_id__in=variant_pks)
+
+    if limit is not None:
+        variant_images = variant_images.filter(sort_order__lt=limit)
+
+    images = defaultdict(list)
+
+    for variant_image in variant_images.select_related('image').order_by('variant_id', 'sort_order'):
+        images[variant_image.variant_id].append(variant_image.image)
+
+    return images
+
+
+def prefetch_variant_images(objects, variant_attname='variant_id'):
+    """
+    Set the ``primary_image`` of objects referencing variants, e.g. cart or order
+    lines, to their variant's first image, with a single query.
+    """
+    images = get_images_for_variants({getattr(obj, variant_attname) for obj in objects}, limit=1)
+
+    for obj in objects:
+        variant_images = images.get(getattr(obj, variant_attname))
+        obj.__dict__['primary_image'] = variant_images[0] if variant_images else None
+
+    return objects
+
+
+def rebuild_variant_images(batch_size=1000):
+    """
+    Rebuild the VariantImage rows of every variant.
+    """
+    variant_pks = list(ProductVariant.objects.order_by('pk').values_list('pk', flat=True))
+
+    for start in range(0, len(variant_pks), batch_size):
+        update_variant_images(ProductVariant.objects.filter(pk__in=variant_pks[start:start + batch_size]))
+
+    return len(variant_pks)
@@ -0,0 +1,71 @@
+from __future__ import absolute_import, unicode_literals
+
+from decimal import ROUND_FLOOR, ROUND_HALF_UP, Decimal
+
+from wagtailcommerce.promotions.models import Coupon
+
+CENT = Decimal('0.01')
+
+
+def allocate_amount(amount, weights, quantum=CENT):
+    """
+    Split amount across weights proportionally, in multiples of quantum.
+
+    Uses the largest remainder method: every share is rounded down (towards
+    negative infinity, so negative amounts work too), and the leftover quanta
+    go to the shares with the biggest rounding loss (earlier entries win ties),
+    so the shares always add up to exactly amount.
+    """
+    weight_total = sum(weights, Decimal('0'))
+
+    if not amount or not weight_total:
+        return [Decimal('0') for weight in weights]
+
+    exact_shares = [amount * weight / weight_total for weight in weights]
+    shares = [share.quantize(quantum, rounding=ROUND_FLOOR) for share in exact_shares]
+
+    leftover = int(((amount - sum(shares, Decimal('0'))) / quantum).to_integral_value(rounding=ROUND_HALF_UP))
+
+    by_remainder = sorted(range(len(shares)), key=lambda i: (shares[i] - exact_shares[i], i))
+
+    for i in by_remainder[:leftover]:
+        shares[i] += quantum
+
+    return shares
+
+
+def allocate_coupon_discount(coupon, line_subtotals, eligible_lines=None):
+    """
+    Compute an order total coupon's discount and distribute it across lines.
+
+    line_subtotals are the lines' undiscounted totals. eligible_lines optionally
+    flags which lines a percentage coupon applies to (all of them if None).
+
+    Returns a (discount, line_discounts) tuple. line_discounts follows the order
+    of line_subtotals and always adds up to discount.
+    """
+    no_discount = (Decimal('0'), [Decimal('0') for subtotal in line_subtotals])
+
+    if not coupon or coupon.coupon_type != Coupon.ORDER_TOTAL:
+        return no_discount
+
+    if coupon.coupon_mode == Coupon.COUPON_MODE_PERCENTAGE:
+        if eligible_lines is None:
+            weights = list(line_subtotals)
+        else:
+            weights = [
+                subtotal if eligible else Decimal('0')
+                for subtotal, eligible in zip(line_subtotals, eligible_lines)
+            ]
+
+        discount = (sum(weights, Decimal('0')) * coupon.coupon_amount / Decimal('100')).quantize(
+            CENT, rounding=ROUND_HALF_UP)
+
+    elif coupon.coupon_mode == Coupon.COUPON_MODE_FIXED:
+        weights = list(line_subtotals)
+        discount = min(coupon.coupon_amount, sum(weights, Decimal('0')))
+
+    else:
+        return no_discount
+
+    return discount, allocate_amount(discount, weights)
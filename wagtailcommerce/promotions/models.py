@@ -1,5 +1,6 @@
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
@@ -132,3 +133,11 @@ class Coupon(models.Model):
     class Meta:
         verbose_name = _('coupon')
         verbose_name_plural = _('coupons')
+
+
+@receiver(models.signals.post_save, sender=Coupon)
+@receiver(models.signals.post_delete, sender=Coupon)
+def coupon_changed(sender, instance, **kwargs):
+    from wagtailcommerce.promotions.utils import invalidate_auto_assign_coupon
+
+    invalidate_auto_assign_coupon()
@@ -0,0 +1,80 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from wagtailcommerce.promotions.allocation import allocate_amount
+from wagtailcommerce.promotions.models import Coupon
+from wagtailcommerce.promotions.utils import get_auto_assign_coupon, get_cache
+
+
+def create_coupon(code, **kwargs):
+    return Coupon.objects.create(
+        name=code, code=code, coupon_type=Coupon.ORDER_TOTAL, coupon_mode=Coupon.COUPON_MODE_FIXED,
+        coupon_amount=Decimal('5.00'), **dict({'auto_assign_to_new_users': True}, **kwargs))
+
+
+class TestAutoAssignCoupon(TestCase):
+    def setUp(self):
+        get_cache().clear()
+
+    def test_coupon_is_cached_until_it_stops_being_valid(self):
+        coupon = create_coupon('WELCOME', valid_until=timezone.now() + timedelta(seconds=30))
+
+        with mock.patch.object(get_cache(), 'set', wraps=get_cache().set) as cache_set:
+            self.assertEqual(get_auto_assign_coupon(), coupon)
+
+        timeout = cache_set.call_args[0][2]
+        self.assertTrue(0 < timeout <= 31)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_auto_assign_coupon(), coupon)
+
+    def test_cache_expires_when_a_coupon_starts_being_valid(self):
+        create_coupon('LATER', valid_from=timezone.now() + timedelta(seconds=60))
+
+        with mock.patch.object(get_cache(), 'set', wraps=get_cache().set) as cache_set:
+            self.assertIsNone(get_auto_assign_coupon())
+
+        self.assertTrue(0 < cache_set.call_args[0][2] <= 61)
+
+    def test_saving_a_coupon_invalidates_the_cache(self):
+        self.assertIsNone(get_auto_assign_coupon())
+
+        coupon = create_coupon('WELCOME')
+        self.assertEqual(get_auto_assign_coupon(), coupon)
+
+        coupon.active = False
+        coupon.save()
+        self.assertIsNone(get_auto_assign_coupon())
+
+
+class TestAllocateAmount(SimpleTestCase):
+    def test_shares_add_up_to_the_amount(self):
+        self.assertEqual(allocate_amount(Decimal('10.00'), [Decimal('1')] * 3), [
+            Decimal('3.34'), Decimal('3.33'), Decimal('3.33')])
+
+        # The leftover cent goes to the share losing most to rounding
+        self.assertEqual(allocate_amount(Decimal('1.00'), [Decimal('10'), Decimal('20'), Decimal('70')]), [
+            Decimal('0.10'), Decimal('0.20'), Decimal('0.70')])
+        self.assertEqual(allocate_amount(Decimal('0.05'), [Decimal('1'), Decimal('2'), Decimal('2')]), [
+            Decimal('0.01'), Decimal('0.02'), Decimal('0.02')])
+        self.assertEqual(allocate_amount(Decimal('0.10'), [Decimal('1'), Decimal('1'), Decimal('4')]), [
+            Decimal('0.02'), Decimal('0.02'), Decimal('0.06')])
+
+        for amount in ('0.01', '9.99', '123.45'):
+            shares = allocate_amount(Decimal(amount), [Decimal('3.10'), Decimal('0.70'), Decimal('11.00')])
+            self.assertEqual(sum(shares), Decimal(amount))
+
+    def test_negative_amounts_add_up(self):
+        shares = allocate_amount(Decimal('-10.00'), [Decimal('1')] * 3)
+
+        self.assertEqual(sum(shares), Decimal('-10.00'))
+        self.assertEqual(sorted(shares), [Decimal('-3.34'), Decimal('-3.33'), Decimal('-3.33')])
+
+    def test_nothing_is_allocated_without_an_amount_or_weights(self):
+        self.assertEqual(allocate_amount(Decimal('0'), [Decimal('1'), Decimal('2')]), [Decimal('0')] * 2)
+        self.assertEqual(allocate_amount(Decimal('5.00'), [Decimal('0'), Decimal('0')]), [Decimal('0')] * 2)
+        self.assertEqual(allocate_amount(Decimal('5.00'), []), [])
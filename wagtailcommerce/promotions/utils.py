@@ -1,13 +1,80 @@
-from django.db.models import F
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F, Min
 from django.utils import timezone
 
 from wagtailcommerce.promotions.models import Coupon
 
+AUTO_ASSIGN_COUPON_CACHE_KEY = 'wagtailcommerce:auto_assign_coupon'
+
+# Seconds the auto assign coupon is cached for when no validity date comes sooner
+DEFAULT_AUTO_ASSIGN_COUPON_CACHE_TIMEOUT = 60 * 60
+
+
+def get_cache():
+    return caches[getattr(settings, 'WAGTAILCOMMERCE_COUPON_CACHE', 'default')]
+
+
+def get_auto_assign_coupon():
+    """
+    Return the coupon assigned to carts without one, the latest valid coupon
+    auto assigned to new users, or None.
+
+    Cached until a coupon is saved or deleted, or until it or another auto
+    assign coupon starts or stops being valid, whichever comes first.
+    """
+    cache = get_cache()
+    cached = cache.get(AUTO_ASSIGN_COUPON_CACHE_KEY)
+
+    if cached is not None:
+        return cached[0]
+
+    now = timezone.now()
+    coupon = Coupon.objects.active().filter(auto_assign_to_new_users=True).order_by('-created').first()
+
+    expires = [Coupon.objects.filter(
+        auto_assign_to_new_users=True, active=True, valid_from__gt=now
+    ).aggregate(next_valid_from=Min('valid_from'))['next_valid_from']]
+
+    if coupon is not None:
+        expires.append(coupon.valid_until)
+
+    timeout = getattr(settings, 'WAGTAILCOMMERCE_AUTO_ASSIGN_COUPON_CACHE_TIMEOUT',
+                      DEFAULT_AUTO_ASSIGN_COUPON_CACHE_TIMEOUT)
+
+    for expiry in expires:
+        if expiry is not None:
+            timeout = min(timeout, max(int((expiry - now).total_seconds()) + 1, 1))
+
+    # Wrapped, so a cached None is told apart from a cache miss
+    cache.set(AUTO_ASSIGN_COUPON_CACHE_KEY, (coupon, ), timeout)
+
+    return coupon
+
+
+def invalidate_auto_assign_coupon():
+    """
+    Look the auto assign coupon up again on next access, and again on commit,
+    so a coupon read from uncommitted data isn't kept.
+    """
+    def delete():
+        get_cache().delete(AUTO_ASSIGN_COUPON_CACHE_KEY)
+
+    delete()
+    transaction.on_commit(delete)
+
 
 def verify_coupon(coupon):
     """
     Check if the coupon is still valid.
     """
+    if coupon.auto_assign_to_new_users:
+        auto_assign_coupon = get_auto_assign_coupon()
+
+        if auto_assign_coupon is not None and auto_assign_coupon.pk == coupon.pk:
+            return True
+
     try:
         Coupon.objects.active().get(pk=coupon.pk)
     except Coupon.DoesNotExist:
@@ -17,6 +84,8 @@ def verify_coupon(coupon):
 
 
 def apply_coupon(coupon_code, cart):
+    from wagtailcommerce.carts.storage import save_cart
+
     try:
         coupon = Coupon.objects.get(code__iexact=coupon_code.strip(), active=True, auto_generated=False)
 
@@ -24,7 +93,7 @@ def apply_coupon(coupon_code, cart):
             return False
 
         cart.coupon = coupon
-        cart.save()
+        save_cart(cart)
 
         Coupon.objects.filter(pk=coupon.pk).update(times_added_to_cart=F('times_added_to_cart') + 1)
 
@@ -35,8 +104,10 @@ def apply_coupon(coupon_code, cart):
 
 
 def remove_coupon(cart):
+    from wagtailcommerce.carts.storage import save_cart
+
     if cart.coupon:
         cart.coupon = None
-        cart.save()
+        save_cart(cart)
 
     return True
@@ -15,6 +15,7 @@ from wagtail.core.models import Orderable
 from wagtail.images.edit_handlers import ImageChooserPanel
 
 from wagtailcommerce.shipping.query import ShipmentQuerySet
+from wagtailcommerce.utils.query import SelectSpecificMixin
 
 SHIPPING_METHOD_MODEL_CLASSES = []
 SHIPMENT_MODEL_CLASSES = []
@@ -36,8 +37,9 @@ def get_default_shipment_content_type():
     return ContentType.objects.get_for_model(Shipment)
 
 
-class ShippingMethodQueryset(models.QuerySet):
-    pass
+class ShippingMethodQueryset(SelectSpecificMixin, models.QuerySet):
+    def get_specific_model_classes(self):
+        return SHIPPING_METHOD_MODEL_CLASSES
 
 
 class BaseShippingMethodManager(models.Manager):
@@ -173,14 +175,17 @@ class ShippingMethod(AbstractShippingMethod, ClusterableModel, metaclass=Shippin
         return True
 
 
-    def get_shipping_cost(self, cart, shipping_address):
+    def get_shipping_cost(self, cart, shipping_address, cart_total=None):
         """
-        Return the shipping cost for a specified shipping address
+        Return the shipping cost for a specified shipping address.
+
+        cart_total can be passed when it's already known, to avoid pricing the cart again.
         """
         shipping_cost = self.calculate_shipping_cost(cart, shipping_address)
 
         if self.free_shipping_above_amount:
-            cart_total = cart.get_total()
+            if cart_total is None:
+                cart_total = cart.get_total()
 
             if cart_total > self.free_shipping_above_amount:
                 shipping_cost['discount'] = shipping_cost['cost']
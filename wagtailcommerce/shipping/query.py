@@ -4,10 +4,10 @@ from django.contrib.contenttypes.models import ContentType
 from django.db.models import QuerySet
 from django.db.models.query import BaseIterable
 
-from wagtailcommerce.utils.query import SpecificIterable
+from wagtailcommerce.utils.query import PrefetchSpecificMixin, SpecificIterable
 
 
-class ShipmentQuerySet(QuerySet):
+class ShipmentQuerySet(PrefetchSpecificMixin, QuerySet):
     def specific(self):
         """
         This efficiently gets all the specific objects for the queryset, using
@@ -0,0 +1,112 @@
+from __future__ import absolute_import, unicode_literals
+
+from django.db import connections, router, transaction
+
+
+def get_inheritance_chain(model):
+    """
+    Return the concrete models whose tables store instances of model, root first.
+    """
+    return [parent for parent in reversed(model._meta.get_parent_list()) if not parent._meta.proxy] + [model]
+
+
+def bulk_create_inherited(model, objs, batch_size=1000, using=None):
+    """
+    Insert objs, all instances of model, table by table along its multi-table
+    inheritance chain, with one INSERT per table and batch. Primary keys are
+    read back from the root table and set on objs.
+
+    Like ``QuerySet.bulk_create``, this doesn't call ``save()`` or send any
+    signals. Unlike it, model may have concrete parents.
+    """
+    objs = list(objs)
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+
+    chain = get_inheritance_chain(model)
+    root = chain[0]
+
+    with transaction.atomic(using=using, savepoint=False):
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start:start + batch_size]
+
+            root_fields = [field for field in root._meta.local_concrete_fields if field is not root._meta.auto_field]
+
+            # A single row INSERT returns its id rather than a list of ids
+            if connection.features.can_return_ids_from_bulk_insert and len(batch) > 1:
+                ids = root._base_manager._insert(batch, fields=root_fields, return_id=True, using=using)
+            else:
+                ids = [
+                    root._base_manager._insert([obj], fields=root_fields, return_id=True, using=using)
+                    for obj in batch
+                ]
+
+            for obj, pk in zip(batch, ids):
+                setattr(obj, root._meta.pk.attname, pk)
+
+            for parent, child in zip(chain, chain[1:]):
+                parent_link = child._meta.parents[parent]
+
+                for obj in batch:
+                    setattr(obj, parent_link.attname, getattr(obj, parent._meta.pk.attname))
+
+                child._base_manager._insert(batch, fields=child._meta.local_concrete_fields, using=using)
+
+            for obj in batch:
+                obj._state.adding = False
+                obj._state.db = using
+
+    return objs
+
+
+def bulk_upsert(model, objs, unique_fields, update_fields, batch_size=1000, using=None):
+    """
+    Insert objs, or update update_fields of the rows they conflict with on
+    unique_fields, with one INSERT ... ON CONFLICT DO UPDATE statement per
+    batch. unique_fields must match a unique constraint. On databases other
+    than PostgreSQL, objs are updated one by one, then the rest are inserted.
+
+    Like ``QuerySet.bulk_create``, this doesn't call ``save()`` or send any
+    signals, and primary keys aren't set on objs.
+    """
+    objs = list(objs)
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+
+    opts = model._meta
+
+    if connection.vendor != 'postgresql':
+        manager = model._base_manager.using(using)
+
+        def get_values(obj, names):
+            return {opts.get_field(name).attname: getattr(obj, opts.get_field(name).attname) for name in names}
+
+        with transaction.atomic(using=using, savepoint=False):
+            new_objs = [
+                obj for obj in objs
+                if not manager.filter(**get_values(obj, unique_fields)).update(**get_values(obj, update_fields))
+            ]
+            manager.bulk_create(new_objs, batch_size=batch_size)
+
+        return
+
+    fields = [field for field in opts.local_concrete_fields if field is not opts.auto_field]
+
+    sql = 'INSERT INTO {} ({}) VALUES {{}} ON CONFLICT ({}) DO UPDATE SET {}'.format(
+        quote_name(opts.db_table),
+        ', '.join(quote_name(field.column) for field in fields),
+        ', '.join(quote_name(opts.get_field(name).column) for name in unique_fields),
+        ', '.join('{0} = EXCLUDED.{0}'.format(quote_name(opts.get_field(name).column)) for name in update_fields)
+    )
+    row = '({})'.format(', '.join(['%s'] * len(fields)))
+
+    with transaction.atomic(using=using, savepoint=False), connection.cursor() as cursor:
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start:start + batch_size]
+            params = []
+
+            for obj in batch:
+                params.extend(field.get_db_prep_save(field.pre_save(obj, True), connection) for field in fields)
+
+            cursor.execute(sql.format(', '.join([row] * len(batch))), params)
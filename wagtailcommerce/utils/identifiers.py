@@ -0,0 +1,138 @@
+from __future__ import absolute_import, unicode_literals
+
+import secrets
+import string
+
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+from django.utils.module_loading import import_string
+
+
+class IdentifierAllocator(object):
+    """
+    Allocates short random identifiers for a unique model field.
+
+    Uniqueness is guaranteed by the field's unique constraint: identifiers
+    are inserted optimistically inside a savepoint, and a fresh one is drawn
+    if the insert collides. Identifiers are drawn with ``secrets``, so
+    allocators are safe to share between threads.
+    """
+    field_name = 'identifier'
+    alphabet = string.ascii_lowercase + string.digits
+    length = 8
+    max_attempts = 10
+
+    def __init__(self, model, alphabet=None, length=None, field_name=None):
+        self.model = model
+        self.alphabet = alphabet or self.alphabet
+        self.length = length or self.length
+        self.field_name = field_name or self.field_name
+
+    def generate(self):
+        """
+        Return a random identifier, without checking whether it's in use.
+        """
+        return ''.join(secrets.choice(self.alphabet) for i in range(self.length))
+
+    def allocate(self, count):
+        """
+        Return count distinct identifiers that aren't in use, checking each
+        block of candidates with a single query.
+        """
+        identifiers = set()
+
+        while len(identifiers) < count:
+            candidates = {self.generate() for i in range(count - len(identifiers))} - identifiers
+
+            taken = self.model._default_manager.filter(**{
+                '{}__in'.format(self.field_name): candidates
+            }).values_list(self.field_name, flat=True)
+
+            identifiers.update(candidates.difference(taken))
+
+        return list(identifiers)
+
+    def is_taken(self, identifier):
+        return self.model._default_manager.filter(**{self.field_name: identifier}).exists()
+
+    def get_pk_attnames(self, instance):
+        # With multi-table inheritance every table in the chain gets a pk
+        return {model._meta.pk.attname for model in [instance._meta.model] + instance._meta.get_parent_list()}
+
+    def save(self, instance, save_func, *args, **kwargs):
+        """
+        Assign an identifier to instance and save it with save_func (usually
+        the model's ``super().save``), retrying with a new identifier if it
+        was taken in the meantime.
+        """
+        pk_attnames = self.get_pk_attnames(instance)
+        pk_values = {attname: getattr(instance, attname) for attname in pk_attnames}
+        using = kwargs.get('using') or router.db_for_write(type(instance), instance=instance)
+
+        for attempt in range(self.max_attempts):
+            identifier = self.generate()
+            setattr(instance, self.field_name, identifier)
+
+            try:
+                with transaction.atomic(using=using):
+                    return save_func(*args, **kwargs)
+            except IntegrityError:
+                for attname, value in pk_values.items():
+                    setattr(instance, attname, value)
+
+                if attempt + 1 == self.max_attempts or not self.is_taken(identifier):
+                    setattr(instance, self.field_name, '')
+                    raise
+
+    def assign(self, instances):
+        """
+        Assign identifiers to the instances that don't have one yet, using
+        a single query. Returns the instances that were assigned.
+        """
+        pending = [instance for instance in instances if not getattr(instance, self.field_name)]
+
+        for instance, identifier in zip(pending, self.allocate(len(pending))):
+            setattr(instance, self.field_name, identifier)
+
+        return pending
+
+    def bulk_create(self, instances, create_func=None, **kwargs):
+        """
+        Assign identifiers to instances and insert them with create_func
+        (``bulk_create`` on the default manager unless given), drawing new
+        identifiers for them if a concurrent insert took one.
+        """
+        instances = list(instances)
+        create_func = create_func or self.model._default_manager.bulk_create
+        using = router.db_for_write(self.model)
+
+        pending = self.assign(instances)
+
+        for attempt in range(self.max_attempts):
+            try:
+                with transaction.atomic(using=using):
+                    return create_func(instances, **kwargs)
+            except IntegrityError:
+                identifiers = [getattr(instance, self.field_name) for instance in pending]
+
+                if attempt + 1 == self.max_attempts or not self.model._default_manager.filter(**{
+                        '{}__in'.format(self.field_name): identifiers}).exists():
+                    raise
+
+                for instance in pending:
+                    setattr(instance, self.field_name, '')
+
+                self.assign(pending)
+
+
+def get_identifier_allocator(model, setting_name, alphabet=None):
+    """
+    Return an instance of the allocator class configured in setting_name,
+    defaulting to ``IdentifierAllocator``.
+    """
+    allocator_class = getattr(settings, setting_name, 'wagtailcommerce.utils.identifiers.IdentifierAllocator')
+
+    if isinstance(allocator_class, str):
+        allocator_class = import_string(allocator_class)
+
+    return allocator_class(model, alphabet=alphabet)
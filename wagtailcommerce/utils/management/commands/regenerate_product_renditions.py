@@ -1,26 +1,64 @@
-from django.conf import settings
+import datetime
 
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
-if getattr(settings, 'WAGTAILCOMMERCE_ASYNC_THUMBNAILS', False):
-    from django.core.management.base import BaseCommand
+from wagtailcommerce.products.renditions import get_rendition_jobs, run_rendition_jobs
+from wagtailcommerce.stores.models import Store
 
-    class Command(BaseCommand):
-        help = 'Regenerates product image renditions'
 
-        def handle(self, *args, **options):
-            question = 'Are you sure you want to regenerate all product thumbnails?\n'
-            result = input("%s " % question)
+class Command(BaseCommand):
+    help = 'Generates missing product image renditions'
 
-            if not result:
-                return
-            while len(result) < 1 or result[0].lower() not in "yn":
-                result = input("Please answer yes or no: ")
+    def add_arguments(self, parser):
+        parser.add_argument('--store', type=int, help='Only products of the store with this primary key')
+        parser.add_argument(
+            '--since',
+            help='Only images added or products modified since this date (YYYY-MM-DD or ISO 8601 date and time)')
+        parser.add_argument('--workers', type=int, default=1, help='Number of processes generating renditions')
+        parser.add_argument('--chunk-size', type=int, default=100, help='Renditions handed to a worker at a time')
+        parser.add_argument(
+            '--checkpoint',
+            help='File to save progress to, an interrupted run started with the same file resumes from it')
 
-            if result[0].lower() == "y":
-                self.stdout.write(self.style.SUCCESS('Regenerating thumbnails\n'))
+    def handle(self, *args, **options):
+        store = None
 
-                from wagtailcommerce.products.models import Image
-                from wagtailcommerce.products.images import generate_renditions
+        if options['store']:
+            try:
+                store = Store.objects.get(pk=options['store'])
+            except Store.DoesNotExist:
+                raise CommandError('Store {} not found'.format(options['store']))
 
-                for image in Image.objects.all():
-                    generate_renditions.delay(image)
+        since = None
+
+        if options['since']:
+            since = parse_datetime(options['since'])
+
+            if since is None:
+                since_date = parse_date(options['since'])
+
+                if since_date is None:
+                    raise CommandError('Invalid date "{}"'.format(options['since']))
+
+                since = datetime.datetime.combine(since_date, datetime.time.min)
+
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+
+        jobs = get_rendition_jobs(store=store, since=since)
+        self.stdout.write('{} renditions to check'.format(len(jobs)))
+
+        totals = {'generated': 0, 'skipped': 0, 'failed': 0}
+
+        for chunk, counts in run_rendition_jobs(
+                jobs, workers=options['workers'], chunk_size=options['chunk_size'], checkpoint=options['checkpoint']):
+            for key, count in counts.items():
+                totals[key] += count
+
+            self.stdout.write('Up to image {}: {} generated, {} skipped, {} failed'.format(
+                chunk[-1][0], totals['generated'], totals['skipped'], totals['failed']))
+
+        self.stdout.write(self.style.SUCCESS('{} renditions generated, {} skipped, {} failed'.format(
+            totals['generated'], totals['skipped'], totals['failed'])))
@@ -0,0 +1,129 @@
+from __future__ import absolute_import, unicode_literals
+
+import base64
+import json
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(values):
+    """
+    Encode the ordering values of a row (booleans, numbers, datetimes) as an opaque cursor.
+    """
+    values = [
+        value.isoformat() if hasattr(value, 'isoformat') else str(value) if isinstance(value, Decimal) else value
+        for value in values
+    ]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, length, datetime_positions=()):
+    """
+    Decode a cursor of length ordering values, or raise InvalidCursor if it isn't one.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor(cursor)
+
+    if not all(isinstance(value, (bool, int, float, str)) for value in values):
+        raise InvalidCursor(cursor)
+
+    for position in datetime_positions:
+        try:
+            values[position] = parse_datetime(values[position])
+        except (ValueError, TypeError):
+            raise InvalidCursor(cursor)
+
+        if values[position] is None:
+            raise InvalidCursor(cursor)
+
+    return values
+
+
+def keyset_page(queryset, fields, first, after=None, descending=True):
+    """
+    Return (objects, end_cursor, has_next_page) for the first objects of
+    queryset after the cursor ``after``, ordered on fields (concrete field
+    names ending with a unique one, e.g. ``['featured', 'created', 'id']``),
+    all descending or all ascending. Rows with nulls in fields are skipped
+    by the comparison, so fields should be non-null.
+
+    Pages are found with a row comparison on fields, so with a matching
+    index every page costs the same as the first one.
+    """
+    model = queryset.model
+    connection = connections[queryset.db]
+    qn = connection.ops.quote_name
+
+    model_fields = [model._meta.get_field(name) for name in fields]
+    queryset = queryset.order_by(*['{}{}'.format('-' if descending else '', name) for name in fields])
+
+    if after:
+        values = decode_cursor(after, len(fields), [
+            i for i, field in enumerate(model_fields) if field.get_internal_type() == 'DateTimeField'
+        ])
+
+        try:
+            params = [
+                field.get_db_prep_value(field.to_python(value), connection)
+                for field, value in zip(model_fields, values)
+            ]
+        except ValidationError:
+            raise InvalidCursor(after)
+
+        columns = ', '.join(
+            '{}.{}'.format(qn(field.model._meta.db_table), qn(field.column)) for field in model_fields)
+
+        queryset = queryset.extra(
+            where=['({}) {} ({})'.format(columns, '<' if descending else '>', ', '.join(['%s'] * len(fields)))],
+            params=params
+        )
+
+    objects = list(queryset[:first + 1])
+    has_next_page = len(objects) > first
+    objects = objects[:first]
+
+    end_cursor = encode_cursor([getattr(objects[-1], field.attname) for field in model_fields]) if objects else None
+
+    return objects, end_cursor, has_next_page
+
+
+def estimate_count(queryset):
+    """
+    Count queryset's rows exactly if the query planner expects at most
+    WAGTAILCOMMERCE_EXACT_COUNT_THRESHOLD of them, or return the planner's
+    estimate otherwise. Only PostgreSQL provides estimates.
+    """
+    queryset = queryset.order_by().values('pk')
+    connection = connections[queryset.db]
+
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    sql, params = queryset.query.sql_with_params()
+
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) {}'.format(sql), params)
+        plan = cursor.fetchone()[0]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    estimate = plan[0]['Plan']['Plan Rows']
+
+    if estimate <= getattr(settings, 'WAGTAILCOMMERCE_EXACT_COUNT_THRESHOLD', 1000):
+        return queryset.count()
+
+    return estimate
@@ -1,38 +1,244 @@
 from collections import defaultdict
+from itertools import islice
 
 from django.contrib.contenttypes.models import ContentType
-from django.db.models.query import BaseIterable
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import prefetch_related_objects
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.query import BaseIterable, ModelIterable
 
 
-def specific_iterator(qs):
+def get_specific_objects(model, pks_and_types):
     """
-    This efficiently iterates all the specific pages in a queryset, using
-    the minimum number of queries.
-    This should be called from ``PageQuerySet.specific``
+    Return a dict mapping pks to their most specific instances, given
+    (pk, content type id) pairs. Runs one query per content type.
     """
-    pks_and_types = qs.values_list('pk', 'content_type')
     pks_by_type = defaultdict(list)
     for pk, content_type in pks_and_types:
         pks_by_type[content_type].append(pk)
 
-    # Content types are cached by ID, so this will not run any queries.
-    content_types = {pk: ContentType.objects.get_for_id(pk)
-                     for _, pk in pks_and_types}
-
-    # Get the specific instances of all pages, one model class at a time.
-    objects_by_type = {}
+    objects = {}
     for content_type, pks in pks_by_type.items():
         # look up model class for this content type, falling back on the original
-        # model (i.e. Page) if the more specific one is missing
-        model = content_types[content_type].model_class() or qs.model
-        objects = model.objects.filter(pk__in=pks)
-        objects_by_type[content_type] = {obj.pk: obj for obj in objects}
+        # model (i.e. Page) if the more specific one is missing.
+        # Content types are cached by ID, so this will not run any queries.
+        specific_model = ContentType.objects.get_for_id(content_type).model_class() or model
+        objects.update({obj.pk: obj for obj in specific_model.objects.filter(pk__in=pks)})
 
-    # Yield all of the pages, in the order they occurred in the original query.
-    for pk, content_type in pks_and_types:
-        yield objects_by_type[content_type][pk]
+    return objects
+
+
+def specific_iterator(qs, chunk_size=None):
+    """
+    This efficiently iterates all the specific pages in a queryset, using
+    the minimum number of queries.
+    This should be called from ``PageQuerySet.specific``
+
+    If chunk_size is given, (pk, content type) pairs are streamed from the
+    database (through a server-side cursor where supported) and resolved
+    chunk_size rows at a time, so memory use doesn't grow with the queryset.
+    """
+    if chunk_size is None:
+        pks_and_types = list(qs.values_list('pk', 'content_type'))
+        chunks = [pks_and_types]
+    else:
+        pks_and_types = qs.values_list('pk', 'content_type').iterator(chunk_size=chunk_size)
+        chunks = iter(lambda: list(islice(pks_and_types, chunk_size)), [])
+
+    for chunk in chunks:
+        objects = get_specific_objects(qs.model, chunk)
+
+        # Yield all of the pages, in the order they occurred in the original query.
+        for pk, content_type in chunk:
+            yield objects[pk]
 
 
 class SpecificIterable(BaseIterable):
     def __iter__(self):
+        # Stream in chunks when the queryset is walked with .iterator()
+        if self.chunked_fetch:
+            return specific_iterator(self.queryset, chunk_size=self.chunk_size)
+
         return specific_iterator(self.queryset)
+
+
+def get_related_objects(instances, lookup):
+    """
+    Follow a relation lookup such as 'variant__product' from instances,
+    returning the non-null objects found at its end.
+    """
+    objects = instances
+
+    for attname in lookup.split(LOOKUP_SEP):
+        objects = [getattr(obj, attname) for obj in objects]
+        objects = [obj for obj in objects if obj is not None]
+
+    return objects
+
+
+def attach_specific(objects):
+    """
+    Populate the ``specific`` cached property of objects with one query per
+    concrete content type. Relations already loaded on an object are copied
+    to its specific instance, so they don't get queried again.
+    """
+    pending = []
+
+    for obj in objects:
+        if 'specific' in obj.__dict__:
+            continue
+
+        model_class = ContentType.objects.get_for_id(obj.content_type_id).model_class()
+
+        if model_class is None or isinstance(obj, model_class):
+            obj.__dict__['specific'] = obj
+        else:
+            pending.append(obj)
+
+    if not pending:
+        return
+
+    specific_objects = get_specific_objects(
+        type(pending[0]), [(obj.pk, obj.content_type_id) for obj in pending])
+
+    for obj in pending:
+        specific = specific_objects.get(obj.pk)
+
+        if specific is None:
+            # Deleted in the meantime, behave like the cached property would
+            continue
+
+        for cache_name, value in obj._state.fields_cache.items():
+            specific._state.fields_cache.setdefault(cache_name, value)
+
+        obj.__dict__['specific'] = specific
+
+
+def prefetch_specific(instances, *lookups):
+    """
+    Resolve the most specific form of the objects related to instances through
+    each lookup (e.g. ``prefetch_specific(lines, 'variant', 'variant__product')``),
+    with one query per concrete content type, and store them as those objects'
+    ``specific``.
+
+    Relations along the lookups that aren't loaded yet are fetched with
+    ``prefetch_related_objects``.
+    """
+    instances = list(instances)
+    lookups = sorted(lookups, key=lambda lookup: lookup.count(LOOKUP_SEP))
+
+    for lookup in lookups:
+        prefetch_related_objects(instances, lookup)
+
+    # Deepest first, so specific instances inherit already resolved relations
+    for lookup in reversed(lookups):
+        attach_specific(get_related_objects(instances, lookup))
+
+    return instances
+
+
+class PrefetchSpecificMixin(object):
+    """
+    QuerySet mixin adding ``prefetch_specific()``, which applies
+    ``prefetch_specific`` to the results once they're fetched.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._prefetch_specific_lookups = ()
+
+    def prefetch_specific(self, *lookups):
+        clone = self._chain()
+        clone._prefetch_specific_lookups = clone._prefetch_specific_lookups + lookups
+        return clone
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._prefetch_specific_lookups = self._prefetch_specific_lookups
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is not None
+
+        super()._fetch_all()
+
+        if not fetched and self._prefetch_specific_lookups:
+            prefetch_specific(
+                [obj for obj in self._result_cache if isinstance(obj, self.model)],
+                *self._prefetch_specific_lookups
+            )
+
+
+def get_specific_accessors(model, model_classes):
+    """
+    Return a dict mapping each concrete subclass of model in model_classes to
+    the reverse one-to-one accessors leading to it from model, following the
+    multi-table inheritance parent links (e.g. ``{Shoe: ['shoe']}``).
+    """
+    accessors = {}
+
+    for model_class in model_classes:
+        if model_class is model or model_class._meta.proxy or not issubclass(model_class, model):
+            continue
+
+        path = []
+        child = model_class
+
+        while child is not model:
+            parent, parent_link = next(
+                (parent, parent_link) for parent, parent_link in child._meta.parents.items()
+                if issubclass(parent, model)
+            )
+            path.insert(0, parent_link.remote_field.get_accessor_name())
+            child = parent
+
+        accessors[model_class] = path
+
+    return accessors
+
+
+class SelectSpecificIterable(ModelIterable):
+    """
+    Yield the most specific instance of every row, reading it from the child
+    tables joined in by ``select_specific()``.
+    """
+    def __iter__(self):
+        accessors = get_specific_accessors(
+            self.queryset.model, self.queryset.get_specific_model_classes())
+
+        for obj in super().__iter__():
+            model_class = ContentType.objects.get_for_id(obj.content_type_id).model_class()
+            specific = obj
+
+            try:
+                for accessor in accessors.get(model_class, ()):
+                    specific = getattr(specific, accessor)
+            except ObjectDoesNotExist:
+                # Missing child row, fall back on the base instance
+                specific = obj
+
+            specific.__dict__['specific'] = specific
+            yield specific
+
+
+class SelectSpecificMixin(object):
+    """
+    QuerySet mixin adding ``select_specific()``, which joins the tables of
+    every registered subclass into the query, so specific instances are
+    built from a single query.
+
+    Subclasses implement ``get_specific_model_classes()``, returning the
+    model class registry (e.g. ``PRODUCT_MODEL_CLASSES``).
+    """
+    def get_specific_model_classes(self):
+        raise NotImplementedError
+
+    def select_specific(self):
+        paths = [
+            LOOKUP_SEP.join(path)
+            for path in get_specific_accessors(self.model, self.get_specific_model_classes()).values()
+        ]
+
+        # select_related() with no arguments would follow every foreign key
+        clone = self.select_related(*paths) if paths else self._chain()
+        clone._iterable_class = SelectSpecificIterable
+        return clone